@@ -1,17 +1,45 @@
-# This Carbon Black package initializer sets up host locking and removes old host lock files.
+# This Carbon Black package initializer sets up host locking, removes stale host lock files, resumes interrupted jobs, and removes stale transfer checkpoints.
 # File: __init__.py
-# Date: 04/28/2019 - Modified: 06/25/2019
+# Date: 04/28/2019 - Modified: 10/18/2026
 # Author: Jared F
 
-import os
 import logging
+import datetime
+import carbon_black.util.host_queue as host_queue
+import carbon_black.util.transfer as transfer
+import carbon_black.util.job_journal as job_journal
+import carbon_black.util.parking as parking
 log = logging.getLogger(__name__)  # Establish logging
 
-if os.path.exists('/home/integrations/.resilient/cb_host_locks'):
-	lock_file_list = [f for f in os.listdir('/home/integrations/.resilient/cb_host_locks') if f.endswith(".lock")]
-	for lock_file in lock_file_list:
-		os.remove(os.path.join('/home/integrations/.resilient/cb_host_locks', lock_file))
-		log.info("[INFO] carbon_black's __init__ script has removed: " + str(lock_file))
+# Only locks whose owning process died or whose lease expired are removed, locks held by running processes are kept
+for lock_file in host_queue.reclaim_stale_locks():
+	log.info("[INFO] carbon_black's __init__ script has removed: " + str(lock_file))
 
-else:
-	os.makedirs('/home/integrations/.resilient/cb_host_locks')
+# Jobs a restart interrupted have their orphaned live response sessions closed, then resume from the phase the job journal
+# recorded. Jobs that already delivered their results are not rerun. Jobs that never checked out a session never reached
+# the endpoint and are parked to run once their host is online, as are read only jobs, whose reruns continue the transfers
+# their journaled checkpoints hold. Other jobs may have acted on the endpoint, they are not safe to repeat and are only logged.
+interrupted_jobs = job_journal.interrupted_jobs()
+if [job for job in interrupted_jobs if job["sessions"]]:
+	try:
+		from cbapi.response import CbEnterpriseResponseAPI
+		cb = CbEnterpriseResponseAPI()  # CB Response API
+		for job in interrupted_jobs:
+			for session_id in job_journal.close_orphaned_sessions(cb, job):
+				log.info("[INFO] carbon_black's __init__ script has closed orphaned Session #" + str(session_id) + " of interrupted job " + job["job_id"])
+	except Exception as err:
+		log.error("[ERROR] carbon_black's __init__ script could not close orphaned sessions: " + str(err))
+for job in interrupted_jobs:
+	if job_journal.DELIVERED_PHASE in job["completed_phases"]:
+		log.info("[INFO] carbon_black's __init__ script found interrupted " + job["function"] + " job " + job["job_id"] + " on " + job["hostname"] + " already delivered its results, it is not rerun")
+	elif job["sessions"] and job["function"] not in job_journal.RERUNNABLE_FUNCTIONS:
+		log.warning("[WARNING] carbon_black's __init__ script found interrupted " + job["function"] + " job " + job["job_id"] + " on " + job["hostname"] + " for incident " + str(job["incident_id"]) + ", it is not safe to repeat and is not rerun, rerun it from the incident if still needed")
+	elif datetime.datetime.fromtimestamp(job["deadline"]) <= datetime.datetime.now():
+		log.info("[INFO] carbon_black's __init__ script found interrupted " + job["function"] + " job " + job["job_id"] + " on " + job["hostname"] + " past its deadline, it is not rerun")
+	else:
+		parking.park(job["function"], job["incident_id"], job["hostname"], job["inputs"], datetime.datetime.fromtimestamp(job["deadline"]), job)
+		log.info("[INFO] carbon_black's __init__ script has parked interrupted " + job["function"] + " job " + job["job_id"] + " on " + job["hostname"] + " to resume " + ("after its " + job["phase"] + " phase" if job["phase"] else "from the start"))
+
+# Checkpoints of resumable file retrievals abandoned for longer than transfer.CHECKPOINT_TTL are removed, those of parked jobs are kept for their reruns
+for checkpoint in transfer.reclaim_stale_checkpoints(keep=parking.checkpoints()):
+	log.info("[INFO] carbon_black's __init__ script has removed transfer checkpoint: " + str(checkpoint))
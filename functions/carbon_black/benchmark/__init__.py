@@ -0,0 +1,4 @@
+# This Carbon Black benchmark package initializer exposes the local CB stand-in and the function benchmarks.
+# File: __init__.py
+# Date: 10/18/2026
+# Author: Jared F
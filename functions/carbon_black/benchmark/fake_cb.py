@@ -0,0 +1,507 @@
+# -*- coding: utf-8 -*-
+
+# This utility stands in for a Carbon Black Response server and its endpoints so the functions can be measured locally.
+# File: fake_cb.py
+# Date: 10/18/2026
+# Author: Jared F
+
+"""Local Carbon Black Response stand-in"""
+#   Usage from a benchmark:
+#       server = fake_cb.FakeCbServer(fake_cb.PROFILES['wan'], hosts=4)  # Scripted latency, bandwidth, timeout and offline behavior
+#       fake_cb.install(server)  # Every CbEnterpriseResponseAPI() created afterwards, and already imported functions' cb, talks to server
+#       server.endpoint(1).add_directory(r'C:\Users\Public\Evidence', files=50, file_size=256*1024)  # Files served to live response
+#       server.reset(fake_cb.PROFILES['satellite'])  # Next run: new profile and empty endpoints, same sensors
+#   The server answers Sensor and SensorGroup queries and live response sessions: list_processes, list_directory, walk,
+#   get_file and ranged gets, put_file, delete_file and create_process. create_process understands the commands the
+#   functions run: report commands write a report file, certutil and the evidence_store script hash files, and the
+#   endpoint_archive script builds a real ZIP archive. Commands wait out the profile's latency, transfers share each
+#   sensor's bandwidth, and timeouts are raised after the latency instead of after the command's full timeout.
+
+import io
+import re
+import zlib
+import time
+import base64
+import random
+import zipfile
+import hashlib
+import datetime
+import threading
+from cbapi.errors import TimeoutError
+
+REPORTS_DIRECTORY = r'C:\Windows\CarbonBlack\Reports'  # Endpoint directory the functions stage their reports in
+
+
+class Profile(object):
+    """ Network and sensor behavior of a simulated CB deployment """
+    def __init__(self, name, latency, bandwidth, session_setup=1.0, process_time=0.5, timeout_rate=0.0, offline_for=0,
+                 can_compress=True, upload_bandwidth=20*1000000):
+        self.name = name
+        self.latency = latency  # Seconds each live response command waits for the sensor's next check-in
+        self.bandwidth = bandwidth  # Bytes per second between each sensor and the integration server, shared by that sensor's transfers
+        self.session_setup = session_setup  # Seconds to establish a live response session
+        self.process_time = process_time  # Seconds a command started with create_process runs on the endpoint
+        self.timeout_rate = timeout_rate  # Chance that a command or transfer raises TimeoutError
+        self.offline_for = offline_for  # Seconds every sensor stays offline after the server starts
+        self.can_compress = can_compress  # Whether endpoints can run the endpoint_archive script
+        self.upload_bandwidth = upload_bandwidth  # Bytes per second of attachment uploads to Resilient
+
+
+PROFILES = {
+    'lan': Profile('lan', latency=0.05, bandwidth=20*1000000),
+    'wan': Profile('wan', latency=0.5, bandwidth=1000000),
+    'satellite': Profile('satellite', latency=2.0, bandwidth=100000, session_setup=5.0),
+    'flaky': Profile('flaky', latency=0.5, bandwidth=1000000, timeout_rate=0.05),
+    'offline': Profile('offline', latency=0.5, bandwidth=1000000, offline_for=15),
+    'legacy': Profile('legacy', latency=0.5, bandwidth=1000000, can_compress=False),  # Windows 7 without .NET 4.5
+}
+
+
+def log_bytes(size, seed=0):
+    """
+    Log-like text that compresses about as well as real sensor and event logs
+    :param size: bytes to generate
+    :param seed: varies the content
+    :return: bytes
+    """
+    rng = random.Random(seed)
+    lines = []
+    length = 0
+    while length < size:
+        line = u'2026-10-18 {0:02d}:{1:02d}:{2:02d} [{3}] pid={4} event={5} status=0x{6:08x} path=C:\\Windows\\System32\\{7}.dll\r\n'.format(
+            rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59), rng.choice(['INFO', 'INFO', 'INFO', 'WARN', 'ERROR']),
+            rng.randint(4, 65535), rng.randint(1000, 9999), rng.randint(0, 2**32 - 1), rng.choice(['kernel32', 'ntdll', 'advapi32', 'user32', 'crypt32']))
+        lines.append(line)
+        length += len(line)
+    return u''.join(lines).encode('ascii')[:size]
+
+
+class FakeEndpoint(object):
+    """ File system and process list of one simulated endpoint """
+    def __init__(self, seed=0):
+        self.files = {}  # Endpoint path -> bytes
+        self.modified = {}  # Endpoint path -> last write time
+        self.locked = set()  # Paths the endpoint_archive script cannot open, ie held exclusively
+        self.report_size = 64*1024  # Bytes of every report a command writes
+        self.seed = seed
+        self._lock = threading.Lock()
+
+    def write(self, path, data):
+        with self._lock:
+            self.files[path] = data
+            self.modified[path] = int(time.time())
+
+    def add_file(self, path, size):
+        self.write(path, log_bytes(size, zlib.crc32(path.encode('utf-8')) ^ self.seed))
+
+    def add_directory(self, top, files, file_size, depth=2):
+        """
+        Fill a directory tree with log files
+        :param top: endpoint directory path
+        :param files: number of files
+        :param file_size: bytes per file
+        :param depth: subdirectory levels the files are spread over
+        :return:
+        """
+        for index in range(files):
+            subdirectory = '\\'.join('dir{0}'.format((index // (3 ** level)) % 3) for level in range(index % (depth + 1)))
+            self.add_file(top + ('\\' + subdirectory if subdirectory else '') + '\\file{0}.log'.format(index), file_size)
+
+    def listing(self, path):
+        if path in self.files:
+            return {'filename': path.rsplit('\\', 1)[-1], 'size': len(self.files[path]), 'attributes': ['ARCHIVE'],
+                    'last_write_time': self.modified[path], 'create_time': self.modified[path]}
+        return {'filename': path.rstrip('\\').rsplit('\\', 1)[-1], 'size': 0, 'attributes': ['DIRECTORY'], 'last_write_time': 0, 'create_time': 0}
+
+    def is_directory(self, path):
+        prefix = path.rstrip('\\').lower() + '\\'
+        return any(each_path.lower().startswith(prefix) for each_path in self.files)
+
+    def children(self, directory):
+        """
+        Immediate subdirectory names and file paths of a directory
+        :param directory: endpoint directory path
+        :return: (list of subdirectory names, list of file paths)
+        """
+        prefix = directory.rstrip('\\').lower() + '\\'
+        subdirectories, files = set(), []
+        with self._lock:
+            for each_path in self.files:
+                if each_path.lower().startswith(prefix):
+                    rest = each_path[len(prefix):]
+                    if '\\' in rest: subdirectories.add(rest.split('\\', 1)[0])
+                    else: files.append(each_path)
+        return sorted(subdirectories), sorted(files)
+
+
+class FakeSensor(object):
+    """ Sensor model object, status follows the profile's offline period """
+    def __init__(self, server, sensor_id, hostname, group_id=1):
+        self._server = server
+        self.id = sensor_id
+        self.hostname = hostname
+        self.computer_name = hostname
+        self.group_id = group_id
+        self.os_environment_display_string = 'Windows 10 Enterprise, 64-bit'
+        self.network_isolation_enabled = False
+        self.is_isolating = False
+        self.restart_queued = False
+
+    @property
+    def status(self):
+        return 'Online' if time.time() >= self._server.online_at else 'Offline'
+
+    @property
+    def last_checkin_time(self):
+        return datetime.datetime.utcfromtimestamp(min(time.time(), max(self._server.started, self._server.online_at)))
+
+    def restart_sensor(self):
+        self._server.count('restarts')
+
+
+class FakeSensorGroup(object):
+    def __init__(self, group_id, name):
+        self.id = group_id
+        self.name = name
+
+
+class FakeQuery(list):
+    """ Result of cb.select(), where() filters like the CB sensor API does """
+    def where(self, query):
+        field, value = query.split(':', 1)
+        if field == 'hostname':
+            return FakeQuery(each for each in self if each.hostname.upper().startswith(value.upper()))
+        if field == 'groupid':
+            return FakeQuery(each for each in self if str(each.group_id) == value)
+        return self
+
+
+class _Response(object):
+    def __init__(self, payload=None, raw=None):
+        self._payload = payload
+        self.raw = raw
+        self.status_code = 200
+
+    def close(self):
+        pass
+
+    def json(self):
+        return self._payload
+
+
+class FakeHttpSession(object):
+    """ The requests session of the API, serves ranged get file content """
+    def __init__(self, server):
+        self._server = server
+
+    def get(self, url, stream=False):
+        return _Response(raw=io.BytesIO(self._server.blobs.pop(int(url.rsplit('/', 2)[1]))))
+
+
+class FakeLiveResponseSession(object):
+    """ Live response session to one simulated endpoint """
+    cblr_base = '/api/v1/cblr'
+
+    def __init__(self, server, session_id, sensor_id):
+        self._server = server
+        self.session_id = session_id
+        self.sensor_id = sensor_id
+
+    @property
+    def endpoint(self):
+        return self._server.endpoint(self.sensor_id)
+
+    @property
+    def _cb(self):
+        return self._server.client()
+
+    def _command(self, transfer_size=0):
+        """
+        Wait out one command: the sensor's check-in latency, then the transfer over the sensor's shared link
+        :param transfer_size: bytes moved by the command
+        :return:
+        :raises TimeoutError per the profile's timeout rate
+        """
+        self._server.count('commands')
+        time.sleep(self._server.profile.latency)
+        if self._server.chance(self._server.profile.timeout_rate):
+            self._server.count('timeouts')
+            raise TimeoutError(message='Simulated timeout on CB Sensor #' + str(self.sensor_id))
+        if transfer_size:
+            self._server.transfer(self.sensor_id, transfer_size)
+
+    def close(self):
+        self._server.count('sessions_closed')
+
+    def list_drives(self):
+        self._command()
+        return ['C:\\']
+
+    def list_processes(self):
+        self._command(200*200)
+        return [{'path': 'c:\\windows\\system32\\svchost.exe', 'command_line': 'svchost.exe -k netsvcs', 'username': 'NT AUTHORITY\\SYSTEM',
+                 'pid': 1000 + index, 'sid': 'S-1-5-18', 'parent': 4, 'create_time': 1792300000, 'proc_guid': '00000001-0000-0000-0000-{0:012d}'.format(index)}
+                for index in range(200)]
+
+    def create_directory(self, path):
+        self._command()
+        if self.endpoint.is_directory(path):
+            raise Exception('Directory exists')
+
+    def delete_file(self, path):
+        self._command()
+        with self.endpoint._lock:
+            self.endpoint.files.pop(path, None)
+
+    def put_file(self, infp, path):
+        data = infp.read()
+        self._command(len(data))
+        self.endpoint.write(path, data)
+
+    def list_directory(self, path):
+        self._command()
+        if path.endswith('\\'):
+            subdirectories, files = self.endpoint.children(path)
+            listing = [self.endpoint.listing('.'), self.endpoint.listing('..')]
+            listing += [self.endpoint.listing(path.rstrip('\\') + '\\' + name + '\\') for name in subdirectories]
+            return listing + [self.endpoint.listing(each_file) for each_file in files]
+        if path.endswith('*'):
+            directory, pattern = path.rsplit('\\', 1)
+            pattern = re.compile('^' + re.escape(pattern).replace('\\*', '.*') + '$', re.IGNORECASE)
+            return [self.endpoint.listing(each_file) for each_file in self.endpoint.children(directory)[1] if pattern.match(each_file.rsplit('\\', 1)[1])]
+        if path in self.endpoint.files or self.endpoint.is_directory(path):
+            return [self.endpoint.listing(path)]
+        raise Exception('Error: The system cannot find the file specified.')
+
+    def walk(self, top, topdown=True, onerror=None, followlinks=False):
+        self._command()
+        subdirectories, files = self.endpoint.children(top)
+        yield top, subdirectories, [each_file.rsplit('\\', 1)[1] for each_file in files]
+        for name in subdirectories:
+            for each in self.walk(top.rstrip('\\') + '\\' + name, topdown, onerror, followlinks):
+                yield each
+
+    def _read(self, path):
+        try:
+            return self.endpoint.files[path]
+        except KeyError:
+            raise Exception('Error: The system cannot find the file specified.')
+
+    def get_file(self, file_name, timeout=None, delay=None):
+        data = self._read(file_name)
+        self._command(len(data))
+        return data
+
+    def get_raw_file(self, file_name, timeout=None, delay=None):
+        return io.BytesIO(self.get_file(file_name, timeout, delay))
+
+    def _lr_post_command(self, data):
+        content = self._read(data['object'])
+        offset = data.get('offset', 0)
+        content = content[offset:offset + data['get_count']] if data.get('get_count') else content[offset:]
+        self._command(len(content))
+        return _Response({'id': 0, 'file_id': self._server.add_blob(content)})
+
+    def _poll_command(self, command_id, **kwargs):
+        return {}
+
+    def create_process(self, command_string, wait_for_output=True, remote_output_file_name=None, working_directory=None,
+                       wait_timeout=30, wait_for_completion=True):
+        self._command()
+        if wait_for_completion and self._server.profile.process_time:
+            time.sleep(self._server.profile.process_time)
+
+        if '-EncodedCommand ' in command_string:
+            script = base64.b64decode(command_string.split('-EncodedCommand ', 1)[1].split()[0]).decode('utf-16-le')
+            file_list = re.search(r"ReadAllLines\('([^']+)'\)", script).group(1)
+            lines = [line for line in self._read(file_list).decode('utf-8').split('\r\n') if line]
+            if 'HASHED' in script:  # evidence_store.HASH_SCRIPT
+                output = [hashlib.sha256(self.endpoint.files[path]).hexdigest().upper() + '|' + path for path in lines if path in self.endpoint.files]
+                return self._output(output + ['HASHED'])
+            if 'ARCHIVED' in script:  # endpoint_archive.ARCHIVE_SCRIPT
+                if not self._server.profile.can_compress:
+                    return self._output(['Add-Type : Cannot add type. The assembly System.IO.Compression could not be found.'])
+                archive = re.search(r"ZipFile\]::Open\('([^']+)'", script).group(1)
+                buffer, output = io.BytesIO(), []
+                with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+                    for line in lines:
+                        path, name = line.split('|', 1)
+                        if path in self.endpoint.locked or path not in self.endpoint.files: output.append('SKIPPED|' + path)
+                        else: zip_file.writestr(name, self.endpoint.files[path])
+                self.endpoint.write(archive, buffer.getvalue())
+                return self._output(output + ['ARCHIVED'])
+            return self._output([])
+
+        if command_string.lower().startswith('certutil.exe -hashfile'):
+            path = command_string.split('"')[1]
+            if path not in self.endpoint.files:
+                return self._output(['CertUtil: -hashfile command FAILED: 0x80070002 (WIN32: 2 ERROR_FILE_NOT_FOUND)'])
+            digest = hashlib.sha256(self.endpoint.files[path]).hexdigest()
+            return self._output(['SHA256 hash of ' + path + ':', digest, 'CertUtil: -hashfile command completed successfully.'])
+
+        deleted, reports = [], set()
+        for part in command_string.split(' & '):  # collectors.collect_many() chains del, the report command and its marker
+            if re.match(r'(cmd\.exe /c )?del ', part, re.IGNORECASE):
+                deleted += re.findall(r'"([^"]+)"', part)
+            else:
+                reports.update(re.findall(r'(' + re.escape(REPORTS_DIRECTORY) + r'\\[\w.-]+\.(?:csv|txt|html|done))', part, re.IGNORECASE))
+        with self.endpoint._lock:
+            for path in deleted:
+                self.endpoint.files.pop(path, None)
+
+        def finish():
+            for report in sorted(reports, key=lambda report: report.endswith('.done')):  # A collectors.DONE_SUFFIX marker is written last
+                self.endpoint.write(report, b'' if report.endswith('.done') else log_bytes(self.endpoint.report_size, zlib.crc32(report.encode('utf-8'))))
+
+        if wait_for_completion:
+            finish()
+        else:  # Started without waiting, the command runs on the endpoint for the profile's process time
+            timer = threading.Timer(self._server.profile.process_time, finish)
+            timer.daemon = True
+            timer.start()
+        return self._output([]) if wait_for_output else None
+
+    @staticmethod
+    def _output(lines):
+        return (u'\r\n'.join(lines) + u'\r\n').encode('utf-8')
+
+
+class FakeLiveResponse(object):
+    """ cb.live_response of the API """
+    def __init__(self, server):
+        self._server = server
+
+    def request_session(self, sensor_id):
+        sensor = self._server.sensor(sensor_id)
+        if sensor.status != 'Online':
+            raise TimeoutError(message='CB Sensor #' + str(sensor_id) + ' is offline')
+        self._server.count('sessions')
+        time.sleep(self._server.profile.session_setup)
+        return FakeLiveResponseSession(self._server, self._server.next_id(), sensor_id)
+
+
+class FakeCbEnterpriseResponseAPI(object):
+    """ Client of a FakeCbServer, used in place of cbapi's CbEnterpriseResponseAPI """
+    def __init__(self, server):
+        self._server = server
+        self.url = 'https://cb.benchmark.local'
+        self.live_response = FakeLiveResponse(server)
+        self.session = FakeHttpSession(server)
+
+    def select(self, cls, unique_id=None, *args, **kwargs):
+        self._server.count('queries')
+        time.sleep(self._server.profile.latency / 10.0)  # API calls are answered by the server, not the sensor
+        if cls.__name__ == 'SensorGroup':
+            return FakeQuery(self._server.groups)
+        if unique_id is not None:
+            return self._server.sensor(unique_id)
+        return FakeQuery(self._server.sensors)
+
+    def info(self):
+        return {'version': '6.3.0', 'benchmark': True}
+
+    def get_object(self, uri, query_parameters=None, default=None):
+        return {}
+
+
+class FakeRestClient(object):
+    """ Resilient rest client, attachment uploads take the profile's upload bandwidth """
+    def __init__(self, server):
+        self._server = server
+        self.attachments = []  # (uri, file name, bytes) of every posted attachment
+
+    def get(self, uri, *args, **kwargs):
+        return {'id': 1, 'name': 'Benchmark incident'}
+
+    def post_attachment(self, uri, filepath, filename=None, *args, **kwargs):
+        with open(filepath, 'rb') as f:
+            size = len(f.read())
+        time.sleep(size / float(self._server.profile.upload_bandwidth))
+        self.attachments.append((uri, filename, size))
+        return {'id': len(self.attachments)}
+
+
+class FakeCbServer(object):
+    """ State shared by every client of one simulated CB server """
+    def __init__(self, profile, hosts=1, seed=0):
+        self.groups = [FakeSensorGroup(1, 'Workstations'), FakeSensorGroup(2, 'Servers')]
+        self.sensors = [FakeSensor(self, index + 1, 'BENCH-HOST-{0:03d}'.format(index + 1), 1 if index % 4 else 2) for index in range(hosts)]
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._ids = 0
+        self.reset(profile)
+
+    def reset(self, profile):
+        """
+        Start over with a profile and empty endpoints, the sensors and their IDs are kept so cached sensor objects stay valid
+        :param profile: Profile
+        :return:
+        """
+        with self._lock:
+            self.profile = profile
+            self.started = time.time()
+            self.online_at = self.started + profile.offline_for
+            self.endpoints = dict((sensor.id, FakeEndpoint(self.seed + sensor.id)) for sensor in self.sensors)
+            self.blobs = {}  # Blob ID -> ranged get content waiting to be downloaded
+            self.counters = {}  # Name -> number of API calls, commands, bytes, ...
+            self._random = random.Random(self.seed)
+            self._links = {}  # Sensor ID -> time the sensor's link is busy until
+
+    def client(self):
+        return FakeCbEnterpriseResponseAPI(self)
+
+    def sensor(self, sensor_id):
+        for sensor in self.sensors:
+            if sensor.id == int(sensor_id):
+                return sensor
+        raise Exception('CB Sensor #' + str(sensor_id) + ' does not exist')
+
+    def endpoint(self, sensor_id):
+        return self.endpoints[int(sensor_id)]
+
+    def next_id(self):
+        with self._lock:
+            self._ids += 1
+            return self._ids
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def chance(self, probability):
+        with self._lock:
+            return self._random.random() < probability
+
+    def add_blob(self, content):
+        blob_id = self.next_id()
+        with self._lock:
+            self.blobs[blob_id] = content
+        return blob_id
+
+    def transfer(self, sensor_id, size):
+        """
+        Wait for size bytes to cross the sensor's link, concurrent transfers of a sensor queue behind each other
+        :param sensor_id: CB sensor ID
+        :param size: bytes
+        :return:
+        """
+        with self._lock:
+            start = max(time.time(), self._links.get(sensor_id, 0))
+            self._links[sensor_id] = start + size / float(self.profile.bandwidth)
+            done = self._links[sensor_id]
+        self.count('bytes', size)
+        time.sleep(max(0, done - time.time()))
+
+
+def install(server):
+    """
+    Point cbapi's CbEnterpriseResponseAPI, and the cb of every imported Carbon Black function, at a fake server
+    :param server: FakeCbServer
+    :return:
+    """
+    import sys
+    import cbapi.response
+    cbapi.response.CbEnterpriseResponseAPI = lambda *args, **kwargs: server.client()
+    for name, module in list(sys.modules.items()):
+        if name.startswith('carbon_black.cb_') and hasattr(module, 'cb'):
+            module.cb = server.client()
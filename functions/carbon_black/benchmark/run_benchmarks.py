@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+
+# This utility runs the Carbon Black functions against the local CB stand-in and reports their throughput, memory and latency.
+# File: run_benchmarks.py
+# Date: 10/18/2026
+# Author: Jared F
+
+"""Carbon Black function benchmarks"""
+#   Usage from the functions directory, with cbapi and resilient_circuits installed (no CB server or Resilient needed):
+#       python -m carbon_black.benchmark.run_benchmarks  # Run the default scenarios and print a report
+#       python -m carbon_black.benchmark.run_benchmarks --scenario directory_wan --scenario cb_logs_wan  # Run some scenarios
+#       python -m carbon_black.benchmark.run_benchmarks --output before.json  # Save the results as a baseline
+#       python -m carbon_black.benchmark.run_benchmarks --baseline before.json  # Exit 1 if a scenario regressed beyond --tolerance
+#   Each scenario resets the fake server to its profile, fills the endpoints, closes every warm session and then runs the
+#   function's jobs, one job per host at once. Throughput counts the bytes crossing the simulated sensor links, peak memory
+#   is the peak of Python allocations during the scenario (tracemalloc, or the process's peak RSS on Python 2), latency is
+#   each job's wall time from start to its FunctionResult. Host locks, checkpoints, learned transfer rates, staged tools,
+#   the evidence store and the metrics export are redirected to a temporary directory.
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import types
+import shutil
+import argparse
+import tempfile
+import threading
+import importlib
+import carbon_black.benchmark.fake_cb as fake_cb
+
+DEFAULT_TOLERANCE = 0.2  # Fraction a scenario may slow down, or lose throughput, before it counts as a regression
+INCIDENT_ID = 1001  # Incident the benchmark jobs post to
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+
+class Scenario(object):
+    """ One function run under one profile """
+    def __init__(self, name, function, profile, inputs=None, setup=None, jobs=1, slow=False):
+        self.name = name
+        self.function = function  # Function name, ie 'cb_retrieve_process_list'
+        self.profile = profile  # Key of fake_cb.PROFILES
+        self.inputs = inputs or {}  # Function inputs besides incident_id and hostname
+        self.setup = setup  # Callable taking a FakeEndpoint, fills it before the jobs run
+        self.jobs = jobs  # Jobs run at once, each against its own host
+        self.slow = slow  # Only run when selected or with --all, ie scenarios that back off from timeouts
+
+
+def _cb_logs(endpoint):
+    endpoint.add_directory(r'C:\Windows\CarbonBlack', files=30, file_size=512*1024)
+
+
+def _evidence(endpoint):
+    endpoint.add_directory(r'C:\Users\Public\Evidence', files=40, file_size=256*1024)
+
+
+def _prefetch(endpoint):
+    endpoint.add_directory(r'C:\Windows\Prefetch', files=120, file_size=32*1024, depth=0)
+
+
+def _security_events(endpoint):
+    endpoint.report_size = 8*1024*1024  # wevtutil output
+
+
+SCENARIOS = [
+    Scenario('process_list_lan', 'cb_retrieve_process_list', 'lan'),
+    Scenario('process_list_concurrent', 'cb_retrieve_process_list', 'wan', jobs=8),
+    Scenario('services_fleet', 'cb_retrieve_fleet_artifacts', 'wan', {'collector': 'services', 'max_parallel': 8}, jobs=8),
+    Scenario('triage_wan', 'cb_retrieve_triage_bundle', 'wan'),
+    Scenario('cb_logs_wan', 'cb_retrieve_carbon_black_logs', 'wan', {'compress_on_endpoint': True}, setup=_cb_logs),
+    Scenario('cb_logs_legacy', 'cb_retrieve_carbon_black_logs', 'legacy', {'compress_on_endpoint': True}, setup=_cb_logs),
+    Scenario('directory_wan', 'cb_retrieve_file_or_directory', 'wan', {'path_or_file': r'C:\Users\Public\Evidence'}, setup=_evidence),
+    Scenario('directory_satellite', 'cb_retrieve_file_or_directory', 'satellite', {'path_or_file': r'C:\Users\Public\Evidence'}, setup=_evidence),
+    Scenario('prefetch_lan', 'cb_retrieve_prefetch_files', 'lan', setup=_prefetch),
+    Scenario('security_events_wan', 'cb_retrieve_windows_security_events', 'wan', {'compress_on_endpoint': True}, setup=_security_events),
+    Scenario('process_list_offline', 'cb_retrieve_process_list', 'offline'),
+    Scenario('directory_flaky', 'cb_retrieve_file_or_directory', 'flaky', {'path_or_file': r'C:\Users\Public\Evidence'}, setup=_evidence, slow=True),
+]
+
+
+def sandbox(directory):
+    """
+    Point every piece of persistent state the functions keep at a scratch directory
+    :param directory: local scratch directory
+    :return:
+    """
+    import carbon_black.util.transfer as transfer
+    import carbon_black.util.host_queue as host_queue
+    import carbon_black.util.tool_stage as tool_stage
+    import carbon_black.util.transfer_rate as transfer_rate
+    import carbon_black.util.phase_metrics as phase_metrics
+    import carbon_black.util.evidence_store as evidence_store
+    import carbon_black.util.parking as parking
+    import carbon_black.util.job_journal as job_journal
+
+    transfer.CHECKPOINT_DIRECTORY = os.path.join(directory, 'checkpoints')
+    host_queue.HostQueue.get_queue().lock_directory = os.path.join(directory, 'host_locks')
+    tool_stage.ToolStage.get_stage().staged_tools_file = os.path.join(directory, 'staged_tools.json')
+    store = evidence_store.EvidenceStore.get_store()
+    store.store_directory = os.path.join(directory, 'evidence_store')
+    store.bundle_directory = os.path.join(directory, 'bundles')  # Never sweep the integration server's store
+    phase_metrics.MetricsRegistry.get_registry().metrics_file = os.path.join(directory, 'cb_metrics.prom')
+    model = transfer_rate.TransferRateModel.get_model()
+    model.rates_file = os.path.join(directory, 'transfer_rates.json')
+    model._rates = {}  # Start from the default rates, not the integration server's learned ones
+    job_journal.JobJournal.get_journal().journal_file = os.path.join(directory, 'job_journal.db')
+    parked = parking.ParkedJobs.get_parked()
+    parked.jobs_file = os.path.join(directory, 'parked_jobs.json')
+    parked._jobs = {}  # Never resume the integration server's parked jobs
+    parking.PARK_OFFLINE_JOBS = False  # Jobs of offline hosts wait on their worker, so the wait is part of their measured latency
+
+
+def load_function(function):
+    """
+    Import a function module and find its generator under the resilient_circuits decorators
+    :param function: function name, ie 'cb_retrieve_process_list'
+    :return: (FunctionComponent class, generator function taking (component, event, **inputs))
+    """
+    try:
+        importlib.import_module('carbon_black.util.selftest')
+    except ImportError:  # Generated per deployment by the Resilient SDK, the benchmark never runs it
+        selftest = types.ModuleType('carbon_black.util.selftest')
+        selftest.selftest_function = lambda opts: None
+        sys.modules['carbon_black.util.selftest'] = selftest
+        setattr(importlib.import_module('carbon_black.util'), 'selftest', selftest)  # Python 2 resolves "import a.b as c" by attribute
+
+    import carbon_black.util.parking as parking
+
+    module = importlib.import_module('carbon_black.' + function)
+    return module.FunctionComponent, parking.function_body(module.FunctionComponent, function)
+
+
+def run_job(component_class, body, server, inputs):
+    """
+    Run one function invocation to completion
+    :param component_class: FunctionComponent class of the function
+    :param body: generator function of the function
+    :param server: FakeCbServer
+    :param inputs: function inputs
+    :return: dict of "latency", "was_successful", "messages"
+    """
+    component = component_class.__new__(component_class)  # Skip ResilientComponent.__init__, there is no Resilient to connect to
+    component.options = {}
+    rest_client = fake_cb.FakeRestClient(server)
+    component.rest_client = lambda: rest_client
+
+    start = time.time()
+    result, messages = None, []
+    try:
+        for item in body(component, None, **inputs):
+            if type(item).__name__ == 'FunctionResult':
+                result = getattr(item, 'value', None)
+            elif type(item).__name__ == 'FunctionError':
+                messages.append('FunctionError')
+            else:
+                messages.append(str(getattr(item, 'text', item)))
+    except Exception as err:
+        messages.append('Raised: ' + str(err))
+    return {"latency": time.time() - start, "was_successful": bool(result and result.get("was_successful")),
+            "messages": messages, "attachments": sum(size for uri, name, size in rest_client.attachments)}
+
+
+def run_scenario(scenario, server):
+    """
+    Run a scenario's jobs at once and measure them
+    :param scenario: Scenario
+    :param server: FakeCbServer, reset to the scenario's profile
+    :return: dict of results
+    """
+    import carbon_black.util.sensor_index as sensor_index
+    import carbon_black.util.session_broker as session_broker
+
+    component_class, body = load_function(scenario.function)
+    fake_cb.install(server)
+    server.reset(fake_cb.PROFILES[scenario.profile])
+    hosts = [sensor.hostname for sensor in server.sensors[:scenario.jobs]]
+    if scenario.setup is not None:
+        for sensor in server.sensors[:scenario.jobs]:
+            scenario.setup(server.endpoint(sensor.id))
+    session_broker.SessionBroker.get_broker().close_all_sessions()  # Every scenario starts cold
+    sensor_index.reload(server.client())
+
+    if scenario.function == 'cb_retrieve_fleet_artifacts':  # One job runs against every host
+        job_inputs = [dict(scenario.inputs, incident_id=INCIDENT_ID, hostnames=','.join(hosts))]
+    else:
+        job_inputs = [dict(scenario.inputs, incident_id=INCIDENT_ID, hostname=hostname) for hostname in hosts]
+
+    if tracemalloc is not None:
+        tracemalloc.start()
+    jobs = []
+    start = time.time()
+    threads = [threading.Thread(target=lambda inputs=inputs: jobs.append(run_job(component_class, body, server, inputs)), name='cb-benchmark') for inputs in job_inputs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    if tracemalloc is not None:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    else:
+        import resource
+        peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    latencies = sorted(job["latency"] for job in jobs)
+    return {"scenario": scenario.name, "function": scenario.function, "profile": scenario.profile, "jobs": len(jobs),
+            "succeeded": sum(1 for job in jobs if job["was_successful"]), "elapsed": round(elapsed, 3),
+            "bytes": server.counters.get('bytes', 0), "throughput": round(server.counters.get('bytes', 0) / elapsed, 1) if elapsed else 0,
+            "attachment_bytes": sum(job["attachments"] for job in jobs), "peak_memory": peak_memory,
+            "latency_p50": round(latencies[len(latencies) // 2], 3), "latency_max": round(latencies[-1], 3),
+            "commands": server.counters.get('commands', 0), "sessions": server.counters.get('sessions', 0),
+            "timeouts": server.counters.get('timeouts', 0),
+            "failures": [job["messages"][-3:] for job in jobs if not job["was_successful"]]}
+
+
+def compare(results, baseline, tolerance):
+    """
+    Find scenarios that regressed against a baseline run
+    :param results: list of run_scenario() results
+    :param baseline: list of run_scenario() results of an earlier run
+    :param tolerance: fraction of slowdown or throughput loss allowed
+    :return: list of regression descriptions
+    """
+    previous = dict((result["scenario"], result) for result in baseline)
+    regressions = []
+    for result in results:
+        before = previous.get(result["scenario"])
+        if before is None:
+            continue
+        if result["succeeded"] < before["succeeded"]:
+            regressions.append('{0}: {1} of {2} jobs succeeded, {3} before'.format(result["scenario"], result["succeeded"], result["jobs"], before["succeeded"]))
+        if result["latency_max"] > before["latency_max"] * (1 + tolerance):
+            regressions.append('{0}: latency {1}s, {2}s before'.format(result["scenario"], result["latency_max"], before["latency_max"]))
+        if before["throughput"] and result["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append('{0}: throughput {1} B/s, {2} B/s before'.format(result["scenario"], result["throughput"], before["throughput"]))
+    return regressions
+
+
+def report(results):
+    """
+    Results as a text table
+    :param results: list of run_scenario() results
+    :return: string
+    """
+    lines = ['{0:<26} {1:<10} {2:>7} {3:>10} {4:>12} {5:>11} {6:>11} {7:>10} {8:>9}'.format(
+        'Scenario', 'Profile', 'Jobs OK', 'Elapsed s', 'Throughput', 'Latency p50', 'Latency max', 'Peak MB', 'Commands')]
+    for result in results:
+        lines.append('{0:<26} {1:<10} {2:>7} {3:>10.2f} {4:>10.1f}kB/s {5:>10.2f}s {6:>10.2f}s {7:>10.1f} {8:>9}'.format(
+            result["scenario"], result["profile"], '{0}/{1}'.format(result["succeeded"], result["jobs"]), result["elapsed"],
+            result["throughput"] / 1000.0, result["latency_p50"], result["latency_max"], result["peak_memory"] / 1000000.0, result["commands"]))
+        for failure in result["failures"]:
+            lines.append('    failed: ' + ' | '.join(failure))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the Carbon Black functions against a local CB stand-in')
+    parser.add_argument('--scenario', action='append', help='scenario to run, repeatable, default every scenario not marked slow')
+    parser.add_argument('--all', action='store_true', help='also run the slow scenarios')
+    parser.add_argument('--list', action='store_true', help='list the scenarios and exit')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run, exit 1 if a scenario regressed')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='fraction of slowdown allowed against the baseline')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for scenario in SCENARIOS:
+            print('{0:<26} {1:<40} {2:<10} jobs={3}{4}'.format(scenario.name, scenario.function, scenario.profile, scenario.jobs, ' (slow)' if scenario.slow else ''))
+        return 0
+
+    selected = [scenario for scenario in SCENARIOS if (scenario.name in args.scenario if args.scenario else args.all or not scenario.slow)]
+    unknown = set(args.scenario or []) - set(scenario.name for scenario in SCENARIOS)
+    if unknown:
+        parser.error('unknown scenario: ' + ', '.join(sorted(unknown)))
+
+    directory = tempfile.mkdtemp(prefix='cb-benchmark-')
+    try:
+        server = fake_cb.FakeCbServer(fake_cb.PROFILES['lan'], hosts=max(scenario.jobs for scenario in selected))
+        fake_cb.install(server)  # Before any function is imported, their module level CbEnterpriseResponseAPI() must not reach for a real server
+        sandbox(directory)
+        results = []
+        for scenario in selected:
+            results.append(run_scenario(scenario, server))
+            print(report(results[-1:]).split('\n', 1)[1])
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print('\n' + report(results))
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(results, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('[REGRESSION] ' + regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,7 +3,7 @@
 
 # This function will delete an absolute-path file or directory from an endpoint, found processes will be killed prior to deletion.
 # File: cb_delete_file_kill_if_necessary.py
-# Date: 03/18/2019 - Modified: 06/28/2019
+# Date: 03/18/2019 - Modified: 10/18/2026
 # Author: Jared F
 
 """Function implementation"""
@@ -12,14 +12,20 @@
 #   @return -> boolean: results['was_successful'], string: results['hostname'], list of strings: results['deleted']
 
 import os
-import time
 import logging
 import datetime
 from resilient_circuits import ResilientComponent, function, handler, StatusMessage, FunctionResult, FunctionError
-from cbapi.response import CbEnterpriseResponseAPI, Sensor
-from cbapi.errors import TimeoutError, ApiError
-from urllib3.exceptions import ProtocolError, NewConnectionError, ConnectTimeoutError, MaxRetryError
+from cbapi.response import CbEnterpriseResponseAPI
+from cbapi.errors import TimeoutError
 import carbon_black.util.selftest as selftest
+import carbon_black.util.session_broker as session_broker
+import carbon_black.util.sensor_watcher as sensor_watcher
+import carbon_black.util.sensor_index as sensor_index
+import carbon_black.util.host_queue as host_queue
+import carbon_black.util.parking as parking
+import carbon_black.util.job_journal as job_journal
+import carbon_black.util.retry_policy as retry_policy
+import carbon_black.util.phase_metrics as phase_metrics
 
 cb = CbEnterpriseResponseAPI()  # CB Response API
 MAX_TIMEOUTS = 3  # The number of CB timeouts that must occur before the function aborts
@@ -34,6 +40,7 @@ class FunctionComponent(ResilientComponent):
         super(FunctionComponent, self).__init__(opts)
         self.options = opts.get("carbon_black", {})
         selftest.selftest_function(opts)
+        parking.register("cb_delete_file_kill_if_necessary", self, cb)  # Resume this function's parked jobs once their hosts come online
 
     @handler("reload")
     def _reload(self, event, opts):
@@ -47,7 +54,9 @@ class FunctionComponent(ResilientComponent):
         results["was_successful"] = False
         results["hostname"] = None
         results["deleted"] = []
-        lock_acquired = False
+        host_ticket = None  # This job's place in the host's job queue
+        job_metrics = None  # Phase timings of this job
+        job_entry = None  # This job's entry in the job journal
 
         try:
             # Get the function parameters:
@@ -57,20 +66,21 @@ class FunctionComponent(ResilientComponent):
 
             log = logging.getLogger(__name__)  # Establish logging
 
-            days_later_timeout_length = datetime.datetime.now() + datetime.timedelta(days=DAYS_UNTIL_TIMEOUT)  # Max duration length before aborting
-            hostname = hostname.upper()[:15]  # CB limits hostname to 15 characters
-            lock_file = '/home/integrations/.resilient/cb_host_locks/{}.lock'.format(hostname)
-            sensor = cb.select(Sensor).where('hostname:' + hostname)  # Query CB for the hostname's sensor
+            days_later_timeout_length = parking.deadline(datetime.datetime.now() + datetime.timedelta(days=DAYS_UNTIL_TIMEOUT))  # Max duration length before aborting, a resumed job keeps its parked deadline
+            hostname = sensor_index.hostname_key(hostname)  # CB limits hostname to 15 characters
+            sensor = sensor_index.find(cb, hostname)  # Resolve the hostname's sensor from the in-memory sensor index
             timeouts = 0  # Number of timeouts that have occurred
 
-            if len(sensor) <= 0:  # Host does not have CB agent, abort
+            if sensor is None:  # Host does not have CB agent, abort
                 yield StatusMessage("[FATAL ERROR] CB could not find hostname: " + str(hostname))
                 yield StatusMessage('[FAILURE] Fatal error caused exit!')
                 yield FunctionResult(results)
                 return
 
-            sensor = sensor[0]  # Get the sensor object from the query
             results["hostname"] = str(hostname).upper()
+            host_ticket = host_queue.enqueue(hostname, 'cb_delete_file_kill_if_necessary')  # Queue behind any running or waiting actions on the host
+            job_metrics = phase_metrics.start_run('cb_delete_file_kill_if_necessary', hostname, sensor.id)  # Time each phase of the job against the host
+            job_entry = job_journal.start('cb_delete_file_kill_if_necessary', incident_id, hostname, sensor.id, kwargs, days_later_timeout_length)  # Journal the job so a restart does not lose it
             deleted = []
 
             while timeouts <= MAX_TIMEOUTS:  # Max timeouts before aborting
@@ -81,37 +91,40 @@ class FunctionComponent(ResilientComponent):
 
                     # Check if the sensor is queued to restart, wait up to 90 seconds before checking online status
                     three_minutes_passed = datetime.datetime.now() + datetime.timedelta(minutes=3)
-                    while (sensor.restart_queued is True) and (three_minutes_passed >= now):
-                        time.sleep(3)  # Give the CPU a break, it works hard!
-                        now = datetime.datetime.now()
-                        sensor = (cb.select(Sensor).where('hostname:' + hostname))[0]  # Retrieve the latest sensor vitals
+                    sensor = sensor_watcher.wait_for(cb, hostname, lambda s: s.restart_queued is not True, three_minutes_passed, sensor)  # Woken by the fleet-wide sensor watcher, no per-function polling
+                    now = datetime.datetime.now()
+
+                    # Park the job instead of holding a worker while the host is offline, it runs again once the host comes online
+                    if sensor.status != "Online" and parking.should_park():
+                        parking.park('cb_delete_file_kill_if_necessary', incident_id, hostname, kwargs, days_later_timeout_length)
+                        results["parked"] = True
+                        yield StatusMessage('[INFO] Hostname: ' + str(hostname) + ' is offline. The job is parked and will run once the host comes online, for up to ' + str(DAYS_UNTIL_TIMEOUT) + ' days...')
+                        break
 
                     # Check online status
                     if sensor.status != "Online":
                         yield StatusMessage('[WARNING] Hostname: ' + str(hostname) + ' is offline. Will attempt for ' + str(DAYS_UNTIL_TIMEOUT) + ' days...')
 
                     # Check lock status
-                    if lock_acquired is False and os.path.exists(lock_file):
-                        yield StatusMessage('[WARNING] A running action has a lock on  ' + str(hostname) + '. Will attempt for ' + str(DAYS_UNTIL_TIMEOUT) + ' days...')
+                    if host_queue.jobs_ahead(host_ticket) > 0:
+                        yield StatusMessage('[WARNING] A running action has a lock on  ' + str(hostname) + ' (' + str(host_queue.jobs_ahead(host_ticket)) + ' queued ahead). Will attempt for ' + str(DAYS_UNTIL_TIMEOUT) + ' days...')
 
                     # Wait for offline and locked hosts for days_later_timeout_length
-                    while (sensor.status != "Online" or (os.path.exists(lock_file) and lock_acquired is False)) and (days_later_timeout_length >= now):
-                        time.sleep(3)  # Give the CPU a break, it works hard!
-                        now = datetime.datetime.now()
-                        sensor = (cb.select(Sensor).where('hostname:' + hostname))[0]  # Retrieve the latest sensor vitals
+                    sensor = sensor_watcher.wait_for(cb, hostname, lambda s: s.status == "Online", days_later_timeout_length, sensor)
+                    if sensor.status == "Online":
+                        host_queue.wait_for_turn(host_ticket, days_later_timeout_length)  # Handed the host as soon as the job ahead releases it
+                    now = datetime.datetime.now()
 
                     # Abort after DAYS_UNTIL_TIMEOUT
-                    if sensor.status != "Online" or (os.path.exists(lock_file) and lock_acquired is False):
+                    if sensor.status != "Online" or not host_ticket.acquired:
                         yield StatusMessage('[FATAL ERROR] Hostname: ' + str(hostname) + ' is still offline!')
                         yield StatusMessage('[FAILURE] Fatal error caused exit!')
                         break
 
                     # Check if the sensor is queued to restart, wait up to 90 seconds before continuing
                     three_minutes_passed = datetime.datetime.now() + datetime.timedelta(minutes=3)
-                    while (sensor.restart_queued is True) and (three_minutes_passed >= now):  # If the sensor is queued to restart, wait up to 90 seconds
-                        time.sleep(3)  # Give the CPU a break, it works hard!
-                        now = datetime.datetime.now()
-                        sensor = (cb.select(Sensor).where('hostname:' + hostname))[0]  # Retrieve the latest sensor vitals
+                    sensor = sensor_watcher.wait_for(cb, hostname, lambda s: s.restart_queued is not True, three_minutes_passed, sensor)  # Woken by the fleet-wide sensor watcher, no per-function polling
+                    now = datetime.datetime.now()
 
                     # Verify the incident still exists and is reachable, if not abort
                     try: incident = self.rest_client().get('/incidents/{0}?text_content_output_format=always_text&handle_format=names'.format(str(incident_id)))
@@ -124,18 +137,9 @@ class FunctionComponent(ResilientComponent):
                             log.info('[FAILURE] Fatal error caused exit!')
                         break
 
-                    # Acquire host lock
-                    if lock_acquired is False:
-                        try:
-                            f = os.fdopen(os.open(lock_file, os.O_CREAT | os.O_WRONLY | os.O_EXCL), 'w')
-                            f.close()
-                            lock_acquired = True
-                        except OSError:
-                            continue
-
                     # Establish a session to the host sensor
                     yield StatusMessage('[INFO] Establishing session to CB Sensor #' + str(sensor.id) + ' (' + sensor.hostname + ')')
-                    session = cb.live_response.request_session(sensor.id)
+                    session = session_broker.request_session(cb, sensor.id)  # Reuse a warm session to the sensor if the broker holds one
                     yield StatusMessage('[SUCCESS] Connected on Session #' + str(session.session_id) + ' to CB Sensor #' + str(sensor.id) + ' (' + sensor.hostname + ')')
 
                     path = session.walk(path_or_file, False)  # Walk everything. False = performs a bottom->up walk, not top->down
@@ -185,30 +189,20 @@ class FunctionComponent(ResilientComponent):
                         except TimeoutError: raise
                         except: yield StatusMessage('[ERROR] Deletion failed for: ' + path_or_file)
 
-                except TimeoutError:  # Catch TimeoutError and handle
-                    timeouts = timeouts + 1
-                    if timeouts <= MAX_TIMEOUTS:
-                        yield StatusMessage('[ERROR] TimeoutError was encountered. Reattempting... (' + str(timeouts) + '/' + str(MAX_TIMEOUTS) + ')')
-                        try: session.close()
+                except retry_policy.RETRYABLE_ERRORS as err:  # Catch CB timeouts and connection exceptions and handle
+                    if not retry_policy.is_retryable(err):  # Only handle ApiError involving network connection error
+                        try: session_broker.release_session(session)  # Return the session to the broker before giving up
                         except: pass
-                        sensor = (cb.select(Sensor).where('hostname:' + hostname))[0]  # Retrieve the latest sensor vitals
-                        sensor.restart_sensor()  # Restarting the sensor may avoid a timeout from occurring again
-                        time.sleep(30)  # Sleep to apply sensor restart
-                        sensor = (cb.select(Sensor).where('hostname:' + hostname))[0]  # Retrieve the latest sensor vitals
-                    else:
-                        yield StatusMessage('[FATAL ERROR] TimeoutError was encountered. The maximum number of retries was reached. Aborting!')
-                        yield StatusMessage('[FAILURE] Fatal error caused exit!')
-                    continue
-
-                except(ApiError, ProtocolError, NewConnectionError, ConnectTimeoutError, MaxRetryError) as err:  # Catch urllib3 connection exceptions and handle
-                    if 'ApiError' in str(type(err).__name__) and 'network connection error' not in str(err): raise  # Only handle ApiError involving network connection error
+                        raise
                     timeouts = timeouts + 1
-                    if timeouts <= MAX_TIMEOUTS:
-                        yield StatusMessage('[ERROR] Carbon Black was unreachable. Reattempting in 30 minutes... (' + str(timeouts) + '/' + str(MAX_TIMEOUTS) + ')')
-                        time.sleep(1800)  # Sleep for 30 minutes, backup service may have been running.
+                    if retry_policy.rule_for(err).discard_session:
+                        try: session_broker.discard_session(session)  # Do not reuse a session that timed out
+                        except: pass
                     else:
-                        yield StatusMessage('[FATAL ERROR] ' + str(type(err).__name__) + ' was encountered. The maximum number of retries was reached. Aborting!')
-                        yield StatusMessage('[FAILURE] Fatal error caused exit!')
+                        try: session_broker.release_session(session)  # Return the session to the broker, the retry checks it out again
+                        except: pass
+                    session = None  # Returned to the broker, never return it twice
+                    for status_message in retry_policy.recover(cb, err, hostname, timeouts, MAX_TIMEOUTS): yield StatusMessage(status_message)  # Backs off per the error's rule, waits out CB outages together with every other job
                     continue
 
                 except Exception as err:  # Catch all other exceptions and abort
@@ -220,16 +214,19 @@ class FunctionComponent(ResilientComponent):
                     results["was_successful"] = True
                     results["deleted"] = deleted
 
-                try: session.close()
+                try: session_broker.release_session(session)  # Keep the session warm for the next function
                 except: pass
-                yield StatusMessage('[INFO] Session has been closed to CB Sensor #' + str(sensor.id) + '(' + sensor.hostname + ')')
+                yield StatusMessage('[INFO] Session has been released to CB Sensor #' + str(sensor.id) + '(' + sensor.hostname + ')')
                 break
 
-            # Release the host lock if acquired
-            if lock_acquired is True:
-                os.remove(lock_file)
+            # Release the host lock if acquired, the next queued action on the host starts immediately
+            host_queue.release(host_ticket)
 
             # Produce a FunctionResult with the results
             yield FunctionResult(results)
         except Exception:
             yield FunctionError()
+        finally:
+            host_queue.release(host_ticket)  # Never leave the host's queue blocked after an unexpected error
+            phase_metrics.finish_run(job_metrics, results["was_successful"])  # Log and export the phase timings of the job
+            job_journal.finish(job_entry, results)  # The job is no longer in flight
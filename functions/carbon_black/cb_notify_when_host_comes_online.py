@@ -3,24 +3,24 @@
 
 # This function will return when a host comes online (or a max_days value is reached).
 # File: cb_notify_when_host_comes_online.py
-# Date: 04/18/2019 - Modified: 06/25/2019
+# Date: 04/18/2019 - Modified: 10/18/2026
 # Author: Jared F
 
 """Function implementation"""
 #   @function -> cb_notify_when_host_comes_online
 #   @params -> integer: incident_id, string: hostname, int: max_days
-#   @return -> boolean: results['was_successful'], string: results['hostname']
+#   @return -> boolean: results['was_successful'], string: results['hostname'], boolean: results['Online']
 
 
-import os
-import time
 import logging
 import datetime
 from resilient_circuits import ResilientComponent, function, handler, StatusMessage, FunctionResult, FunctionError
-from cbapi.response import CbEnterpriseResponseAPI, Sensor
-from cbapi.errors import TimeoutError, ApiError
-from urllib3.exceptions import ProtocolError, NewConnectionError, ConnectTimeoutError, MaxRetryError
+from cbapi.response import CbEnterpriseResponseAPI
 import carbon_black.util.selftest as selftest
+import carbon_black.util.sensor_watcher as sensor_watcher
+import carbon_black.util.sensor_index as sensor_index
+import carbon_black.util.job_journal as job_journal
+import carbon_black.util.parking as parking
 
 cb = CbEnterpriseResponseAPI()  # CB Response API
 
@@ -32,6 +32,7 @@ class FunctionComponent(ResilientComponent):
         super(FunctionComponent, self).__init__(opts)
         self.options = opts.get("carbon_black", {})
         selftest.selftest_function(opts)
+        parking.register("cb_notify_when_host_comes_online", self, cb)  # Post the notes of this function's parked waits once their hosts come online
 
     @handler("reload")
     def _reload(self, event, opts):
@@ -45,6 +46,7 @@ class FunctionComponent(ResilientComponent):
         results["was_successful"] = False
         results["hostname"] = None
         results["Online"] = False
+        job_entry = None  # This job's entry in the job journal
 
         try:
             # Get the function parameters:
@@ -56,28 +58,33 @@ class FunctionComponent(ResilientComponent):
 
             try:
 
-                days_later_timeout_length = datetime.datetime.now() + datetime.timedelta(days=max_days)  # Max duration length before aborting
-                hostname = hostname.upper()[:15]  # CB limits hostname to 15 characters
-                sensor = cb.select(Sensor).where('hostname:' + hostname)  # Query CB for the hostname's sensor
+                days_later_timeout_length = parking.deadline(datetime.datetime.now() + datetime.timedelta(days=max_days))  # Max duration length before aborting, a resumed wait keeps its parked deadline
+                hostname = sensor_index.hostname_key(hostname)  # CB limits hostname to 15 characters
+                sensor = sensor_index.find(cb, hostname)  # Resolve the hostname's sensor from the in-memory sensor index
 
-                if len(sensor) <= 0:  # Host does not have CB agent, abort
+                if sensor is None:  # Host does not have CB agent, abort
                     yield StatusMessage("[FATAL ERROR] CB could not find hostname: " + str(hostname))
                     yield StatusMessage('[FAILURE] Fatal error caused exit!')
                     yield FunctionResult(results)
                     return
 
-                sensor = sensor[0]  # Get the sensor object from the query
                 results["hostname"] = str(hostname).upper()
+                job_entry = job_journal.start('cb_notify_when_host_comes_online', incident_id, hostname, sensor.id, kwargs, days_later_timeout_length)  # Journal the job so a restart does not lose it
 
                 now = datetime.datetime.now()
 
+                # Park the wait instead of holding a worker for max_days, a note is posted to the incident once the host comes online
+                if sensor.status != "Online" and parking.should_park():
+                    parking.park('cb_notify_when_host_comes_online', incident_id, hostname, kwargs, days_later_timeout_length)
+                    results["parked"] = True
+                    yield StatusMessage('[INFO] Hostname: ' + str(hostname) + ' is offline. The wait is parked, a note will be posted to the incident once the host comes online, for up to ' + str(max_days) + ' days...')
+                    yield FunctionResult(results)
+                    return
+
                 # Check online status
                 if sensor.status != "Online":
                     yield StatusMessage('[INFO] Hostname: ' + str(hostname) + ' is offline. Will notify when online for ' + str(max_days) + ' days...')
-                while (sensor.status != "Online") and (days_later_timeout_length >= now):  # Continuously check if the sensor comes online for max_days
-                    time.sleep(3)  # Give the CPU a break, it works hard!
-                    now = datetime.datetime.now()
-                    sensor = (cb.select(Sensor).where('hostname:' + hostname))[0]  # Retrieve the latest sensor vitals
+                sensor = sensor_watcher.wait_for(cb, hostname, lambda s: s.status == "Online", days_later_timeout_length, sensor)  # Woken by the fleet-wide sensor watcher when the sensor comes online, for max_days
 
                 # Abort after max_days
                 if sensor.status != "Online":
@@ -99,3 +106,5 @@ class FunctionComponent(ResilientComponent):
             yield FunctionResult(results)
         except Exception:
             yield FunctionError()
+        finally:
+            job_journal.finish(job_entry, results)  # The job is no longer in flight
@@ -3,7 +3,7 @@
 
 # This function will remove isolation from an endpoint via Carbon Black.
 # File: cb_remove_system_isolation.py
-# Date: 03/26/2019 - Modified: 06/25/2019
+# Date: 03/26/2019 - Modified: 10/18/2026
 # Author: Jared F
 
 """Function implementation"""
@@ -13,8 +13,9 @@
 
 import logging
 from resilient_circuits import ResilientComponent, function, handler, StatusMessage, FunctionResult, FunctionError
-from cbapi.response import CbEnterpriseResponseAPI, Sensor
+from cbapi.response import CbEnterpriseResponseAPI
 import carbon_black.util.selftest as selftest
+import carbon_black.util.sensor_index as sensor_index
 
 cb = CbEnterpriseResponseAPI()  # CB Response API
 protected_sensor_group_ids = []  # List of group IDs that cannot be isolated (ie critical server groups)
@@ -48,16 +49,15 @@ class FunctionComponent(ResilientComponent):
 
             log = logging.getLogger(__name__)
 
-            hostname = hostname.upper()[:15]  # CB limits hostname to 15 characters
-            sensor = cb.select(Sensor).where('hostname:' + hostname)  # Query CB for the hostname's sensor
+            hostname = sensor_index.hostname_key(hostname)  # CB limits hostname to 15 characters
+            sensor = sensor_index.find(cb, hostname)  # Resolve the hostname's sensor from the in-memory sensor index
 
-            if len(sensor) <= 0:  # Host does not have CB agent, abort
+            if sensor is None:  # Host does not have CB agent, abort
                 yield StatusMessage("[FATAL ERROR] CB could not find hostname: " + str(hostname))
                 yield StatusMessage('[FAILURE] Fatal error caused exit!')
                 yield FunctionResult(results)
                 return
 
-            sensor = sensor[0]  # Get the sensor object from the query
             results["hostname"] = str(hostname).upper()
 
             try:
@@ -3,12 +3,12 @@
 
 # This function will retrieve Carbon Black log files from an endpoint from pre-determined file extensions in a ZIP file.
 # File: cb_retrieve_carbon_black_logs.py
-# Date: 04/04/2019 - Modified: 06/25/2019
+# Date: 04/04/2019 - Modified: 10/18/2026
 # Author: Jared F
 
 """Function implementation"""
 #   @function -> cb_retrieve_carbon_black_logs
-#   @params -> integer: incident_id, string: hostname
+#   @params -> integer: incident_id, string: hostname, int: max_file_size (optional), boolean: compress_on_endpoint (optional)
 #   @return -> boolean: results['was_successful'], string: results['hostname']
 
 
@@ -20,10 +20,21 @@ import zipfile
 import logging
 import datetime
 from resilient_circuits import ResilientComponent, function, handler, StatusMessage, FunctionResult, FunctionError
-from cbapi.response import CbEnterpriseResponseAPI, Sensor
-from cbapi.errors import TimeoutError, ApiError
-from urllib3.exceptions import ProtocolError, NewConnectionError, ConnectTimeoutError, MaxRetryError
+from cbapi.response import CbEnterpriseResponseAPI
+from cbapi.errors import TimeoutError
 import carbon_black.util.selftest as selftest
+import carbon_black.util.session_broker as session_broker
+import carbon_black.util.sensor_watcher as sensor_watcher
+import carbon_black.util.sensor_index as sensor_index
+import carbon_black.util.host_queue as host_queue
+import carbon_black.util.parking as parking
+import carbon_black.util.job_journal as job_journal
+import carbon_black.util.retry_policy as retry_policy
+import carbon_black.util.transfer as transfer
+import carbon_black.util.transfer_rate as transfer_rate
+import carbon_black.util.directory_scan as directory_scan
+import carbon_black.util.endpoint_archive as endpoint_archive
+import carbon_black.util.phase_metrics as phase_metrics
 
 cb = CbEnterpriseResponseAPI()  # CB Response API
 MAX_TIMEOUTS = 3  # The number of CB timeouts that must occur before the function aborts
@@ -31,9 +42,10 @@ DAYS_UNTIL_TIMEOUT = 3  # The number of days that must pass before the function
 
 MAX_FILE_SIZE = 100*1000000  # Bytes, the default maximum file size to transfer (per file), default = 100MB
 MAX_UPLOAD_SIZE = 50*1000000  # Maximum number of bytes of files to upload as an attachment before reverting to a netshare drop, default = 50MB
-TRANSFER_RATE = 225000  # Bytes per second, the expected minimum file transfer rate via Carbon Black
 
 EXTENSIONS_TO_RETRIEVE = ['.txt', '.log', '.dump', '.dmp', '.tmp', '.html']
+COMPRESS_ON_ENDPOINT = True  # Default for compress_on_endpoint, logs are compressed on the endpoint and retrieved as one file
+ENDPOINT_ARCHIVE = r'C:\Windows\CarbonBlack\Reports\CB_logs.zip'  # Endpoint path the compressed logs are staged at
 
 
 class FunctionComponent(ResilientComponent):
@@ -44,6 +56,7 @@ class FunctionComponent(ResilientComponent):
         super(FunctionComponent, self).__init__(opts)
         self.options = opts.get("carbon_black", {})
         selftest.selftest_function(opts)
+        parking.register("cb_retrieve_carbon_black_logs", self, cb)  # Resume this function's parked jobs once their hosts come online
 
     @handler("reload")
     def _reload(self, event, opts):
@@ -56,30 +69,35 @@ class FunctionComponent(ResilientComponent):
         results = {}
         results["was_successful"] = False
         results["hostname"] = None
-        lock_acquired = False
+        host_ticket = None  # This job's place in the host's job queue
+        job_metrics = None  # Phase timings of this job
+        job_entry = None  # This job's entry in the job journal
 
         try:
             # Get the function parameters:
             incident_id = kwargs.get("incident_id")  # number
             hostname = kwargs.get("hostname")  # text
             max_file_size = kwargs.get("max_file_size")  # number
+            compress_on_endpoint = kwargs.get("compress_on_endpoint")  # boolean
+            if compress_on_endpoint is None: compress_on_endpoint = COMPRESS_ON_ENDPOINT
 
             log = logging.getLogger(__name__)  # Establish logging
 
-            days_later_timeout_length = datetime.datetime.now() + datetime.timedelta(days=DAYS_UNTIL_TIMEOUT)  # Max duration length before aborting
-            hostname = hostname.upper()[:15]  # CB limits hostname to 15 characters
-            lock_file = '/home/integrations/.resilient/cb_host_locks/{}.lock'.format(hostname)
-            sensor = cb.select(Sensor).where('hostname:' + hostname)  # Query CB for the hostname's sensor
+            days_later_timeout_length = parking.deadline(datetime.datetime.now() + datetime.timedelta(days=DAYS_UNTIL_TIMEOUT))  # Max duration length before aborting, a resumed job keeps its parked deadline
+            hostname = sensor_index.hostname_key(hostname)  # CB limits hostname to 15 characters
+            sensor = sensor_index.find(cb, hostname)  # Resolve the hostname's sensor from the in-memory sensor index
             timeouts = 0  # Number of timeouts that have occurred
 
-            if len(sensor) <= 0:  # Host does not have CB agent, abort
+            if sensor is None:  # Host does not have CB agent, abort
                 yield StatusMessage("[FATAL ERROR] CB could not find hostname: " + str(hostname))
                 yield StatusMessage('[FAILURE] Fatal error caused exit!')
                 yield FunctionResult(results)
                 return
 
-            sensor = sensor[0]  # Get the sensor object from the query
             results["hostname"] = str(hostname).upper()
+            host_ticket = host_queue.enqueue(hostname, 'cb_retrieve_carbon_black_logs')  # Queue behind any running or waiting actions on the host
+            job_metrics = phase_metrics.start_run('cb_retrieve_carbon_black_logs', hostname, sensor.id)  # Time each phase of the job against the host
+            job_entry = job_journal.start('cb_retrieve_carbon_black_logs', incident_id, hostname, sensor.id, kwargs, days_later_timeout_length)  # Journal the job so a restart does not lose it
 
             while timeouts <= MAX_TIMEOUTS:  # Max timeouts before aborting
 
@@ -89,37 +107,40 @@ class FunctionComponent(ResilientComponent):
 
                     # Check if the sensor is queued to restart, wait up to 90 seconds before checking online status
                     three_minutes_passed = datetime.datetime.now() + datetime.timedelta(minutes=3)
-                    while (sensor.restart_queued is True) and (three_minutes_passed >= now):
-                        time.sleep(3)  # Give the CPU a break, it works hard!
-                        now = datetime.datetime.now()
-                        sensor = (cb.select(Sensor).where('hostname:' + hostname))[0]  # Retrieve the latest CB sensor vitals
+                    sensor = sensor_watcher.wait_for(cb, hostname, lambda s: s.restart_queued is not True, three_minutes_passed, sensor)  # Woken by the fleet-wide sensor watcher, no per-function polling
+                    now = datetime.datetime.now()
+
+                    # Park the job instead of holding a worker while the host is offline, it runs again once the host comes online
+                    if sensor.status != "Online" and parking.should_park():
+                        parking.park('cb_retrieve_carbon_black_logs', incident_id, hostname, kwargs, days_later_timeout_length)
+                        results["parked"] = True
+                        yield StatusMessage('[INFO] Hostname: ' + str(hostname) + ' is offline. The job is parked and will run once the host comes online, for up to ' + str(DAYS_UNTIL_TIMEOUT) + ' days...')
+                        break
 
                     # Check online status
                     if sensor.status != "Online":
                         yield StatusMessage('[WARNING] Hostname: ' + str(hostname) + ' is offline. Will attempt for ' + str(DAYS_UNTIL_TIMEOUT) + ' days...')
 
                     # Check lock status
-                    if os.path.exists(lock_file) and lock_acquired is False:
-                        yield StatusMessage('[WARNING] A running action has a lock on  ' + str(hostname) + '. Will attempt for ' + str(DAYS_UNTIL_TIMEOUT) + ' days...')
+                    if host_queue.jobs_ahead(host_ticket) > 0:
+                        yield StatusMessage('[WARNING] A running action has a lock on  ' + str(hostname) + ' (' + str(host_queue.jobs_ahead(host_ticket)) + ' queued ahead). Will attempt for ' + str(DAYS_UNTIL_TIMEOUT) + ' days...')
 
                     # Wait for offline and locked hosts for days_later_timeout_length
-                    while (sensor.status != "Online" or (os.path.exists(lock_file) and lock_acquired is False)) and (days_later_timeout_length >= now):
-                        time.sleep(3)  # Give the CPU a break, it works hard!
-                        now = datetime.datetime.now()
-                        sensor = (cb.select(Sensor).where('hostname:' + hostname))[0]  # Retrieve the latest sensor vitals
+                    sensor = sensor_watcher.wait_for(cb, hostname, lambda s: s.status == "Online", days_later_timeout_length, sensor)
+                    if sensor.status == "Online":
+                        host_queue.wait_for_turn(host_ticket, days_later_timeout_length)  # Handed the host as soon as the job ahead releases it
+                    now = datetime.datetime.now()
 
                     # Abort after DAYS_UNTIL_TIMEOUT
-                    if sensor.status != "Online" or (os.path.exists(lock_file) and lock_acquired is False):
+                    if sensor.status != "Online" or not host_ticket.acquired:
                         yield StatusMessage('[FATAL ERROR] Hostname: ' + str(hostname) + ' is still offline!')
                         yield StatusMessage('[FAILURE] Fatal error caused exit!')
                         break
 
                     # Check if the sensor is queued to restart, wait up to 90 seconds before continuing
                     three_minutes_passed = datetime.datetime.now() + datetime.timedelta(minutes=3)
-                    while (sensor.restart_queued is True) and (three_minutes_passed >= now):  # If the sensor is queued to restart, wait up to 90 seconds
-                        time.sleep(3)  # Give the CPU a break, it works hard!
-                        now = datetime.datetime.now()
-                        sensor = (cb.select(Sensor).where('hostname:' + hostname))[0]  # Retrieve the latest CB sensor vitals
+                    sensor = sensor_watcher.wait_for(cb, hostname, lambda s: s.restart_queued is not True, three_minutes_passed, sensor)  # Woken by the fleet-wide sensor watcher, no per-function polling
+                    now = datetime.datetime.now()
 
                     # Verify the incident still exists and is reachable, if not abort
                     try: incident = self.rest_client().get('/incidents/{0}?text_content_output_format=always_text&handle_format=names'.format(str(incident_id)))
@@ -132,18 +153,9 @@ class FunctionComponent(ResilientComponent):
                             log.info('[FAILURE] Fatal error caused exit!')
                         break
 
-                    # Acquire host lock
-                    if lock_acquired is False:
-                        try:
-                            f = os.fdopen(os.open(lock_file, os.O_CREAT | os.O_WRONLY | os.O_EXCL), 'w')
-                            f.close()
-                            lock_acquired = True
-                        except OSError:
-                            continue
-
                     # Establish a session to the host sensor
                     yield StatusMessage('[INFO] Establishing session to CB Sensor #' + str(sensor.id) + ' (' + sensor.hostname + ')')
-                    session = cb.live_response.request_session(sensor.id)
+                    session = session_broker.request_session(cb, sensor.id)  # Reuse a warm session to the sensor if the broker holds one
                     yield StatusMessage('[SUCCESS] Connected on Session #' + str(session.session_id) + ' to CB Sensor #' + str(sensor.id) + ' (' + sensor.hostname + ')')
 
                     files_to_retrieve = []  # Stores log file path located for retrieval
@@ -151,39 +163,51 @@ class FunctionComponent(ResilientComponent):
                     if max_file_size is None:  # If max_file_size is not provided
                         max_file_size = MAX_FILE_SIZE  # Set max_file_size to the default value
 
-                    path = session.walk(r'C:\Windows\CarbonBlack', False)  # Walk everything. False performs a bottom->up walk, not top->down
-                    for item in path:  # For each subdirectory in the path
-                        directory = os.path.normpath((str(item[0])))  # The subdirectory in OS path syntax
-                        file_list = item[2]  # List of files in the subdirectory
-                        if str(file_list) != '[]':  # If the subdirectory is not empty
-                            for f in file_list:  # For each file in the subdirectory
-                                if f.lower().endswith(tuple(EXTENSIONS_TO_RETRIEVE)):  # If the file is of a type we want to retrieve
-                                    file_path = os.path.normpath(directory + '\\' + f)
-                                    file_size = session.list_directory(file_path)[0]['size']
-                                    if 0 < file_size < int(max_file_size):  # If the file has data and does not exceed max_file_size
-                                        log.info('[INFO] Located: ' + file_path)
-                                        files_to_retrieve.append(file_path)  # Store the file path into files_to_retrieve
+                    for file_path, listing in directory_scan.scan(session, r'C:\Windows\CarbonBlack').files:  # Scan everything, one round trip per directory returns every file's size
+                        if listing['filename'].lower().endswith(tuple(EXTENSIONS_TO_RETRIEVE)):  # If the file is of a type we want to retrieve
+                            if 0 < listing['size'] < int(max_file_size):  # If the file has data and does not exceed max_file_size
+                                log.info('[INFO] Located: ' + file_path)
+                                base_directory = os.path.dirname(r'C:\Windows\CarbonBlack\\'.replace('\\', os.sep))
+                                file_directory = os.path.dirname(file_path.replace('\\', os.sep).replace(base_directory, ''))
+                                zip_path = file_directory + os.sep + os.path.basename(file_path.replace('\\', os.sep))
+                                files_to_retrieve.append([file_path, listing['size'], zip_path])  # Store the file path, size and path within the ZIP file into files_to_retrieve
+
+                    files_to_retrieve.sort(key=lambda each_file: (each_file[1], each_file[0]))  # Smallest first, most logs are retrieved before a slow transfer can time out
+
+                    skipped = None  # Logs the endpoint could not compress, None while the logs were not compressed on the endpoint
+                    if compress_on_endpoint and files_to_retrieve:
+                        try: session.create_directory(r'C:\Windows\CarbonBlack\Reports')
+                        except TimeoutError: raise
+                        except Exception: pass  # Existed already
+
+                        yield StatusMessage('[INFO] Compressing ' + str(len(files_to_retrieve)) + ' log(s) on Sensor...')
+                        skipped = endpoint_archive.stage_archive(session, [[each_file, zip_path] for each_file, file_size, zip_path in files_to_retrieve], ENDPOINT_ARCHIVE, endpoint_archive.archive_timeout(sum(file_size for each_file, file_size, zip_path in files_to_retrieve)))
+                        if skipped is None: yield StatusMessage('[WARNING] Sensor could not compress the logs, retrieving them one by one...')
 
                     with tempfile.NamedTemporaryFile(delete=False) as temp_zip:  # Create temporary temp_zip for creating zip_file
                         try:
-                            with zipfile.ZipFile(temp_zip, 'w') as zip_file:  # Establish zip_file from temporary temp_zip for packaging logs into
-                                for each_file in files_to_retrieve:  # For each located log file
-                                    with tempfile.NamedTemporaryFile(delete=False) as temp_file:  # Create temp_file for log
-                                        try:
-                                            base_directory = os.path.dirname(r'C:\Windows\CarbonBlack\\'.replace('\\', os.sep))
-                                            file_directory = os.path.dirname(each_file.replace('\\', os.sep).replace(base_directory, ''))
-                                            file_path = file_directory + os.sep + os.path.basename(each_file.replace('\\', os.sep))
-                                            file_size = session.list_directory(each_file)[0]['size']  # File size in bytes
-                                            custom_timeout = int((file_size / TRANSFER_RATE) + 120)  # The expected timeout duration + 120 seconds for good measure
-                                            temp_file.write(session.get_file(each_file, timeout=custom_timeout))  # Write the log to temp_file
-                                            temp_file.close()
-                                            zip_file.write(temp_file.name, file_path, compress_type=zipfile.ZIP_DEFLATED)  # Write temp_file into zip_file
-
-                                        finally:
-                                            os.unlink(temp_file.name)  # Delete temporary temp_file
-
-                            if os.stat(temp_zip.name).st_size <= MAX_UPLOAD_SIZE:
-                                self.rest_client().post_attachment('/incidents/{0}/attachments'.format(incident_id), temp_zip.name, '{0}-CB_logs.zip'.format(sensor.hostname))  # Post temp_zip to incident
+                            if skipped is not None:  # Retrieve the compressed logs as a single file
+                                archive_size = session.list_directory(ENDPOINT_ARCHIVE)[0]['size']  # File size in bytes
+                                transfer.stream_file(session, ENDPOINT_ARCHIVE, temp_zip, transfer_rate.timeout(sensor.id, archive_size))  # Stream the compressed logs into temp_zip
+                                temp_zip.flush()
+                                session.delete_file(ENDPOINT_ARCHIVE)
+                                if endpoint_archive.verify(temp_zip.name):
+                                    yield StatusMessage('[SUCCESS] Retrieved ' + str(len(files_to_retrieve) - len(skipped)) + ' compressed log(s) from Sensor in a single transfer!')
+                                else:  # Corrupt archive, start over with per-log retrieval
+                                    yield StatusMessage('[WARNING] Compressed logs failed verification, retrieving them one by one...')
+                                    temp_zip.seek(0)
+                                    temp_zip.truncate()
+                                    skipped = None
+
+                            with zipfile.ZipFile(temp_zip, 'w' if skipped is None else 'a') as zip_file:  # Establish zip_file from temporary temp_zip for packaging logs into
+                                for each_file, file_size, zip_path in files_to_retrieve:  # For each located log file
+                                    if skipped is not None and each_file not in skipped: continue  # Already in the compressed logs
+                                    custom_timeout = transfer_rate.timeout(sensor.id, file_size)  # Sized from the sensor's learned transfer rate
+                                    transfer.stream_file_to_zip(session, each_file, zip_file, zip_path, custom_timeout)  # Stream the log into zip_file
+
+                            if transfer_rate.deliver_as_attachment(os.stat(temp_zip.name).st_size, MAX_UPLOAD_SIZE):  # Within the size limit and expected to upload in time
+                                with transfer_rate.measure(transfer_rate.RESILIENT, os.stat(temp_zip.name).st_size):  # Learn the Resilient upload rate
+                                    phase_metrics.post_attachment(self.rest_client(), '/incidents/{0}/attachments'.format(incident_id), temp_zip.name, '{0}-CB_logs.zip'.format(sensor.hostname))  # Post temp_zip to incident
                                 yield StatusMessage('[SUCCESS] Posted a ZIP file of the Carbon Black logs to the incident as an attachment!')
                             else:
                                 if not os.path.exists(os.path.normpath('/mnt/cyber-sec-forensics/Resilient/{0}'.format(incident_id))): os.makedirs('/mnt/cyber-sec-forensics/Resilient/{0}'.format(incident_id))
@@ -193,29 +217,20 @@ class FunctionComponent(ResilientComponent):
                         finally:
                             os.unlink(temp_zip.name)  # Delete temporary temp_file
 
-                except TimeoutError:  # Catch TimeoutError and handle
-                    timeouts = timeouts + 1
-                    if timeouts <= MAX_TIMEOUTS: yield StatusMessage('[ERROR] TimeoutError was encountered. Reattempting... (' + str(timeouts) + '/' + str(MAX_TIMEOUTS) + ')')
-                    else:
-                        yield StatusMessage('[FATAL ERROR] TimeoutError was encountered. The maximum number of retries was reached. Aborting!')
-                        yield StatusMessage('[FAILURE] Fatal error caused exit!')
-                    try: session.close()
-                    except: pass
-                    sensor = (cb.select(Sensor).where('hostname:' + hostname))[0]  # Retrieve the latest CB sensor vitals
-                    sensor.restart_sensor()  # Restarting the sensor may avoid a timeout from occurring again
-                    time.sleep(30)  # Sleep to apply sensor restart
-                    sensor = (cb.select(Sensor).where('hostname:' + hostname))[0]  # Retrieve the latest CB sensor vitals
-                    continue
-
-                except(ApiError, ProtocolError, NewConnectionError, ConnectTimeoutError, MaxRetryError) as err:  # Catch urllib3 connection exceptions and handle
-                    if 'ApiError' in str(type(err).__name__) and 'network connection error' not in str(err): raise  # Only handle ApiError involving network connection error
+                except retry_policy.RETRYABLE_ERRORS as err:  # Catch CB timeouts and connection exceptions and handle
+                    if not retry_policy.is_retryable(err):  # Only handle ApiError involving network connection error
+                        try: session_broker.release_session(session)  # Return the session to the broker before giving up
+                        except: pass
+                        raise
                     timeouts = timeouts + 1
-                    if timeouts <= MAX_TIMEOUTS:
-                        yield StatusMessage('[ERROR] Carbon Black was unreachable. Reattempting in 30 minutes... (' + str(timeouts) + '/' + str(MAX_TIMEOUTS) + ')')
-                        time.sleep(1800)  # Sleep for 30 minutes, backup service may have been running.
+                    if retry_policy.rule_for(err).discard_session:
+                        try: session_broker.discard_session(session)  # Do not reuse a session that timed out
+                        except: pass
                     else:
-                        yield StatusMessage('[FATAL ERROR] ' + str(type(err).__name__) + ' was encountered. The maximum number of retries was reached. Aborting!')
-                        yield StatusMessage('[FAILURE] Fatal error caused exit!')
+                        try: session_broker.release_session(session)  # Return the session to the broker, the retry checks it out again
+                        except: pass
+                    session = None  # Returned to the broker, never return it twice
+                    for status_message in retry_policy.recover(cb, err, hostname, timeouts, MAX_TIMEOUTS): yield StatusMessage(status_message)  # Backs off per the error's rule, waits out CB outages together with every other job
                     continue
 
                 except Exception as err:  # Catch all other exceptions and abort
@@ -225,16 +240,19 @@ class FunctionComponent(ResilientComponent):
                 else:
                     results["was_successful"] = True
 
-                try: session.close()
+                try: session_broker.release_session(session)  # Keep the session warm for the next function
                 except: pass
-                yield StatusMessage('[INFO] Session has been closed to CB Sensor #' + str(sensor.id) + '(' + sensor.hostname + ')')
+                yield StatusMessage('[INFO] Session has been released to CB Sensor #' + str(sensor.id) + '(' + sensor.hostname + ')')
                 break
 
-            # Release the host lock if acquired
-            if lock_acquired is True:
-                os.remove(lock_file)
+            # Release the host lock if acquired, the next queued action on the host starts immediately
+            host_queue.release(host_ticket)
 
             # Produce a FunctionResult with the results
             yield FunctionResult(results)
         except Exception:
             yield FunctionError()
+        finally:
+            host_queue.release(host_ticket)  # Never leave the host's queue blocked after an unexpected error
+            phase_metrics.finish_run(job_metrics, results["was_successful"])  # Log and export the phase timings of the job
+            job_journal.finish(job_entry, results)  # The job is no longer in flight
@@ -3,7 +3,7 @@
 
 # This function will retrieve a file or directory from an endpoint in a ZIP file.
 # File: cb_retrieve_file_or_directory.py
-# Date: 04/04/2019 - Modified: 06/25/2019
+# Date: 04/04/2019 - Modified: 10/18/2026
 # Author: Jared F
 
 """Function implementation"""
@@ -20,10 +20,20 @@ import zipfile
 import logging
 import datetime
 from resilient_circuits import ResilientComponent, function, handler, StatusMessage, FunctionResult, FunctionError
-from cbapi.response import CbEnterpriseResponseAPI, Sensor
-from cbapi.errors import TimeoutError, ApiError
-from urllib3.exceptions import ProtocolError, NewConnectionError, ConnectTimeoutError, MaxRetryError
+from cbapi.response import CbEnterpriseResponseAPI
 import carbon_black.util.selftest as selftest
+import carbon_black.util.session_broker as session_broker
+import carbon_black.util.sensor_watcher as sensor_watcher
+import carbon_black.util.sensor_index as sensor_index
+import carbon_black.util.host_queue as host_queue
+import carbon_black.util.parking as parking
+import carbon_black.util.job_journal as job_journal
+import carbon_black.util.retry_policy as retry_policy
+import carbon_black.util.transfer as transfer
+import carbon_black.util.transfer_rate as transfer_rate
+import carbon_black.util.directory_scan as directory_scan
+import carbon_black.util.evidence_store as evidence_store
+import carbon_black.util.phase_metrics as phase_metrics
 
 cb = CbEnterpriseResponseAPI()  # CB Response API
 MAX_TIMEOUTS = 3  # The number of CB timeouts that must occur before the function aborts
@@ -31,7 +41,8 @@ DAYS_UNTIL_TIMEOUT = 3  # The number of days that must pass before the function
 
 MAX_FILE_SIZE = 100*1000000  # Bytes, the default maximum file size to transfer (per file), default = 100MB
 MAX_UPLOAD_SIZE = 50*1000000  # Maximum number of bytes of files to upload as an attachment before reverting to a netshare drop, default = 50MB
-TRANSFER_RATE = 225000  # Bytes per second, the expected minimum file transfer rate via Carbon Black
+MAX_PARALLEL_TRANSFERS = 4  # Files retrieved at once over the session, the sensor runs each as a separate get file command
+USE_EVIDENCE_STORE = True  # Skip files the evidence store already holds and deliver netshare drops as manifests into the store
 
 
 class FunctionComponent(ResilientComponent):
@@ -42,6 +53,8 @@ class FunctionComponent(ResilientComponent):
         super(FunctionComponent, self).__init__(opts)
         self.options = opts.get("carbon_black", {})
         selftest.selftest_function(opts)
+        parking.register("cb_retrieve_file_or_directory", self, cb)  # Resume this function's parked jobs once their hosts come online
+        if USE_EVIDENCE_STORE: evidence_store.register(self)  # Release the evidence of deleted incidents and bundles
 
     @handler("reload")
     def _reload(self, event, opts):
@@ -54,7 +67,9 @@ class FunctionComponent(ResilientComponent):
         results = {}
         results["was_successful"] = False
         results["hostname"] = None
-        lock_acquired = False
+        host_ticket = None  # This job's place in the host's job queue
+        job_metrics = None  # Phase timings of this job
+        job_entry = None  # This job's entry in the job journal
 
         try:
             # Get the function parameters:
@@ -65,20 +80,22 @@ class FunctionComponent(ResilientComponent):
 
             log = logging.getLogger(__name__)  # Establish logging
 
-            days_later_timeout_length = datetime.datetime.now() + datetime.timedelta(days=DAYS_UNTIL_TIMEOUT)  # Max duration length before aborting
-            hostname = hostname.upper()[:15]  # CB limits hostname to 15 characters
-            lock_file = '/home/integrations/.resilient/cb_host_locks/{}.lock'.format(hostname)
-            sensor = cb.select(Sensor).where('hostname:' + hostname)  # Query CB for the hostname's sensor
+            days_later_timeout_length = parking.deadline(datetime.datetime.now() + datetime.timedelta(days=DAYS_UNTIL_TIMEOUT))  # Max duration length before aborting, a resumed job keeps its parked deadline
+            hostname = sensor_index.hostname_key(hostname)  # CB limits hostname to 15 characters
+            sensor = sensor_index.find(cb, hostname)  # Resolve the hostname's sensor from the in-memory sensor index
             timeouts = 0  # Number of timeouts that have occurred
 
-            if len(sensor) <= 0:  # Host does not have CB agent, abort
+            if sensor is None:  # Host does not have CB agent, abort
                 yield StatusMessage("[FATAL ERROR] CB could not find hostname: " + str(hostname))
                 yield StatusMessage('[FAILURE] Fatal error caused exit!')
                 yield FunctionResult(results)
                 return
 
-            sensor = sensor[0]  # Get the sensor object from the query
             results["hostname"] = str(hostname).upper()
+            host_ticket = host_queue.enqueue(hostname, 'cb_retrieve_file_or_directory')  # Queue behind any running or waiting actions on the host
+            job_metrics = phase_metrics.start_run('cb_retrieve_file_or_directory', hostname, sensor.id)  # Time each phase of the job against the host
+            job_entry = job_journal.start('cb_retrieve_file_or_directory', incident_id, hostname, sensor.id, kwargs, days_later_timeout_length)  # Journal the job so a restart does not lose it
+            checkpoint = transfer.TransferCheckpoint(hostname, 'cb_retrieve_file_or_directory', path_or_file)  # Retrieved byte ranges and files survive TimeoutError retries
 
             while timeouts <= MAX_TIMEOUTS:  # Max timeouts before aborting
 
@@ -88,37 +105,40 @@ class FunctionComponent(ResilientComponent):
 
                     # Check if the sensor is queued to restart, wait up to 90 seconds before checking online status
                     three_minutes_passed = datetime.datetime.now() + datetime.timedelta(minutes=3)
-                    while (sensor.restart_queued is True) and (three_minutes_passed >= now):
-                        time.sleep(3)  # Give the CPU a break, it works hard!
-                        now = datetime.datetime.now()
-                        sensor = (cb.select(Sensor).where('hostname:' + hostname))[0]  # Retrieve the latest CB sensor vitals
+                    sensor = sensor_watcher.wait_for(cb, hostname, lambda s: s.restart_queued is not True, three_minutes_passed, sensor)  # Woken by the fleet-wide sensor watcher, no per-function polling
+                    now = datetime.datetime.now()
+
+                    # Park the job instead of holding a worker while the host is offline, it runs again once the host comes online
+                    if sensor.status != "Online" and parking.should_park():
+                        parking.park('cb_retrieve_file_or_directory', incident_id, hostname, kwargs, days_later_timeout_length)
+                        results["parked"] = True
+                        yield StatusMessage('[INFO] Hostname: ' + str(hostname) + ' is offline. The job is parked and will run once the host comes online, for up to ' + str(DAYS_UNTIL_TIMEOUT) + ' days...')
+                        break
 
                     # Check online status
                     if sensor.status != "Online":
                         yield StatusMessage('[WARNING] Hostname: ' + str(hostname) + ' is offline. Will attempt for ' + str(DAYS_UNTIL_TIMEOUT) + ' days...')
 
                     # Check lock status
-                    if os.path.exists(lock_file) and lock_acquired is False:
-                        yield StatusMessage('[WARNING] A running action has a lock on  ' + str(hostname) + '. Will attempt for ' + str(DAYS_UNTIL_TIMEOUT) + ' days...')
+                    if host_queue.jobs_ahead(host_ticket) > 0:
+                        yield StatusMessage('[WARNING] A running action has a lock on  ' + str(hostname) + ' (' + str(host_queue.jobs_ahead(host_ticket)) + ' queued ahead). Will attempt for ' + str(DAYS_UNTIL_TIMEOUT) + ' days...')
 
                     # Wait for offline and locked hosts for days_later_timeout_length
-                    while (sensor.status != "Online" or (os.path.exists(lock_file) and lock_acquired is False)) and (days_later_timeout_length >= now):
-                        time.sleep(3)  # Give the CPU a break, it works hard!
-                        now = datetime.datetime.now()
-                        sensor = (cb.select(Sensor).where('hostname:' + hostname))[0]  # Retrieve the latest sensor vitals
+                    sensor = sensor_watcher.wait_for(cb, hostname, lambda s: s.status == "Online", days_later_timeout_length, sensor)
+                    if sensor.status == "Online":
+                        host_queue.wait_for_turn(host_ticket, days_later_timeout_length)  # Handed the host as soon as the job ahead releases it
+                    now = datetime.datetime.now()
 
                     # Abort after DAYS_UNTIL_TIMEOUT
-                    if sensor.status != "Online" or (os.path.exists(lock_file) and lock_acquired is False):
+                    if sensor.status != "Online" or not host_ticket.acquired:
                         yield StatusMessage('[FATAL ERROR] Hostname: ' + str(hostname) + ' is still offline!')
                         yield StatusMessage('[FAILURE] Fatal error caused exit!')
                         break
 
                     # Check if the sensor is queued to restart, wait up to 90 seconds before continuing
                     three_minutes_passed = datetime.datetime.now() + datetime.timedelta(minutes=3)
-                    while (sensor.restart_queued is True) and (three_minutes_passed >= now):  # If the sensor is queued to restart, wait up to 90 seconds
-                        time.sleep(3)  # Give the CPU a break, it works hard!
-                        now = datetime.datetime.now()
-                        sensor = (cb.select(Sensor).where('hostname:' + hostname))[0]  # Retrieve the latest CB sensor vitals
+                    sensor = sensor_watcher.wait_for(cb, hostname, lambda s: s.restart_queued is not True, three_minutes_passed, sensor)  # Woken by the fleet-wide sensor watcher, no per-function polling
+                    now = datetime.datetime.now()
 
                     # Verify the incident still exists and is reachable, if not abort
                     try: incident = self.rest_client().get('/incidents/{0}?text_content_output_format=always_text&handle_format=names'.format(str(incident_id)))
@@ -131,18 +151,9 @@ class FunctionComponent(ResilientComponent):
                             log.info('[FAILURE] Fatal error caused exit!')
                         break
 
-                    # Acquire host lock
-                    if lock_acquired is False:
-                        try:
-                            f = os.fdopen(os.open(lock_file, os.O_CREAT | os.O_WRONLY | os.O_EXCL), 'w')
-                            f.close()
-                            lock_acquired = True
-                        except OSError:
-                            continue
-
                     # Establish a session to the host sensor
                     yield StatusMessage('[INFO] Establishing session to CB Sensor #' + str(sensor.id) + ' (' + sensor.hostname + ')')
-                    session = cb.live_response.request_session(sensor.id)
+                    session = session_broker.request_session(cb, sensor.id)  # Reuse a warm session to the sensor if the broker holds one
                     yield StatusMessage('[SUCCESS] Connected on Session #' + str(session.session_id) + ' to CB Sensor #' + str(sensor.id) + ' (' + sensor.hostname + ')')
 
                     files_to_retrieve = []  # Stores log file path located for retrieval
@@ -154,47 +165,68 @@ class FunctionComponent(ResilientComponent):
 
                     yield StatusMessage('[INFO] Retrieving ' + str(os.path.normpath(path_or_file)))
 
-                    if 'DIRECTORY' not in session.list_directory(path_or_file)[0]['attributes']:  # If path_or_file is a file
+                    listing = session.list_directory(path_or_file)[0]  # Listing of path_or_file, holds the attributes, size in bytes and last write time
+                    if 'DIRECTORY' not in listing['attributes']:  # If path_or_file is a file
                         file_path = os.path.normpath(path_or_file)
-                        file_size = session.list_directory(file_path)[0]['size']  # File size in bytes
-                        custom_timeout = int((file_size / TRANSFER_RATE) + 120)  # The expected timeout duration + 120 seconds for good measure
-                        if 0 < file_size < int(max_file_size):  # If the file has data and does not exceed max_file_size
+                        if 0 < listing['size'] < int(max_file_size):  # If the file has data and does not exceed max_file_size
                             log.info('[INFO] Located: ' + file_path)
-                            files_to_retrieve.append([file_path, custom_timeout])  # Store the file path and custom timeout into files_to_retrieve
+                            files_to_retrieve.append([file_path, listing])  # Store the file path and listing into files_to_retrieve
 
                     else:  # path_or_file is a path
-                        path = session.walk(path_or_file, False)  # Walk everything. False performs a bottom->up walk, not top->down
-                        for item in path:  # For each subdirectory in the path
-                            directory = os.path.normpath((str(item[0])))  # The subdirectory in OS path syntax
-                            file_list = item[2]  # List of files in the subdirectory
-                            if str(file_list) != '[]':  # If the subdirectory is not empty
-                                for f in file_list:  # For each file in the subdirectory
-                                    file_path = os.path.normpath(directory + '\\' + f)
-                                    file_size = session.list_directory(file_path)[0]['size']  # File size in bytes
-                                    custom_timeout = int((file_size / TRANSFER_RATE) + 120)  # The expected timeout duration + 120 seconds for good measure
-                                    if 0 < file_size < int(max_file_size):  # If the file has data and does not exceed max_file_size
-                                        log.info('[INFO] Located: ' + file_path)
-                                        files_to_retrieve.append([file_path, custom_timeout])  # Store the file path into files_to_retrieve
+                        scan = directory_scan.scan(session, path_or_file)  # Scan everything, one round trip per directory returns every file's size
+                        for file_path, listing in scan.files:
+                            if 0 < listing['size'] < int(max_file_size):  # If the file has data and does not exceed max_file_size
+                                log.info('[INFO] Located: ' + file_path)
+                                files_to_retrieve.append([file_path, listing])  # Store the file path and listing into files_to_retrieve
+                        if scan.skipped: yield StatusMessage('[WARNING] ' + str(len(scan.skipped)) + ' directory(s) could not be listed and were skipped: ' + ', '.join(scan.skipped))
+
+                    files_to_retrieve.sort(key=lambda each_file: (each_file[1]['size'], each_file[0]))  # Smallest first, most files are retrieved before a slow transfer can time out
+
+                    if checkpoint.received_bytes() > 0:
+                        yield StatusMessage('[INFO] Resuming retrieval, ' + str(checkpoint.received_bytes()) + ' bytes were retrieved before the last retry')
+
+                    stored_files = {}  # Endpoint file path -> sha256 of files the evidence store already holds, referenced by the incident
+                    if USE_EVIDENCE_STORE:
+                        files_to_hash = [[each_file, listing] for each_file, listing in files_to_retrieve if listing['size'] >= evidence_store.MIN_DEDUP_SIZE]
+                        if files_to_hash:
+                            yield StatusMessage('[INFO] Hashing ' + str(len(files_to_hash)) + ' file(s) on Sensor to skip evidence that was already retrieved...')
+                            hashes = evidence_store.endpoint_hashes(session, [each_file for each_file, listing in files_to_hash], evidence_store.hash_timeout(sum(listing['size'] for each_file, listing in files_to_hash)))
+                            if not hashes: yield StatusMessage('[WARNING] Sensor could not hash the files, retrieving all of them...')
+                            stored_files = dict((each_file, sha256) for each_file, sha256 in hashes.items() if evidence_store.reference(sha256, incident_id))  # Referenced once matched, a sweep cannot delete them before delivery
+                            if stored_files: yield StatusMessage('[INFO] ' + str(len(stored_files)) + ' file(s) are already held in the evidence store and will not be transferred')
+
+                    files_to_transfer = [[each_file, listing] for each_file, listing in files_to_retrieve if each_file not in stored_files]
+                    yield StatusMessage('[INFO] Retrieving ' + str(len(files_to_transfer)) + ' file(s), up to ' + str(MAX_PARALLEL_TRANSFERS) + ' at once...')
+                    local_files = dict(zip([each_file for each_file, listing in files_to_transfer], transfer.retrieve_files(session, checkpoint, files_to_transfer, MAX_PARALLEL_TRANSFERS)))  # Retrieve in checkpointed ranges, skips ranges and files already retrieved
+
+                    bundle = []  # [path within the ZIP file, endpoint file path, local file path holding the content] for each file
+                    for each_file, listing in files_to_retrieve:  # For each located file, in the order located
+                        base_directory = os.path.dirname(path_or_file.replace('\\', os.sep))
+                        file_directory = os.path.dirname(each_file.replace('\\', os.sep).replace(base_directory, ''))
+                        file_path = file_directory + os.sep + os.path.basename(each_file.replace('\\', os.sep))
+                        bundle.append([file_path, each_file, local_files.get(each_file) or evidence_store.object_path(stored_files[each_file])])
 
                     with tempfile.NamedTemporaryFile(delete=False) as temp_zip:  # Create temporary temp_zip for creating zip_file
                         try:
-                            with zipfile.ZipFile(temp_zip, 'w') as zip_file:  # Establish zip_file from temporary temp_zip for packaging logs into
-                                for each_file, custom_timeout in files_to_retrieve:  # For each located log file
-                                    with tempfile.NamedTemporaryFile(delete=False) as temp_file:  # Create temp_file for log
-                                        try:
-                                            base_directory = os.path.dirname(path_or_file.replace('\\', os.sep))
-                                            file_directory = os.path.dirname(each_file.replace('\\', os.sep).replace(base_directory, ''))
-                                            file_path = file_directory + os.sep + os.path.basename(each_file.replace('\\', os.sep))
-                                            temp_file.write(session.get_file(each_file, timeout=custom_timeout))  # Write the log to temp_file
-                                            temp_file.close()
-                                            zip_file.write(temp_file.name, file_path, compress_type=zipfile.ZIP_DEFLATED)  # Write temp_file into zip_file
-
-                                        finally:
-                                            os.unlink(temp_file.name)  # Delete temporary temp_file
-
-                            if os.stat(temp_zip.name).st_size <= MAX_UPLOAD_SIZE:
-                                self.rest_client().post_attachment('/incidents/{0}/attachments'.format(incident_id), temp_zip.name, '{0}-retrieved.zip'.format(sensor.hostname))  # Post temp_zip to incident
+                            as_attachment = True  # False once the ZIP file is too large to attach, the files are then delivered through the evidence store
+                            with phase_metrics.phase(phase_metrics.ZIP), zipfile.ZipFile(temp_zip, 'w') as zip_file:  # Establish zip_file from temporary temp_zip for packaging logs into
+                                for file_path, each_file, local_file in bundle:  # For each retrieved file, in the order located
+                                    zip_file.write(local_file, file_path, compress_type=zipfile.ZIP_DEFLATED)  # Write the retrieved file into zip_file
+                                    if USE_EVIDENCE_STORE and not transfer_rate.deliver_as_attachment(temp_zip.tell(), MAX_UPLOAD_SIZE):  # A manifest will be written, never finish the ZIP file
+                                        as_attachment = False
+                                        break
+
+                            if as_attachment and transfer_rate.deliver_as_attachment(os.stat(temp_zip.name).st_size, MAX_UPLOAD_SIZE):  # Within the size limit and expected to upload in time
+                                with transfer_rate.measure(transfer_rate.RESILIENT, os.stat(temp_zip.name).st_size):  # Learn the Resilient upload rate
+                                    phase_metrics.post_attachment(self.rest_client(), '/incidents/{0}/attachments'.format(incident_id), temp_zip.name, '{0}-retrieved.zip'.format(sensor.hostname))  # Post temp_zip to incident
+                                for sha256 in stored_files.values(): evidence_store.unreference(sha256, incident_id)  # Attached, the incident does not hold the stored files
                                 yield StatusMessage('[SUCCESS] Posted a ZIP file of the the file/directory to the incident as an attachment!')
+                            elif USE_EVIDENCE_STORE:  # Files are held once in the evidence store, the incident gets a manifest pointing into it
+                                manifest = []  # [path within the ZIP file, endpoint file path, sha256] for each file, held in the evidence store and referenced by the incident
+                                for file_path, each_file, local_file in bundle:
+                                    manifest.append([file_path, each_file, stored_files.get(each_file) or evidence_store.add(local_file, incident_id)])  # Stored files were referenced when matched
+                                evidence_store.write_manifest('/mnt/cyber-sec-forensics/Resilient/{0}/{1}-retrieved-{2}.json'.format(incident_id, sensor.hostname, str(int(time.time()))), incident_id, sensor.hostname, manifest)
+                                yield StatusMessage('[SUCCESS] Posted a manifest of the the file/directory to the forensics network share, the files are held in the evidence store!')
                             else:
                                 if not os.path.exists(os.path.normpath('/mnt/cyber-sec-forensics/Resilient/{0}'.format(incident_id))): os.makedirs('/mnt/cyber-sec-forensics/Resilient/{0}'.format(incident_id))
                                 shutil.copyfile(temp_zip.name, '/mnt/cyber-sec-forensics/Resilient/{0}/{1}-retrieved-{2}.zip'.format(incident_id, sensor.hostname, str(int(time.time()))))  # Post temp_zip to network share
@@ -203,29 +235,20 @@ class FunctionComponent(ResilientComponent):
                         finally:
                             os.unlink(temp_zip.name)  # Delete temporary temp_file
 
-                except TimeoutError:  # Catch TimeoutError and handle
+                except retry_policy.RETRYABLE_ERRORS as err:  # Catch CB timeouts and connection exceptions and handle
+                    if not retry_policy.is_retryable(err):  # Only handle ApiError involving network connection error
+                        try: session_broker.release_session(session)  # Return the session to the broker before giving up
+                        except: pass
+                        raise
                     timeouts = timeouts + 1
-                    if timeouts <= MAX_TIMEOUTS: yield StatusMessage('[ERROR] TimeoutError was encountered. Reattempting... (' + str(timeouts) + '/' + str(MAX_TIMEOUTS) + ')')
+                    if retry_policy.rule_for(err).discard_session:
+                        try: session_broker.discard_session(session)  # Do not reuse a session that timed out
+                        except: pass
                     else:
-                        yield StatusMessage('[FATAL ERROR] TimeoutError was encountered. The maximum number of retries was reached. Aborting!')
-                        yield StatusMessage('[FAILURE] Fatal error caused exit!')
-                    try: session.close()
-                    except: pass
-                    sensor = (cb.select(Sensor).where('hostname:' + hostname))[0]  # Retrieve the latest CB sensor vitals
-                    sensor.restart_sensor()  # Restarting the sensor may avoid a timeout from occurring again
-                    time.sleep(30)  # Sleep to apply sensor restart
-                    sensor = (cb.select(Sensor).where('hostname:' + hostname))[0]  # Retrieve the latest CB sensor vitals
-                    continue
-
-                except(ApiError, ProtocolError, NewConnectionError, ConnectTimeoutError, MaxRetryError) as err:  # Catch urllib3 connection exceptions and handle
-                    if 'ApiError' in str(type(err).__name__) and 'network connection error' not in str(err): raise  # Only handle ApiError involving network connection error
-                    timeouts = timeouts + 1
-                    if timeouts <= MAX_TIMEOUTS:
-                        yield StatusMessage('[ERROR] Carbon Black was unreachable. Reattempting in 30 minutes... (' + str(timeouts) + '/' + str(MAX_TIMEOUTS) + ')')
-                        time.sleep(1800)  # Sleep for 30 minutes, backup service may have been running.
-                    else:
-                        yield StatusMessage('[FATAL ERROR] ' + str(type(err).__name__) + ' was encountered. The maximum number of retries was reached. Aborting!')
-                        yield StatusMessage('[FAILURE] Fatal error caused exit!')
+                        try: session_broker.release_session(session)  # Return the session to the broker, the retry checks it out again
+                        except: pass
+                    session = None  # Returned to the broker, never return it twice
+                    for status_message in retry_policy.recover(cb, err, hostname, timeouts, MAX_TIMEOUTS): yield StatusMessage(status_message)  # Backs off per the error's rule, waits out CB outages together with every other job
                     continue
 
                 except Exception as err:  # Catch all other exceptions and abort
@@ -234,17 +257,21 @@ class FunctionComponent(ResilientComponent):
 
                 else:
                     results["was_successful"] = True
+                    checkpoint.clear()  # Delivered, the retrieved files are no longer needed
 
-                try: session.close()
+                try: session_broker.release_session(session)  # Keep the session warm for the next function
                 except: pass
-                yield StatusMessage('[INFO] Session has been closed to CB Sensor #' + str(sensor.id) + '(' + sensor.hostname + ')')
+                yield StatusMessage('[INFO] Session has been released to CB Sensor #' + str(sensor.id) + '(' + sensor.hostname + ')')
                 break
 
-            # Release the host lock if acquired
-            if lock_acquired is True:
-                os.remove(lock_file)
+            # Release the host lock if acquired, the next queued action on the host starts immediately
+            host_queue.release(host_ticket)
 
             # Produce a FunctionResult with the results
             yield FunctionResult(results)
         except Exception:
             yield FunctionError()
+        finally:
+            host_queue.release(host_ticket)  # Never leave the host's queue blocked after an unexpected error
+            phase_metrics.finish_run(job_metrics, results["was_successful"])  # Log and export the phase timings of the job
+            job_journal.finish(job_entry, results)  # The job is no longer in flight
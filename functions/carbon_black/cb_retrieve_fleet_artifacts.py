@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+# pragma pylint: disable=unused-argument, no-self-use
+
+# This function will run one live response collection across many endpoints and retrieve the results in a single ZIP file.
+# File: cb_retrieve_fleet_artifacts.py
+# Date: 10/18/2026
+# Author: Jared F
+
+"""Function implementation"""
+#   @function -> cb_retrieve_fleet_artifacts
+#   @params -> integer: incident_id, string: collector, string: hostnames (optional), string: sensor_group (optional), int: max_parallel (optional)
+#   @return -> boolean: results['was_successful'], list: results['succeeded'], dict: results['failed']
+
+
+import os
+import re
+import csv
+import time
+import uuid
+import shutil
+import zipfile
+import logging
+import datetime
+import tempfile
+import threading
+from six.moves import queue
+from resilient_circuits import ResilientComponent, function, handler, StatusMessage, FunctionResult, FunctionError
+from cbapi.response import CbEnterpriseResponseAPI, Sensor, SensorGroup
+import carbon_black.util.selftest as selftest
+import carbon_black.util.session_broker as session_broker
+import carbon_black.util.sensor_watcher as sensor_watcher
+import carbon_black.util.sensor_index as sensor_index
+import carbon_black.util.host_queue as host_queue
+import carbon_black.util.retry_policy as retry_policy
+import carbon_black.util.collectors as collectors
+import carbon_black.util.transfer_rate as transfer_rate
+import carbon_black.util.phase_metrics as phase_metrics
+
+cb = CbEnterpriseResponseAPI()  # CB Response API
+MAX_TIMEOUTS = 3  # The number of CB timeouts that must occur on a host before that host is given up on
+DAYS_UNTIL_TIMEOUT = 3  # The number of days that must pass before hosts still offline are given up on
+
+MAX_PARALLEL = 10  # Default number of hosts collected from at once, keep at or below session_broker.MAX_SESSIONS
+PROGRESS_INTERVAL = 60  # Seconds between progress status messages
+MAX_UPLOAD_SIZE = 50*1000000  # Maximum number of bytes of files to upload as an attachment before reverting to a netshare drop, default = 50MB
+
+
+def collect_from_host(sensor, collector, output_path, deadline, budget_key):
+    """
+    Run a collector on one host, waiting on its host queue and retrying timeouts and CB outages per the shared retry policy
+    :param sensor: the host's sensor object
+    :param collector: collector name from collectors.COLLECTOR_NAMES
+    :param output_path: local file path the report is written to
+    :param deadline: datetime.datetime after which waiting on the host lock is given up
+    :param budget_key: key shared by every host of the fleet run, the run takes one slot of the job budget
+    :return: (boolean: was_successful, string: detail)
+    """
+    hostname = sensor_watcher.SensorWatcher.hostname_key(sensor.hostname)
+    host_ticket = host_queue.enqueue(hostname, 'cb_retrieve_fleet_artifacts', budget_key=budget_key)
+    try:
+        if not host_queue.wait_for_turn(host_ticket, deadline):
+            return False, 'A running action kept its lock on the host'
+
+        timeouts = 0  # Number of timeouts that have occurred
+        while True:
+            session = session_broker.request_session(cb, sensor.id)  # Reuse a warm session to the sensor if the broker holds one
+            try:
+                collectors.collect(cb, session, collector, output_path)
+
+            except retry_policy.RETRYABLE_ERRORS as err:
+                if not retry_policy.is_retryable(err):
+                    session_broker.release_session(session)
+                    raise
+                if retry_policy.rule_for(err).discard_session: session_broker.discard_session(session)  # Do not reuse a session that timed out
+                else: session_broker.release_session(session)
+                timeouts = timeouts + 1
+                if timeouts > MAX_TIMEOUTS:
+                    return False, str(type(err).__name__) + ' was encountered. The maximum number of retries was reached'
+                retry_policy.backoff(cb, err, sensor.hostname, timeouts)  # Restarts the sensor and backs off, or waits out a CB outage together with every other job
+                continue
+
+            except Exception:
+                session_broker.release_session(session)
+                raise
+
+            session_broker.release_session(session)  # Keep the session warm for the next function
+            return True, 'Collected'
+
+    except Exception as err:
+        return False, 'Encountered: ' + str(err)
+
+    finally:
+        host_queue.release(host_ticket)
+
+
+class FunctionComponent(ResilientComponent):
+    """Component that implements Resilient function 'cb_retrieve_fleet_artifacts"""
+
+    def __init__(self, opts):
+        """constructor provides access to the configuration options"""
+        super(FunctionComponent, self).__init__(opts)
+        self.options = opts.get("carbon_black", {})
+        selftest.selftest_function(opts)
+
+    @handler("reload")
+    def _reload(self, event, opts):
+        """Configuration options have changed, save new values"""
+        self.options = opts.get("carbon_black", {})
+
+    @function("cb_retrieve_fleet_artifacts")
+    def _cb_retrieve_fleet_artifacts_function(self, event, *args, **kwargs):
+
+        results = {}
+        results["was_successful"] = False
+        results["succeeded"] = []
+        results["failed"] = {}
+        watched = []  # Hostnames subscribed to the sensor watcher
+
+        try:
+            # Get the function parameters:
+            incident_id = kwargs.get("incident_id")  # number
+            collector = kwargs.get("collector")  # text
+            hostnames = kwargs.get("hostnames")  # text, hostnames separated by commas, semicolons or whitespace
+            sensor_group = kwargs.get("sensor_group")  # text, sensor group name or ID
+            max_parallel = kwargs.get("max_parallel")  # number
+
+            log = logging.getLogger(__name__)  # Establish logging
+            watcher = sensor_watcher.SensorWatcher.get_watcher()
+
+            days_later_timeout_length = datetime.datetime.now() + datetime.timedelta(days=DAYS_UNTIL_TIMEOUT)  # Max duration length before aborting
+            if max_parallel is None: max_parallel = MAX_PARALLEL
+            max_parallel = max(1, int(max_parallel))
+
+            if collector not in collectors.COLLECTOR_NAMES:
+                yield StatusMessage('[FATAL ERROR] Unknown collector: ' + str(collector) + '. Use one of: ' + ', '.join(collectors.COLLECTOR_NAMES))
+                yield StatusMessage('[FAILURE] Fatal error caused exit!')
+                yield FunctionResult(results)
+                return
+
+            # Verify the incident still exists and is reachable, if not abort
+            try: incident = self.rest_client().get('/incidents/{0}?text_content_output_format=always_text&handle_format=names'.format(str(incident_id)))
+            except Exception as err:
+                yield StatusMessage('[FATAL ERROR] Incident ID ' + str(incident_id) + ' could not be reached: ' + str(err))
+                yield StatusMessage('[FAILURE] Fatal error caused exit!')
+                yield FunctionResult(results)
+                return
+
+            # Resolve the targeted hosts from the host list and sensor group
+            targets = set(sensor_index.hostname_key(h) for h in re.split(r'[\s,;]+', hostnames or '') if h)  # CB limits hostname to 15 characters
+            if sensor_group:
+                if str(sensor_group).isdigit(): group_ids = [int(sensor_group)]
+                else: group_ids = [g.id for g in cb.select(SensorGroup) if str(g.name).lower() == str(sensor_group).lower()]
+                if not group_ids:
+                    yield StatusMessage('[FATAL ERROR] CB could not find sensor group: ' + str(sensor_group))
+                    yield StatusMessage('[FAILURE] Fatal error caused exit!')
+                    yield FunctionResult(results)
+                    return
+                for group_id in group_ids:
+                    targets.update(watcher.hostname_key(s.hostname) for s in cb.select(Sensor).where('groupid:' + str(group_id)))
+
+            watcher.refresh(cb)  # One batch query resolves every targeted host
+            pending = []
+            for hostname in sorted(targets):
+                if watcher.get_sensor(hostname) is None:
+                    results["failed"][hostname] = 'CB could not find hostname'
+                else:
+                    pending.append(hostname)
+                    watcher.subscribe(cb, hostname)
+                    watched.append(hostname)
+
+            if not pending:
+                yield StatusMessage('[FATAL ERROR] None of the targeted hosts were found in CB.')
+                yield StatusMessage('[FAILURE] Fatal error caused exit!')
+                yield FunctionResult(results)
+                return
+
+            yield StatusMessage('[INFO] Running the ' + collector + ' collector on ' + str(len(pending)) + ' hosts, ' + str(max_parallel) + ' at a time...')
+
+            work_directory = tempfile.mkdtemp()  # Per-host reports are collected here before zipping
+            try:
+                completed = queue.Queue()  # Workers report (hostname, was_successful, detail) here
+                budget_key = uuid.uuid4().hex  # Every host of this run shares one slot of the host queue's job budget, max_parallel bounds the run
+                running = {}
+                next_progress = time.time() + PROGRESS_INTERVAL
+                total = len(pending) + len(results["failed"])  # Hosts CB could not find already count as done
+
+                def run_host(hostname, sensor, output_path):
+                    job_metrics = None
+                    was_successful, detail = False, 'Collection did not complete'
+                    try:
+                        job_metrics = phase_metrics.start_run('cb_retrieve_fleet_artifacts', hostname, sensor.id)  # Each host's collection is timed as its own job
+                        was_successful, detail = collect_from_host(sensor, collector, output_path, days_later_timeout_length, budget_key)
+                    except Exception as err:
+                        detail = 'Encountered: ' + str(err)
+                    finally:
+                        try: phase_metrics.finish_run(job_metrics, was_successful)
+                        except Exception as err: log.error('[ERROR] Could not record the phase timings of ' + hostname + ': ' + str(err))
+                        completed.put((hostname, was_successful, detail))  # Always reported, the loop waits on every running host
+
+                while pending or running:
+                    # Start online hosts while under the parallelism bound, offline hosts wait without taking a slot
+                    for hostname in list(pending):
+                        if len(running) >= max_parallel:
+                            break
+                        sensor = watcher.get_sensor(hostname)
+                        if sensor is not None and sensor.status == "Online" and sensor.restart_queued is not True:
+                            pending.remove(hostname)
+                            output_path = os.path.join(work_directory, '{0}-{1}'.format(hostname, collectors.report_file_name(collector)))
+                            worker = threading.Thread(target=run_host, args=(hostname, sensor, output_path), name='cb-fleet-' + hostname)
+                            worker.daemon = True
+                            running[hostname] = worker
+                            worker.start()
+
+                    # Give up on hosts still offline after DAYS_UNTIL_TIMEOUT
+                    if pending and datetime.datetime.now() > days_later_timeout_length:
+                        for hostname in pending:
+                            results["failed"][hostname] = 'Hostname is still offline'
+                        pending = []
+
+                    # Collect finished hosts
+                    try:
+                        finished = [completed.get(timeout=3)]
+                        while not completed.empty(): finished.append(completed.get_nowait())
+                    except queue.Empty:
+                        finished = []
+                    for hostname, was_successful, detail in finished:
+                        running.pop(hostname, None)
+                        if was_successful: results["succeeded"].append(hostname)
+                        else: results["failed"][hostname] = detail
+                        log.info('[INFO] ' + hostname + ': ' + detail)
+
+                    if time.time() >= next_progress or not (pending or running):
+                        next_progress = time.time() + PROGRESS_INTERVAL
+                        yield StatusMessage('[INFO] Progress: ' + str(len(results["succeeded"]) + len(results["failed"])) + '/' + str(total) + ' hosts done (' + str(len(results["succeeded"])) + ' succeeded, ' + str(len(results["failed"])) + ' failed), ' + str(len(running)) + ' running, ' + str(len(pending)) + ' waiting')
+
+                # Package every host's report and a summary into one ZIP file, ordered by hostname
+                with tempfile.NamedTemporaryFile(delete=False) as temp_zip:  # Create temporary temp_zip for creating zip_file
+                    try:
+                        with zipfile.ZipFile(temp_zip, 'w') as zip_file:  # Establish zip_file from temporary temp_zip for packaging reports into
+                            for hostname in sorted(results["succeeded"]):
+                                report_name = '{0}-{1}'.format(hostname, collectors.report_file_name(collector))
+                                zip_file.write(os.path.join(work_directory, report_name), report_name, compress_type=zipfile.ZIP_DEFLATED)
+
+                            summary_path = os.path.join(work_directory, 'fleet_summary.csv')
+                            with open(summary_path, 'w') as summary_file:
+                                summary_writer = csv.writer(summary_file)
+                                summary_writer.writerow(['Hostname:', 'Result:', 'Detail:'])
+                                for hostname in sorted(results["succeeded"]):
+                                    summary_writer.writerow([hostname, 'Succeeded', 'Collected'])
+                                for hostname in sorted(results["failed"]):
+                                    summary_writer.writerow([hostname, 'Failed', results["failed"][hostname]])
+                            zip_file.write(summary_path, 'fleet_summary.csv', compress_type=zipfile.ZIP_DEFLATED)
+
+                        if transfer_rate.deliver_as_attachment(os.stat(temp_zip.name).st_size, MAX_UPLOAD_SIZE):  # Within the size limit and expected to upload in time
+                            with transfer_rate.measure(transfer_rate.RESILIENT, os.stat(temp_zip.name).st_size):  # Learn the Resilient upload rate
+                                self.rest_client().post_attachment('/incidents/{0}/attachments'.format(incident_id), temp_zip.name, 'fleet-{0}.zip'.format(collector))  # Post temp_zip to incident
+                            yield StatusMessage('[SUCCESS] Posted a ZIP file of the fleet ' + collector + ' collection to the incident as an attachment!')
+                        else:
+                            if not os.path.exists(os.path.normpath('/mnt/cyber-sec-forensics/Resilient/{0}'.format(incident_id))): os.makedirs('/mnt/cyber-sec-forensics/Resilient/{0}'.format(incident_id))
+                            shutil.copyfile(temp_zip.name, '/mnt/cyber-sec-forensics/Resilient/{0}/fleet-{1}-{2}.zip'.format(incident_id, collector, str(int(time.time()))))  # Post temp_zip to network share
+                            yield StatusMessage('[SUCCESS] Posted a ZIP file of the fleet ' + collector + ' collection to the forensics network share!')
+
+                    finally:
+                        os.unlink(temp_zip.name)  # Delete temporary temp_zip
+
+            finally:
+                shutil.rmtree(work_directory, ignore_errors=True)  # Delete the per-host reports
+
+            results["was_successful"] = len(results["succeeded"]) > 0
+            if results["failed"]:
+                yield StatusMessage('[WARNING] ' + str(len(results["failed"])) + ' hosts failed, see fleet_summary.csv for details.')
+
+            # Produce a FunctionResult with the results
+            yield FunctionResult(results)
+        except Exception:
+            yield FunctionError()
+        finally:
+            for hostname in watched:
+                sensor_watcher.SensorWatcher.get_watcher().unsubscribe(hostname)
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+# pragma pylint: disable=unused-argument, no-self-use
+
+# This function will run a set of triage collectors on an endpoint in one session and retrieve their reports in a single ZIP file.
+# File: cb_retrieve_triage_bundle.py
+# Date: 10/18/2026
+# Author: Jared F
+
+"""Function implementation"""
+#   @function -> cb_retrieve_triage_bundle
+#   @params -> integer: incident_id, string: hostname, string: triage_collectors (optional)
+#   @return -> boolean: results['was_successful'], string: results['hostname'], list: results['collected'], dict: results['failed']
+
+
+import os
+import csv
+import time
+import shutil
+import zipfile
+import tempfile
+import logging
+import datetime
+from resilient_circuits import ResilientComponent, function, handler, StatusMessage, FunctionResult, FunctionError
+from cbapi.response import CbEnterpriseResponseAPI
+import carbon_black.util.selftest as selftest
+import carbon_black.util.session_broker as session_broker
+import carbon_black.util.sensor_watcher as sensor_watcher
+import carbon_black.util.sensor_index as sensor_index
+import carbon_black.util.host_queue as host_queue
+import carbon_black.util.parking as parking
+import carbon_black.util.job_journal as job_journal
+import carbon_black.util.retry_policy as retry_policy
+import carbon_black.util.collectors as collectors
+import carbon_black.util.transfer_rate as transfer_rate
+import carbon_black.util.phase_metrics as phase_metrics
+
+cb = CbEnterpriseResponseAPI()  # CB Response API
+MAX_TIMEOUTS = 3  # The number of CB timeouts that must occur before the function aborts
+DAYS_UNTIL_TIMEOUT = 3  # The number of days that must pass before the function aborts
+MAX_UPLOAD_SIZE = 50*1000000  # Maximum number of bytes of files to upload as an attachment before reverting to a netshare drop, default = 50MB
+
+# Collectors run when triage_collectors is not given, the standard triage playbook
+TRIAGE_COLLECTORS = ['process_list', 'services', 'autoruns', 'active_network_connections', 'scheduled_tasks', 'logged_in_users']
+
+
+class FunctionComponent(ResilientComponent):
+    """Component that implements Resilient function 'cb_retrieve_triage_bundle"""
+
+    def __init__(self, opts):
+        """constructor provides access to the configuration options"""
+        super(FunctionComponent, self).__init__(opts)
+        self.options = opts.get("carbon_black", {})
+        selftest.selftest_function(opts)
+        parking.register("cb_retrieve_triage_bundle", self, cb)  # Resume this function's parked jobs once their hosts come online
+
+    @handler("reload")
+    def _reload(self, event, opts):
+        """Configuration options have changed, save new values"""
+        self.options = opts.get("carbon_black", {})
+
+    @function("cb_retrieve_triage_bundle")
+    def _cb_retrieve_triage_bundle_function(self, event, *args, **kwargs):
+
+        results = {}
+        results["was_successful"] = False
+        results["hostname"] = None
+        results["collected"] = []
+        results["failed"] = {}
+        host_ticket = None  # This job's place in the host's job queue
+        job_metrics = None  # Phase timings of this job
+        job_entry = None  # This job's entry in the job journal
+        work_directory = None  # Reports are collected here before zipping, kept across retries
+
+        try:
+            # Get the function parameters:
+            incident_id = kwargs.get("incident_id")  # number
+            hostname = kwargs.get("hostname")  # text
+            triage_collectors = kwargs.get("triage_collectors")  # text, collector names separated by commas, semicolons or whitespace
+
+            log = logging.getLogger(__name__)  # Establish logging
+
+            days_later_timeout_length = parking.deadline(datetime.datetime.now() + datetime.timedelta(days=DAYS_UNTIL_TIMEOUT))  # Max duration length before aborting, a resumed job keeps its parked deadline
+            hostname = sensor_index.hostname_key(hostname)  # CB limits hostname to 15 characters
+            sensor = sensor_index.find(cb, hostname)  # Resolve the hostname's sensor from the in-memory sensor index
+            timeouts = 0  # Number of timeouts that have occurred
+
+            if triage_collectors: selected = [c.strip().lower() for c in triage_collectors.replace(';', ',').replace(' ', ',').split(',') if c.strip()]
+            else: selected = list(TRIAGE_COLLECTORS)
+            unknown = [c for c in selected if c not in collectors.COLLECTOR_NAMES]
+            if unknown or not selected:
+                yield StatusMessage('[FATAL ERROR] Unknown collector: ' + ', '.join(unknown) + '. Use any of: ' + ', '.join(collectors.COLLECTOR_NAMES))
+                yield StatusMessage('[FAILURE] Fatal error caused exit!')
+                yield FunctionResult(results)
+                return
+            selected = sorted(set(selected))
+
+            if sensor is None:  # Host does not have CB agent, abort
+                yield StatusMessage("[FATAL ERROR] CB could not find hostname: " + str(hostname))
+                yield StatusMessage('[FAILURE] Fatal error caused exit!')
+                yield FunctionResult(results)
+                return
+
+            results["hostname"] = str(hostname).upper()
+            host_ticket = host_queue.enqueue(hostname, 'cb_retrieve_triage_bundle')  # Queue behind any running or waiting actions on the host
+            job_metrics = phase_metrics.start_run('cb_retrieve_triage_bundle', hostname, sensor.id)  # Time each phase of the job against the host
+            job_entry = job_journal.start('cb_retrieve_triage_bundle', incident_id, hostname, sensor.id, kwargs, days_later_timeout_length)  # Journal the job so a restart does not lose it
+            work_directory = tempfile.mkdtemp()
+            collected = {}  # collector name -> local report path
+
+            while timeouts <= MAX_TIMEOUTS:  # Max timeouts before aborting
+
+                try:
+
+                    now = datetime.datetime.now()
+
+                    # Check if the sensor is queued to restart, wait up to 90 seconds before checking online status
+                    three_minutes_passed = datetime.datetime.now() + datetime.timedelta(minutes=3)
+                    sensor = sensor_watcher.wait_for(cb, hostname, lambda s: s.restart_queued is not True, three_minutes_passed, sensor)  # Woken by the fleet-wide sensor watcher, no per-function polling
+                    now = datetime.datetime.now()
+
+                    # Park the job instead of holding a worker while the host is offline, it runs again once the host comes online
+                    if sensor.status != "Online" and parking.should_park():
+                        parking.park('cb_retrieve_triage_bundle', incident_id, hostname, kwargs, days_later_timeout_length)
+                        results["parked"] = True
+                        yield StatusMessage('[INFO] Hostname: ' + str(hostname) + ' is offline. The job is parked and will run once the host comes online, for up to ' + str(DAYS_UNTIL_TIMEOUT) + ' days...')
+                        break
+
+                    # Check online status
+                    if sensor.status != "Online":
+                        yield StatusMessage('[WARNING] Hostname: ' + str(hostname) + ' is offline. Will attempt for ' + str(DAYS_UNTIL_TIMEOUT) + ' days...')
+
+                    # Check lock status
+                    if host_queue.jobs_ahead(host_ticket) > 0:
+                        yield StatusMessage('[WARNING] A running action has a lock on  ' + str(hostname) + ' (' + str(host_queue.jobs_ahead(host_ticket)) + ' queued ahead). Will attempt for ' + str(DAYS_UNTIL_TIMEOUT) + ' days...')
+
+                    # Wait for offline and locked hosts for days_later_timeout_length
+                    sensor = sensor_watcher.wait_for(cb, hostname, lambda s: s.status == "Online", days_later_timeout_length, sensor)
+                    if sensor.status == "Online":
+                        host_queue.wait_for_turn(host_ticket, days_later_timeout_length)  # Handed the host as soon as the job ahead releases it
+                    now = datetime.datetime.now()
+
+                    # Abort after DAYS_UNTIL_TIMEOUT
+                    if sensor.status != "Online" or not host_ticket.acquired:
+                        yield StatusMessage('[FATAL ERROR] Hostname: ' + str(hostname) + ' is still offline!')
+                        yield StatusMessage('[FAILURE] Fatal error caused exit!')
+                        break
+
+                    # Check if the sensor is queued to restart, wait up to 90 seconds before continuing
+                    three_minutes_passed = datetime.datetime.now() + datetime.timedelta(minutes=3)
+                    sensor = sensor_watcher.wait_for(cb, hostname, lambda s: s.restart_queued is not True, three_minutes_passed, sensor)  # Woken by the fleet-wide sensor watcher, no per-function polling
+                    now = datetime.datetime.now()
+
+                    # Verify the incident still exists and is reachable, if not abort
+                    try: incident = self.rest_client().get('/incidents/{0}?text_content_output_format=always_text&handle_format=names'.format(str(incident_id)))
+                    except Exception as err:
+                        if err.message and "not found" in err.message.lower():
+                            log.info('[FATAL ERROR] Incident ID ' + str(incident_id) + ' no longer exists.')
+                            log.info('[FAILURE] Fatal error caused exit!')
+                        else:
+                            log.info('[FATAL ERROR] Incident ID ' + str(incident_id) + ' could not be reached, Resilient instance may be down.')
+                            log.info('[FAILURE] Fatal error caused exit!')
+                        break
+
+                    # Establish a session to the host sensor
+                    yield StatusMessage('[INFO] Establishing session to CB Sensor #' + str(sensor.id) + ' (' + sensor.hostname + ')')
+                    session = session_broker.request_session(cb, sensor.id)  # Reuse a warm session to the sensor if the broker holds one
+                    yield StatusMessage('[SUCCESS] Connected on Session #' + str(session.session_id) + ' to CB Sensor #' + str(sensor.id) + ' (' + sensor.hostname + ')')
+
+                    # Run every remaining collector with its command pipelined, a retry after a timeout only reruns the collectors that did not finish
+                    remaining = [c for c in selected if c not in collected and c not in results["failed"]]
+                    yield StatusMessage('[INFO] Running collectors: ' + ', '.join(remaining))
+                    collectors.collect_many(cb, session, remaining, work_directory, collected, results["failed"])  # Fills collected and results["failed"] as each collector finishes
+                    yield StatusMessage('[SUCCESS] Retrieved ' + str(len(collected)) + ' of ' + str(len(selected)) + ' reports from Sensor!')
+                    for name in sorted(results["failed"]):
+                        yield StatusMessage('[WARNING] The ' + name + ' collector failed: ' + results["failed"][name])
+
+                    if not collected:
+                        yield StatusMessage('[FATAL ERROR] No collector produced a report.')
+                        yield StatusMessage('[FAILURE] Fatal error caused exit!')
+
+                    else:
+                        # Package every report and a summary into one ZIP file and post it to the incident as an attachment
+                        with tempfile.NamedTemporaryFile(delete=False) as temp_zip:  # Create temporary temp_zip for creating zip_file
+                            try:
+                                with phase_metrics.phase(phase_metrics.ZIP), zipfile.ZipFile(temp_zip, 'w') as zip_file:  # Establish zip_file from temporary temp_zip for packaging reports into
+                                    for name in sorted(collected):
+                                        zip_file.write(collected[name], os.path.basename(collected[name]), compress_type=zipfile.ZIP_DEFLATED)
+
+                                    summary_path = os.path.join(work_directory, 'triage_summary.csv')
+                                    with open(summary_path, 'w') as summary_file:
+                                        summary_writer = csv.writer(summary_file)
+                                        summary_writer.writerow(['Collector:', 'Result:', 'Report:'])
+                                        for name in sorted(collected):
+                                            summary_writer.writerow([name, 'Collected', os.path.basename(collected[name])])
+                                        for name in sorted(results["failed"]):
+                                            summary_writer.writerow([name, 'Failed', results["failed"][name]])
+                                    zip_file.write(summary_path, 'triage_summary.csv', compress_type=zipfile.ZIP_DEFLATED)
+
+                                if transfer_rate.deliver_as_attachment(os.stat(temp_zip.name).st_size, MAX_UPLOAD_SIZE):  # Within the size limit and expected to upload in time
+                                    with transfer_rate.measure(transfer_rate.RESILIENT, os.stat(temp_zip.name).st_size):  # Learn the Resilient upload rate
+                                        phase_metrics.post_attachment(self.rest_client(), '/incidents/{0}/attachments'.format(incident_id), temp_zip.name, '{0}-triage.zip'.format(sensor.hostname))  # Post temp_zip to incident
+                                    yield StatusMessage('[SUCCESS] Posted a ZIP file of the triage reports to the incident as an attachment!')
+                                else:
+                                    if not os.path.exists(os.path.normpath('/mnt/cyber-sec-forensics/Resilient/{0}'.format(incident_id))): os.makedirs('/mnt/cyber-sec-forensics/Resilient/{0}'.format(incident_id))
+                                    shutil.copyfile(temp_zip.name, '/mnt/cyber-sec-forensics/Resilient/{0}/{1}-triage-{2}.zip'.format(incident_id, sensor.hostname, str(int(time.time()))))  # Post temp_zip to network share
+                                    yield StatusMessage('[SUCCESS] Posted a ZIP file of the triage reports to the forensics network share!')
+
+                            finally:
+                                os.unlink(temp_zip.name)  # Delete temporary temp_zip
+
+                        results["collected"] = sorted(collected)
+
+                except retry_policy.RETRYABLE_ERRORS as err:  # Catch CB timeouts and connection exceptions and handle
+                    if not retry_policy.is_retryable(err):  # Only handle ApiError involving network connection error
+                        try: session_broker.release_session(session)  # Return the session to the broker before giving up
+                        except: pass
+                        raise
+                    timeouts = timeouts + 1
+                    if retry_policy.rule_for(err).discard_session:
+                        try: session_broker.discard_session(session)  # Do not reuse a session that timed out
+                        except: pass
+                    else:
+                        try: session_broker.release_session(session)  # Return the session to the broker, the retry checks it out again
+                        except: pass
+                    session = None  # Returned to the broker, never return it twice
+                    for status_message in retry_policy.recover(cb, err, hostname, timeouts, MAX_TIMEOUTS): yield StatusMessage(status_message)  # Backs off per the error's rule, waits out CB outages together with every other job
+                    continue
+
+                except Exception as err:  # Catch all other exceptions and abort
+                    yield StatusMessage('[FATAL ERROR] Encountered: ' + str(err))
+                    yield StatusMessage('[FAILURE] Fatal error caused exit!')
+
+                else:
+                    results["was_successful"] = len(results["collected"]) > 0
+
+                try: session_broker.release_session(session)  # Keep the session warm for the next function
+                except: pass
+                yield StatusMessage('[INFO] Session has been released to CB Sensor #' + str(sensor.id) + '(' + sensor.hostname + ')')
+                break
+
+            # Release the host lock if acquired, the next queued action on the host starts immediately
+            host_queue.release(host_ticket)
+
+            # Produce a FunctionResult with the results
+            yield FunctionResult(results)
+        except Exception:
+            yield FunctionError()
+        finally:
+            host_queue.release(host_ticket)  # Never leave the host's queue blocked after an unexpected error
+            phase_metrics.finish_run(job_metrics, results["was_successful"])  # Log and export the phase timings of the job
+            job_journal.finish(job_entry, results)  # The job is no longer in flight
+            if work_directory: shutil.rmtree(work_directory, ignore_errors=True)  # Delete the local reports
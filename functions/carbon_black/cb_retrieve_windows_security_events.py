@@ -3,12 +3,12 @@
 
 # This function will retrieve the Windows Security event logs from an endpoint in a TXT file.
 # File: cb_retrieve_windows_security_events.py
-# Date: 04/16/2019 - Modified: 06/28/2019
+# Date: 04/16/2019 - Modified: 10/18/2026
 # Author: Jared F
 
 """Function implementation"""
 #   @function -> cb_retrieve_windows_security_events
-#   @params -> integer: incident_id, string: hostname, integer: period_to_retrieve (optional)
+#   @params -> integer: incident_id, string: hostname, integer: period_to_retrieve (optional), boolean: compress_on_endpoint (optional)
 #   @return -> boolean: results['was_successful'], string: results['hostname']
 
 
@@ -16,20 +16,32 @@ import os
 import time
 import logging
 import shutil
-import tempfile
 import datetime
 from resilient_circuits import ResilientComponent, function, handler, StatusMessage, FunctionResult, FunctionError
-from cbapi.response import CbEnterpriseResponseAPI, Sensor
-from cbapi.errors import TimeoutError, ApiError
-from urllib3.exceptions import ProtocolError, NewConnectionError, ConnectTimeoutError, MaxRetryError
+from cbapi.response import CbEnterpriseResponseAPI
+from cbapi.errors import TimeoutError
 import carbon_black.util.selftest as selftest
+import carbon_black.util.session_broker as session_broker
+import carbon_black.util.sensor_watcher as sensor_watcher
+import carbon_black.util.sensor_index as sensor_index
+import carbon_black.util.host_queue as host_queue
+import carbon_black.util.parking as parking
+import carbon_black.util.job_journal as job_journal
+import carbon_black.util.retry_policy as retry_policy
+import carbon_black.util.transfer as transfer
+import carbon_black.util.transfer_rate as transfer_rate
+import carbon_black.util.endpoint_archive as endpoint_archive
+import carbon_black.util.phase_metrics as phase_metrics
 
 cb = CbEnterpriseResponseAPI()  # CB Response API
 MAX_TIMEOUTS = 3  # The number of CB timeouts that must occur before the function aborts
 DAYS_UNTIL_TIMEOUT = 3  # The number of days that must pass before the function aborts
 
 MAX_UPLOAD_SIZE = 50*1000000  # Maximum number of bytes of files to upload as an attachment before reverting to a netshare drop, default = 50MB
-TRANSFER_RATE = 225000  # Bytes per second, the expected minimum file transfer rate via Carbon Black
+
+COMPRESS_ON_ENDPOINT = True  # Default for compress_on_endpoint, the events file is compressed on the endpoint before retrieval
+EVENTS_FILE = r'C:\Windows\CarbonBlack\Reports\Security_Events.txt'  # Endpoint path wevtutil writes the events to
+ENDPOINT_ARCHIVE = r'C:\Windows\CarbonBlack\Reports\Security_Events.zip'  # Endpoint path the compressed events file is staged at
 
 
 class FunctionComponent(ResilientComponent):
@@ -40,6 +52,7 @@ class FunctionComponent(ResilientComponent):
         super(FunctionComponent, self).__init__(opts)
         self.options = opts.get("carbon_black", {})
         selftest.selftest_function(opts)
+        parking.register("cb_retrieve_windows_security_events", self, cb)  # Resume this function's parked jobs once their hosts come online
 
     @handler("reload")
     def _reload(self, event, opts):
@@ -52,31 +65,37 @@ class FunctionComponent(ResilientComponent):
         results = {}
         results["was_successful"] = False
         results["hostname"] = None
-        lock_acquired = False
+        host_ticket = None  # This job's place in the host's job queue
+        job_metrics = None  # Phase timings of this job
+        job_entry = None  # This job's entry in the job journal
 
         try:
             # Get the function parameters:
             incident_id = kwargs.get("incident_id")  # number
             hostname = kwargs.get("hostname")  # text
             period_to_retrieve = kwargs.get("period_to_retrieve")  # number - days of events to retrieve
+            compress_on_endpoint = kwargs.get("compress_on_endpoint")  # boolean
+            if compress_on_endpoint is None: compress_on_endpoint = COMPRESS_ON_ENDPOINT
 
             log = logging.getLogger(__name__)  # Establish logging
 
-            days_later_timeout_length = datetime.datetime.now() + datetime.timedelta(days=DAYS_UNTIL_TIMEOUT)  # Max duration length before aborting
-            hostname = hostname.upper()[:15]  # CB limits hostname to 15 characters
-            lock_file = '/home/integrations/.resilient/cb_host_locks/{}.lock'.format(hostname)
-            sensor = cb.select(Sensor).where('hostname:' + hostname)  # Query CB for the hostname's sensor
+            days_later_timeout_length = parking.deadline(datetime.datetime.now() + datetime.timedelta(days=DAYS_UNTIL_TIMEOUT))  # Max duration length before aborting, a resumed job keeps its parked deadline
+            hostname = sensor_index.hostname_key(hostname)  # CB limits hostname to 15 characters
+            sensor = sensor_index.find(cb, hostname)  # Resolve the hostname's sensor from the in-memory sensor index
             if period_to_retrieve: period_to_retrieve = int(period_to_retrieve)*86400000  # Convert days to ms, Windows uses milliseconds for wevtutil command
             timeouts = 0  # Number of timeouts that have occurred
 
-            if len(sensor) <= 0:  # Host does not have CB agent, abort
+            if sensor is None:  # Host does not have CB agent, abort
                 yield StatusMessage("[FATAL ERROR] CB could not find hostname: " + str(hostname))
                 yield StatusMessage('[FAILURE] Fatal error caused exit!')
                 yield FunctionResult(results)
                 return
 
-            sensor = sensor[0]  # Get the sensor object from the query
             results["hostname"] = str(hostname).upper()
+            host_ticket = host_queue.enqueue(hostname, 'cb_retrieve_windows_security_events')  # Queue behind any running or waiting actions on the host
+            job_metrics = phase_metrics.start_run('cb_retrieve_windows_security_events', hostname, sensor.id)  # Time each phase of the job against the host
+            job_entry = job_journal.start('cb_retrieve_windows_security_events', incident_id, hostname, sensor.id, kwargs, days_later_timeout_length)  # Journal the job so a restart does not lose it
+            checkpoint = transfer.TransferCheckpoint(hostname, 'cb_retrieve_windows_security_events', '{0}|{1}'.format(incident_id, period_to_retrieve))  # Retrieved byte ranges survive TimeoutError retries, another incident's export is never resumed
 
             while timeouts <= MAX_TIMEOUTS:  # Max timeouts before aborting
 
@@ -86,37 +105,40 @@ class FunctionComponent(ResilientComponent):
 
                     # Check if the sensor is queued to restart, wait up to 90 seconds before checking online status
                     three_minutes_passed = datetime.datetime.now() + datetime.timedelta(minutes=3)
-                    while (sensor.restart_queued is True) and (three_minutes_passed >= now):
-                        time.sleep(3)  # Give the CPU a break, it works hard!
-                        now = datetime.datetime.now()
-                        sensor = (cb.select(Sensor).where('hostname:' + hostname))[0]  # Retrieve the latest sensor vitals
+                    sensor = sensor_watcher.wait_for(cb, hostname, lambda s: s.restart_queued is not True, three_minutes_passed, sensor)  # Woken by the fleet-wide sensor watcher, no per-function polling
+                    now = datetime.datetime.now()
+
+                    # Park the job instead of holding a worker while the host is offline, it runs again once the host comes online
+                    if sensor.status != "Online" and parking.should_park():
+                        parking.park('cb_retrieve_windows_security_events', incident_id, hostname, kwargs, days_later_timeout_length)
+                        results["parked"] = True
+                        yield StatusMessage('[INFO] Hostname: ' + str(hostname) + ' is offline. The job is parked and will run once the host comes online, for up to ' + str(DAYS_UNTIL_TIMEOUT) + ' days...')
+                        break
 
                     # Check online status
                     if sensor.status != "Online":
                         yield StatusMessage('[WARNING] Hostname: ' + str(hostname) + ' is offline. Will attempt for ' + str(DAYS_UNTIL_TIMEOUT) + ' days...')
 
                     # Check lock status
-                    if os.path.exists(lock_file) and lock_acquired is False:
-                        yield StatusMessage('[WARNING] A running action has a lock on  ' + str(hostname) + '. Will attempt for ' + str(DAYS_UNTIL_TIMEOUT) + ' days...')
+                    if host_queue.jobs_ahead(host_ticket) > 0:
+                        yield StatusMessage('[WARNING] A running action has a lock on  ' + str(hostname) + ' (' + str(host_queue.jobs_ahead(host_ticket)) + ' queued ahead). Will attempt for ' + str(DAYS_UNTIL_TIMEOUT) + ' days...')
 
                     # Wait for offline and locked hosts for days_later_timeout_length
-                    while (sensor.status != "Online" or (os.path.exists(lock_file) and lock_acquired is False)) and (days_later_timeout_length >= now):
-                        time.sleep(3)  # Give the CPU a break, it works hard!
-                        now = datetime.datetime.now()
-                        sensor = (cb.select(Sensor).where('hostname:' + hostname))[0]  # Retrieve the latest sensor vitals
+                    sensor = sensor_watcher.wait_for(cb, hostname, lambda s: s.status == "Online", days_later_timeout_length, sensor)
+                    if sensor.status == "Online":
+                        host_queue.wait_for_turn(host_ticket, days_later_timeout_length)  # Handed the host as soon as the job ahead releases it
+                    now = datetime.datetime.now()
 
                     # Abort after DAYS_UNTIL_TIMEOUT
-                    if sensor.status != "Online" or (os.path.exists(lock_file) and lock_acquired is False):
+                    if sensor.status != "Online" or not host_ticket.acquired:
                         yield StatusMessage('[FATAL ERROR] Hostname: ' + str(hostname) + ' is still offline!')
                         yield StatusMessage('[FAILURE] Fatal error caused exit!')
                         break
 
                     # Check if the sensor is queued to restart, wait up to 90 seconds before continuing
                     three_minutes_passed = datetime.datetime.now() + datetime.timedelta(minutes=3)
-                    while (sensor.restart_queued is True) and (three_minutes_passed >= now):  # If the sensor is queued to restart, wait up to 90 seconds
-                        time.sleep(3)  # Give the CPU a break, it works hard!
-                        now = datetime.datetime.now()
-                        sensor = (cb.select(Sensor).where('hostname:' + hostname))[0]  # Retrieve the latest sensor vitals
+                    sensor = sensor_watcher.wait_for(cb, hostname, lambda s: s.restart_queued is not True, three_minutes_passed, sensor)  # Woken by the fleet-wide sensor watcher, no per-function polling
+                    now = datetime.datetime.now()
 
                     # Verify the incident still exists and is reachable, if not abort
                     try: incident = self.rest_client().get('/incidents/{0}?text_content_output_format=always_text&handle_format=names'.format(str(incident_id)))
@@ -129,74 +151,74 @@ class FunctionComponent(ResilientComponent):
                             log.info('[FAILURE] Fatal error caused exit!')
                         break
 
-                    # Acquire host lock
-                    if lock_acquired is False:
-                        try:
-                            f = os.fdopen(os.open(lock_file, os.O_CREAT | os.O_WRONLY | os.O_EXCL), 'w')
-                            f.close()
-                            lock_acquired = True
-                        except OSError:
-                            continue
-
                     # Establish a session to the host sensor
                     yield StatusMessage('[INFO] Establishing session to CB Sensor #' + str(sensor.id) + ' (' + sensor.hostname + ')')
-                    session = cb.live_response.request_session(sensor.id)
+                    session = session_broker.request_session(cb, sensor.id)  # Reuse a warm session to the sensor if the broker holds one
                     yield StatusMessage('[SUCCESS] Connected on Session #' + str(session.session_id) + ' to CB Sensor #' + str(sensor.id) + ' (' + sensor.hostname + ')')
 
                     try: session.create_directory(r'C:\Windows\CarbonBlack\Reports')
                     except TimeoutError: raise
                     except Exception: pass  # Existed already
 
-                    if period_to_retrieve: session.create_process(r'''cmd.exe /c wevtutil qe "Security" /rd:True /q:"*[System[TimeCreated[timediff(@SystemTime) <= ''' + str(period_to_retrieve) + ''']]]" /f:Text > C:\Windows\CarbonBlack\Reports\Security_Events.txt''', True, None, None, 43200, True)  # Query events, 12hrs until timeout
-                    else: session.create_process(r'''cmd.exe /c wevtutil qe "Security" /rd:True /f:Text > C:\Windows\CarbonBlack\Reports\Security_Events.txt''', True, None, None, 43200, True)  # Query events, 12hrs until timeout
-                    yield StatusMessage('[SUCCESS] Queried all Windows Security events on Sensor!')
-
-                    file_size = session.list_directory(r'C:\Windows\CarbonBlack\Reports\Security_Events.txt')[0]['size']  # File size in bytes
-                    custom_timeout = int((file_size / TRANSFER_RATE) + 120)  # The expected timeout duration + 120 seconds for good measure
-
-                    with tempfile.NamedTemporaryFile(delete=False) as temp_file:  # Create temporary temp_file for TXT file
+                    remote_file = None  # Endpoint file retrieved, the compressed events file when the Sensor could compress it
+                    for candidate in (ENDPOINT_ARCHIVE, EVENTS_FILE):
                         try:
-                            temp_file.write(session.get_file(r'C:\Windows\CarbonBlack\Reports\Security_Events.txt', timeout=custom_timeout))  # Write the file from the endpoint to temp_file
-                            temp_file.close()
-                            yield StatusMessage('[SUCCESS] Retrieved Windows Security events data file from Sensor!')
-
-                            if os.stat(temp_file.name).st_size <= MAX_UPLOAD_SIZE:
-                                self.rest_client().post_attachment('/incidents/{0}/attachments'.format(incident_id), temp_file.name, '{0}-Security_Events.txt'.format(sensor.hostname))  # Post temp_file to incident
-                                yield StatusMessage('[SUCCESS] Posted Windows Security events data file to the incident as an attachment!')
-                            else:
-                                if not os.path.exists(os.path.normpath('/mnt/cyber-sec-forensics/Resilient/{0}'.format(incident_id))): os.makedirs('/mnt/cyber-sec-forensics/Resilient/{0}'.format(incident_id))
-                                shutil.copyfile(temp_file.name, '/mnt/cyber-sec-forensics/Resilient/{0}/{1}-Security_Events-{2}.txt'.format(incident_id, sensor.hostname, str(int(time.time()))))  # Post temp_file to network share
-                                yield StatusMessage('[SUCCESS] Posted Windows Security events data file to the forensics network share!')
+                            if checkpoint.matches(candidate, session.list_directory(candidate)[0]):  # File from before the last retry is unchanged
+                                remote_file = candidate
+                                break
+                        except TimeoutError: raise
+                        except Exception: pass  # File was never written
 
-                        finally:
-                            os.unlink(temp_file.name)  # Delete temporary temp_file
+                    if remote_file: yield StatusMessage('[INFO] Resuming retrieval of Windows Security events data file, ' + str(checkpoint.received_bytes()) + ' bytes were retrieved before the last retry')
+                    else:
+                        if period_to_retrieve: session.create_process(r'''cmd.exe /c wevtutil qe "Security" /rd:True /q:"*[System[TimeCreated[timediff(@SystemTime) <= ''' + str(period_to_retrieve) + ''']]]" /f:Text > C:\Windows\CarbonBlack\Reports\Security_Events.txt''', True, None, None, 43200, True)  # Query events, 12hrs until timeout
+                        else: session.create_process(r'''cmd.exe /c wevtutil qe "Security" /rd:True /f:Text > C:\Windows\CarbonBlack\Reports\Security_Events.txt''', True, None, None, 43200, True)  # Query events, 12hrs until timeout
+                        yield StatusMessage('[SUCCESS] Queried all Windows Security events on Sensor!')
+
+                        remote_file = EVENTS_FILE
+                        if compress_on_endpoint:
+                            yield StatusMessage('[INFO] Compressing Windows Security events data file on Sensor...')
+                            events_size = session.list_directory(EVENTS_FILE)[0]['size']  # File size in bytes, the Security log can be several GB
+                            if endpoint_archive.stage_archive(session, [[EVENTS_FILE, 'Security_Events.txt']], ENDPOINT_ARCHIVE, endpoint_archive.archive_timeout(events_size)) == []: remote_file = ENDPOINT_ARCHIVE  # Compressed in time without skipping the events file
+                            else: yield StatusMessage('[WARNING] Sensor could not compress the Windows Security events data file, retrieving it uncompressed...')
+
+                    events_file = transfer.resumable_get(session, checkpoint, remote_file)  # Retrieve in checkpointed ranges, skips ranges already retrieved
+                    if remote_file == ENDPOINT_ARCHIVE:
+                        if endpoint_archive.verify(events_file):
+                            events_file = endpoint_archive.extract_member(events_file, 'Security_Events.txt', checkpoint.directory)  # Unpack the events file next to the checkpointed archive
+                        else:  # Corrupt archive, the uncompressed events file is still on the Sensor
+                            yield StatusMessage('[WARNING] Compressed Windows Security events data file failed verification, retrieving it uncompressed...')
+                            events_file = transfer.resumable_get(session, checkpoint, EVENTS_FILE)
+                    yield StatusMessage('[SUCCESS] Retrieved Windows Security events data file from Sensor!')
+
+                    if transfer_rate.deliver_as_attachment(os.stat(events_file).st_size, MAX_UPLOAD_SIZE):  # Within the size limit and expected to upload in time
+                        with transfer_rate.measure(transfer_rate.RESILIENT, os.stat(events_file).st_size):  # Learn the Resilient upload rate
+                            phase_metrics.post_attachment(self.rest_client(), '/incidents/{0}/attachments'.format(incident_id), events_file, '{0}-Security_Events.txt'.format(sensor.hostname))  # Post events_file to incident
+                        yield StatusMessage('[SUCCESS] Posted Windows Security events data file to the incident as an attachment!')
+                    else:
+                        if not os.path.exists(os.path.normpath('/mnt/cyber-sec-forensics/Resilient/{0}'.format(incident_id))): os.makedirs('/mnt/cyber-sec-forensics/Resilient/{0}'.format(incident_id))
+                        shutil.copyfile(events_file, '/mnt/cyber-sec-forensics/Resilient/{0}/{1}-Security_Events-{2}.txt'.format(incident_id, sensor.hostname, str(int(time.time()))))  # Post events_file to network share
+                        yield StatusMessage('[SUCCESS] Posted Windows Security events data file to the forensics network share!')
 
-                    session.delete_file(r'C:\Windows\CarbonBlack\Reports\Security_Events.txt')
+                    session.delete_file(EVENTS_FILE)
+                    try: session.delete_file(ENDPOINT_ARCHIVE)
+                    except TimeoutError: raise
+                    except Exception: pass  # Events file was not compressed
 
-                except TimeoutError:  # Catch TimeoutError and handle
-                    timeouts = timeouts + 1
-                    if timeouts <= MAX_TIMEOUTS:
-                        yield StatusMessage('[ERROR] TimeoutError was encountered. Reattempting... (' + str(timeouts) + '/' + str(MAX_TIMEOUTS) + ')')
-                        try: session.close()
+                except retry_policy.RETRYABLE_ERRORS as err:  # Catch CB timeouts and connection exceptions and handle
+                    if not retry_policy.is_retryable(err):  # Only handle ApiError involving network connection error
+                        try: session_broker.release_session(session)  # Return the session to the broker before giving up
                         except: pass
-                        sensor = (cb.select(Sensor).where('hostname:' + hostname))[0]  # Retrieve the latest sensor vitals
-                        sensor.restart_sensor()  # Restarting the sensor may avoid a timeout from occurring again
-                        time.sleep(30)  # Sleep to apply sensor restart
-                        sensor = (cb.select(Sensor).where('hostname:' + hostname))[0]  # Retrieve the latest sensor vitals
-                    else:
-                        yield StatusMessage('[FATAL ERROR] TimeoutError was encountered. The maximum number of retries was reached. Aborting!')
-                        yield StatusMessage('[FAILURE] Fatal error caused exit!')
-                    continue
-
-                except(ApiError, ProtocolError, NewConnectionError, ConnectTimeoutError, MaxRetryError) as err:  # Catch urllib3 connection exceptions and handle
-                    if 'ApiError' in str(type(err).__name__) and 'network connection error' not in str(err): raise  # Only handle ApiError involving network connection error
+                        raise
                     timeouts = timeouts + 1
-                    if timeouts <= MAX_TIMEOUTS:
-                        yield StatusMessage('[ERROR] Carbon Black was unreachable. Reattempting in 30 minutes... (' + str(timeouts) + '/' + str(MAX_TIMEOUTS) + ')')
-                        time.sleep(1800)  # Sleep for 30 minutes, backup service may have been running.
+                    if retry_policy.rule_for(err).discard_session:
+                        try: session_broker.discard_session(session)  # Do not reuse a session that timed out
+                        except: pass
                     else:
-                        yield StatusMessage('[FATAL ERROR] ' + str(type(err).__name__) + ' was encountered. The maximum number of retries was reached. Aborting!')
-                        yield StatusMessage('[FAILURE] Fatal error caused exit!')
+                        try: session_broker.release_session(session)  # Return the session to the broker, the retry checks it out again
+                        except: pass
+                    session = None  # Returned to the broker, never return it twice
+                    for status_message in retry_policy.recover(cb, err, hostname, timeouts, MAX_TIMEOUTS): yield StatusMessage(status_message)  # Backs off per the error's rule, waits out CB outages together with every other job
                     continue
 
                 except Exception as err:  # Catch all other exceptions and abort
@@ -205,17 +227,21 @@ class FunctionComponent(ResilientComponent):
 
                 else:
                     results["was_successful"] = True
+                    checkpoint.clear()  # Delivered, the retrieved file is no longer needed
 
-                try: session.close()
+                try: session_broker.release_session(session)  # Keep the session warm for the next function
                 except: pass
-                yield StatusMessage('[INFO] Session has been closed to CB Sensor #' + str(sensor.id) + '(' + sensor.hostname + ')')
+                yield StatusMessage('[INFO] Session has been released to CB Sensor #' + str(sensor.id) + '(' + sensor.hostname + ')')
                 break
 
-            # Release the host lock if acquired
-            if lock_acquired is True:
-                os.remove(lock_file)
+            # Release the host lock if acquired, the next queued action on the host starts immediately
+            host_queue.release(host_ticket)
 
             # Produce a FunctionResult with the results
             yield FunctionResult(results)
         except Exception:
             yield FunctionError()
+        finally:
+            host_queue.release(host_ticket)  # Never leave the host's queue blocked after an unexpected error
+            phase_metrics.finish_run(job_metrics, results["was_successful"])  # Log and export the phase timings of the job
+            job_journal.finish(job_entry, results)  # The job is no longer in flight
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+# Tests parking and resuming a real FunctionComponent against the local CB stand-in.
+# File: test_parking.py
+# Date: 10/18/2026
+# Author: Jared F
+
+"""Parked job resume tests"""
+#   Usage from the functions directory, with cbapi, resilient_circuits and pytest installed:
+#       python -m pytest carbon_black/tests
+
+import json
+import time
+import shutil
+import importlib
+import tempfile
+import datetime
+import pytest
+import carbon_black.benchmark.fake_cb as fake_cb
+import carbon_black.benchmark.run_benchmarks as run_benchmarks
+import carbon_black.util.parking as parking
+import carbon_black.util.job_journal as job_journal
+import carbon_black.util.sensor_index as sensor_index
+import carbon_black.util.sensor_watcher as sensor_watcher
+
+OFFLINE_FOR = 4  # Seconds the stand-in's sensor stays offline
+
+
+@pytest.fixture
+def offline_host(monkeypatch):
+    """ Offline stand-in sensor with parking enabled, gives a loader of FunctionComponents that note to a shared list """
+    directory = tempfile.mkdtemp()
+    server = fake_cb.FakeCbServer(fake_cb.Profile('offline_briefly', latency=0.05, bandwidth=20*1000000, offline_for=OFFLINE_FOR), 1, 1)
+    fake_cb.install(server)
+    run_benchmarks.sandbox(directory)
+    sensor_index.reload(server.client())
+    monkeypatch.setattr(parking, 'PARK_OFFLINE_JOBS', True)
+    monkeypatch.setattr(parking, 'RESUME_INTERVAL', 1)
+    monkeypatch.setattr(sensor_watcher, 'MAX_INTERVAL', 2)
+    rest_client = fake_cb.FakeRestClient(server)
+    notes = []
+    rest_client.post = lambda uri, payload: notes.append(payload["text"]["content"])
+
+    def load(function):
+        component_class, body = run_benchmarks.load_function(function)
+        component = component_class.__new__(component_class)  # Skip ResilientComponent.__init__, there is no Resilient to connect to
+        component.options = {}
+        component.rest_client = lambda: rest_client
+        parking.register(function, component, importlib.import_module('carbon_black.' + function).cb)
+        return component, body
+
+    yield load, server, notes
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def wait_for_note(notes):
+    for _ in range(60):  # The host comes online after OFFLINE_FOR seconds, then the job resumes on the function's real generator
+        if notes:
+            return
+        time.sleep(1)
+
+
+def test_parked_job_resumes_once_host_is_online(offline_host):
+    load, server, notes = offline_host
+    component, body = load('cb_retrieve_services')
+    hostname = server.sensors[0].hostname
+
+    items = list(body(component, None, incident_id=7, hostname=hostname))
+    results = items[-1].value
+    assert results["parked"] is True and results["was_successful"] is False
+    assert len(parking.ParkedJobs.get_parked().status()) == 1
+
+    wait_for_note(notes)
+    assert len(notes) == 1 and notes[0].startswith('[SUCCESS]'), notes
+    assert parking.ParkedJobs.get_parked().status() == {}
+    with open(parking.ParkedJobs.get_parked().jobs_file) as f:
+        assert json.load(f) == {}  # Out of the parked jobs file once resumed, a restart never reruns it from there
+    entries = job_journal.JobJournal.get_journal().jobs()
+    assert sorted(entry["state"] for entry in entries) == [job_journal.FINISHED, job_journal.PARKED]
+    assert len(set(entry["deadline"] for entry in entries)) == 1  # The resumed run kept the parked deadline
+
+
+def test_parked_notify_posts_note_once_host_is_online(offline_host):
+    load, server, notes = offline_host
+    component, body = load('cb_notify_when_host_comes_online')
+    hostname = server.sensors[0].hostname
+
+    items = list(body(component, None, incident_id=7, hostname=hostname, max_days=1))
+    assert items[-1].value["parked"] is True and items[-1].value["Online"] is False
+
+    wait_for_note(notes)
+    assert notes == ['[SUCCESS] Hostname: ' + sensor_index.hostname_key(hostname) + ' came online.']
+    assert parking.ParkedJobs.get_parked().status() == {}
+
+
+def test_resumed_job_keeps_parked_deadline():
+    parked_deadline = datetime.datetime.now() + datetime.timedelta(hours=1)
+    assert parking.deadline(parked_deadline) == parked_deadline  # Not resuming, the job's own deadline
+    parking._resuming.deadline = parked_deadline - datetime.timedelta(minutes=30)
+    try:
+        assert parking.deadline(parked_deadline) == parked_deadline - datetime.timedelta(minutes=30)
+    finally:
+        parking._resuming.deadline = None
@@ -0,0 +1,4 @@
+# This Carbon Black package initializer exposes the shared utilities used by the Carbon Black functions.
+# File: __init__.py
+# Date: 10/18/2026
+# Author: Jared F
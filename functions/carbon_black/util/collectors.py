@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+# This utility holds the live response artifact collectors shared by the single-host, fleet and triage functions.
+# File: collectors.py
+# Date: 10/18/2026
+# Author: Jared F
+
+"""Live response artifact collectors"""
+#   Usage from a Carbon Black function with an established session:
+#       collectors.collect(cb, session, 'services', temp_file.name)  # Writes the services CSV to temp_file.name
+#       collectors.report_file_name('services')  # 'services.csv', used for attachment names
+#       collected, failed = collectors.collect_many(cb, session, ['services', 'autoruns'], work_directory)  # Pipelined, see collect_many()
+
+import os
+import csv
+import time
+import datetime
+from six import PY3
+from cbapi.errors import TimeoutError
+import carbon_black.util.transfer as transfer
+
+REPORTS_DIRECTORY = r'C:\Windows\CarbonBlack\Reports'  # Endpoint directory the collectors stage their reports in
+
+NETCONNS_POWERSHELL = (r"netstat -ano | Where-Object{$_ -match 'TCP|UDP'} | ForEach-Object{ $split = $_.Trim() -split '\s+'; "
+                       r"New-Object -Type pscustomobject -Property @{ 'Proto' = $split[0]; 'Local Address' = $split[1]; 'Foreign Address' = $split[2]; "
+                       r"'State' = if($split[3] -notmatch '\d+'){$split[3]}else{''}; 'PID' = $($split[-1]); 'Process Name' = $(Get-Process -Id $split[-1]).ProcessName; "
+                       r"} } | Select 'Proto', 'Local Address', 'Foreign Address', 'State', 'PID', 'Process Name' | Export-Csv -NoTypeInformation "
+                       r"-Path C:\Windows\CarbonBlack\Reports\netconns.csv -Encoding ascii")
+
+# Collectors that run a command on the endpoint: name -> (report file name, command that writes the report into REPORTS_DIRECTORY)
+COMMAND_COLLECTORS = {
+    'active_network_connections': ('netconns.csv', r'powershell.exe -ExecutionPolicy Bypass -Command "' + NETCONNS_POWERSHELL + '" '),
+    'autoruns': ('autoruns.csv', r'''powershell.exe -ExecutionPolicy Bypass -Command "Get-WmiObject -ClassName Win32_StartupCommand | Select-Object Name, command, Location, User | Export-Csv "C:\Windows\CarbonBlack\Reports\autoruns.csv" -notypeinformation"'''),
+    'installed_programs': ('installed_programs.csv', r'''powershell.exe -ExecutionPolicy Bypass -Command "Get-ItemProperty HKLM:\Software\Wow6432Node\Microsoft\Windows\CurrentVersion\Uninstall\* | Select-Object DisplayName, DisplayVersion, Publisher, InstallDate | Export-Csv "C:\Windows\CarbonBlack\Reports\installed_programs.csv" -notypeinformation"'''),
+    'logged_in_users': ('logged_in_users.csv', r'''powershell.exe -ExecutionPolicy Bypass -Command "(quser) -replace '\s{2,}', ',' | ConvertFrom-Csv | Export-Csv 'C:\Windows\CarbonBlack\Reports\logged_in_users.csv' -notypeinformation"'''),
+    'network_routing_data': ('network_routing_data.txt', r'cmd.exe /c route print > "C:\Windows\CarbonBlack\Reports\network_routing_data.txt"'),
+    'scheduled_tasks': ('scheduled_tasks.csv', r'cmd.exe /c schtasks.exe /query /v /fo CSV > "C:\Windows\CarbonBlack\Reports\scheduled_tasks.csv"'),
+    'services': ('services.csv', r'''powershell.exe -ExecutionPolicy Bypass -Command "Get-WMIObject Win32_Service  | Select processid,name,state,displayname,pathname,startmode | Export-Csv 'C:\Windows\CarbonBlack\Reports\services.csv' -notypeinformation"'''),
+}
+
+COLLECTOR_NAMES = sorted(list(COMMAND_COLLECTORS.keys()) + ['process_list'])  # Every collector name accepted by collect()
+
+DONE_SUFFIX = '.done'  # Marker written beside a report once its pipelined command has exited
+PIPELINE_POLL_INTERVAL = 2  # Seconds between checks of the reports directory while pipelined commands run
+PIPELINE_TIMEOUT = 300  # Seconds pipelined commands are given to finish, the same wait a single collector's command gets
+
+
+# UnicodeWriter class from http://python3porting.com/problems.html
+class UnicodeWriter:
+    def __init__(self, filename, dialect=csv.excel, encoding="utf-8", **kw):
+        self.filename = filename
+        self.dialect = dialect
+        self.encoding = encoding
+        self.kw = kw
+
+    def __enter__(self):
+        if PY3:
+            self.f = open(self.filename, 'at', encoding=self.encoding, newline='')
+        else:
+            self.f = open(self.filename, 'ab')
+        self.writer = csv.writer(self.f, dialect=self.dialect, **self.kw)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.f.close()
+
+    def writerow(self, row):
+        if not PY3:
+            row = [s or "" for s in row]
+            row = [s.encode(self.encoding) for s in row]
+        self.writer.writerow(row)
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+
+def report_file_name(name):
+    """
+    File name of the report a collector produces
+    :param name: collector name from COLLECTOR_NAMES
+    :return: report file name, ie 'services.csv'
+    """
+    if name == 'process_list':
+        return 'running_processes.csv'
+    return COMMAND_COLLECTORS[name][0]
+
+
+def write_process_list(cb, process_list, output_path):
+    """
+    Write a live response process list to a CSV file
+    :param cb: CbEnterpriseResponseAPI, used to build the process CB URLs
+    :param process_list: list returned by session.list_processes()
+    :param output_path: local CSV file path
+    :return:
+    """
+    with UnicodeWriter(output_path) as csv_writer:
+        csv_writer.writerow(['Process Name:', 'Path:', 'Command Line:', 'Username:', 'PID:', 'SID:', 'Parent PID:', 'Created Time:', 'Process CB URL:'])
+        for process in process_list:
+            process_exe = process['path'].rsplit('\\')[-1]
+            process_path = process['path']
+            process_commandline = process['command_line']
+            process_username = process['username']
+            process_pid = str(process['pid'])
+            process_sid = str(process['sid'])
+            process_parent_pid = str(process['parent'])
+            process_created_time = datetime.datetime.fromtimestamp(process['create_time']).strftime('%Y-%m-%d %H:%M:%S')
+            process_cb_url = str(cb.url + r'/#/analyze/' + process['proc_guid'] + r'/' + str(process['create_time']) + '?cb.legacy_5x_mode=false')
+
+            csv_writer.writerow([process_exe, process_path, process_commandline, process_username, process_pid, process_sid, process_parent_pid, process_created_time, process_cb_url])
+
+
+def collect(cb, session, name, output_path):
+    """
+    Run a collector on the endpoint and write its report to a local file
+    :param cb: CbEnterpriseResponseAPI
+    :param session: established live response session
+    :param name: collector name from COLLECTOR_NAMES
+    :param output_path: local file path the report is written to
+    :return: report file name, ie 'services.csv'
+    :raises KeyError for an unknown collector name, TimeoutError if the sensor stops responding
+    """
+    if name == 'process_list':
+        write_process_list(cb, session.list_processes(), output_path)  # No report is staged on the endpoint
+        return report_file_name(name)
+
+    file_name, command = COMMAND_COLLECTORS[name]
+    remote_path = REPORTS_DIRECTORY + '\\' + file_name
+
+    try: session.create_directory(REPORTS_DIRECTORY)
+    except TimeoutError: raise
+    except Exception: pass  # Existed already
+
+    session.create_process(command, True, None, None, 300, True)
+    with open(output_path, 'wb') as f:
+        transfer.stream_file(session, remote_path, f)  # Stream the report from the endpoint to output_path
+    session.delete_file(remote_path)
+    return file_name
+
+
+def collect_many(cb, session, names, output_directory, collected=None, failed=None, timeout=PIPELINE_TIMEOUT):
+    """
+    Run several collectors in one session with their commands pipelined: every command is started without waiting on
+    the one before it, then one directory listing per poll finds each report as its command exits
+    :param cb: CbEnterpriseResponseAPI
+    :param session: established live response session
+    :param names: collector names from COLLECTOR_NAMES
+    :param output_directory: local directory each report is written to, under its report file name
+    :param collected: dict updated in place as each report arrives, so a timeout keeps the reports already retrieved
+    :param failed: dict updated in place with each collector that failed
+    :param timeout: seconds the pipelined commands are given to finish
+    :return: (dict: collector name -> local report path, dict: collector name -> failure detail)
+    :raises KeyError for an unknown collector name, TimeoutError if the sensor stops responding
+    """
+    collected = {} if collected is None else collected
+    failed = {} if failed is None else failed
+    if 'process_list' in names:  # Listed before the collectors start, so their own processes are not in the list
+        output_path = os.path.join(output_directory, report_file_name('process_list'))
+        write_process_list(cb, session.list_processes(), output_path)
+        collected['process_list'] = output_path
+
+    running = dict((name, COMMAND_COLLECTORS[name][0]) for name in names if name != 'process_list')  # name -> report file name
+    if not running:
+        return collected, failed
+
+    try: session.create_directory(REPORTS_DIRECTORY)
+    except TimeoutError: raise
+    except Exception: pass  # Existed already
+
+    for name in sorted(running):
+        remote_path = REPORTS_DIRECTORY + '\\' + running[name]
+        command = ('cmd.exe /c del /q "' + remote_path + '" "' + remote_path + DONE_SUFFIX + '" 2>nul & '  # A report left by an interrupted run must not pass for this run's
+                   + COMMAND_COLLECTORS[name][1].strip() + ' & type nul > "' + remote_path + DONE_SUFFIX + '"')  # The marker is written once the command exits
+        session.create_process(command, False, None, None, timeout, False)  # Start the command without waiting for it
+
+    give_up_at = time.time() + timeout
+    finished = []  # Endpoint reports and markers already retrieved, deleted together at the end
+    while running:
+        listing = set(entry['filename'].lower() for entry in session.list_directory(REPORTS_DIRECTORY + '\\'))  # One round trip checks every running collector
+        for name, file_name in sorted(running.items()):
+            if (file_name + DONE_SUFFIX).lower() not in listing:
+                continue
+            remote_path = REPORTS_DIRECTORY + '\\' + file_name
+            if file_name.lower() in listing:
+                output_path = os.path.join(output_directory, file_name)
+                with open(output_path, 'wb') as f:
+                    transfer.stream_file(session, remote_path, f)  # Stream the report from the endpoint while the others keep running
+                collected[name] = output_path
+                finished.append(remote_path)
+            else:
+                failed[name] = 'The command exited without writing ' + file_name
+            finished.append(remote_path + DONE_SUFFIX)
+            del running[name]
+
+        if running and time.time() >= give_up_at:
+            for name in running:
+                failed[name] = 'The command did not finish within ' + str(timeout) + ' seconds'
+            break
+        if running:
+            time.sleep(PIPELINE_POLL_INTERVAL)
+
+    if finished:  # One command deletes every retrieved report and marker
+        session.create_process('cmd.exe /c del /q "' + '" "'.join(finished) + '"', False, None, None, timeout, False)
+    return collected, failed
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+# This utility scans endpoint directory trees with one live response round trip per directory.
+# File: directory_scan.py
+# Date: 10/18/2026
+# Author: Jared F
+
+"""Endpoint directory scan"""
+#   Usage from a Carbon Black function with an established session:
+#       scan = directory_scan.scan(session, r'C:\Windows\CarbonBlack')
+#       for file_path, listing in scan.files:  # listing holds the filename, size, attributes and last_write_time
+#           if 0 < listing['size'] < max_file_size: ...
+#   session.walk() only returns names, so sizing every file took another list_directory call per file.
+#   A scan lists each directory's contents once and keeps every entry for the rest of the job.
+#   Like session.walk(), it never follows reparse points (junctions such as "Application Data" loop back up the tree)
+#   and skips a directory it cannot list instead of failing the whole scan.
+
+
+import logging
+from cbapi.errors import TimeoutError
+
+log = logging.getLogger(__name__)  # Establish logging
+
+
+class DirectoryScan(object):
+    """ Names, sizes and attributes of every file under an endpoint directory """
+    def __init__(self, top):
+        self.top = top.rstrip('\\')
+        self.directories = []  # Endpoint directory paths, parents before their subdirectories
+        self.files = []  # [endpoint file path, listing] pairs, in the order scanned
+        self.listings = {}  # endpoint file path -> listing
+        self.skipped = []  # Endpoint directory paths that could not be listed
+
+    def scan(self, session):
+        """
+        List every directory under top, one list_directory call per directory
+        :param session: established live response session
+        :return: self
+        """
+        pending = [self.top]
+        while pending:
+            directory = pending.pop(0)
+            try: entries = session.list_directory(directory + '\\')  # Trailing backslash lists the directory's contents
+            except TimeoutError:
+                raise  # The session is gone, not just this directory
+            except Exception as err:  # Access denied and the like, skip the directory as walk() did
+                log.warning('[WARNING] Could not list ' + directory + ', skipping it: ' + str(err))
+                self.skipped.append(directory)
+                continue
+            self.directories.append(directory)
+            for entry in entries:
+                if entry['filename'] in ('.', '..'):
+                    continue
+                path = directory + '\\' + entry['filename']
+                if 'DIRECTORY' in entry['attributes']:
+                    if 'REPARSE_POINT' not in entry['attributes']:  # Junctions and directory links may point back up the tree, never follow them
+                        pending.append(path)
+                else:
+                    self.files.append([path, entry])
+                    self.listings[path] = entry
+        return self
+
+    def listing(self, path):
+        """
+        Cached listing of a scanned file
+        :param path: endpoint file path
+        :return: listing dict, or None if the file was not scanned
+        """
+        return self.listings.get(path)
+
+    def total_size(self):
+        """
+        Bytes held by every scanned file
+        :return: int
+        """
+        return sum(listing['size'] for path, listing in self.files)
+
+
+def scan(session, top):
+    """
+    Scan an endpoint directory tree
+    :param session: established live response session
+    :param top: endpoint directory path
+    :return: DirectoryScan
+    """
+    return DirectoryScan(top).scan(session)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+# This utility compresses files into a ZIP archive on the endpoint so evidence crosses the live response channel deflated.
+# File: endpoint_archive.py
+# Date: 10/18/2026
+# Author: Jared F
+
+"""Endpoint-side compression"""
+#   Usage from a Carbon Black function with an established session:
+#       skipped = endpoint_archive.stage_archive(session, [[r'C:\Windows\CarbonBlack\sensor.log', 'sensor.log']], r'C:\Windows\CarbonBlack\Reports\cb_logs.zip', endpoint_archive.archive_timeout(size))
+#       if skipped is not None:  # None when the endpoint could not compress in time, retrieve the files one by one instead
+#           transfer.stream_file(session, r'C:\Windows\CarbonBlack\Reports\cb_logs.zip', temp_zip)  # One get file for every file
+#   The archive is written by .NET's System.IO.Compression (built into Windows 8 / Server 2012 and later, .NET 4.5 on Windows 7).
+#   Files are opened with full sharing so logs held open by the sensor or AV engine can still be archived.
+
+import os
+import base64
+import logging
+import zipfile
+import tempfile
+from cbapi.errors import TimeoutError
+import carbon_black.util.phase_metrics as phase_metrics
+
+log = logging.getLogger(__name__)  # Establish logging
+
+ARCHIVE_TIMEOUT = 300  # Seconds the endpoint may take to compress the files, plus a second for every ARCHIVE_RATE bytes
+ARCHIVE_RATE = 5*1000000  # Bytes per second the endpoint is assumed to compress at, at worst
+
+# PowerShell that archives every "path|member name" line of the file list, printing SKIPPED|path for files it could not read
+ARCHIVE_SCRIPT = u'''$ErrorActionPreference = 'Stop'
+Add-Type -AssemblyName System.IO.Compression
+Add-Type -AssemblyName System.IO.Compression.FileSystem
+if (Test-Path -LiteralPath '{archive}') {{ Remove-Item -LiteralPath '{archive}' -Force }}
+$zip = [System.IO.Compression.ZipFile]::Open('{archive}', 'Create')
+try {{
+    foreach ($line in [System.IO.File]::ReadAllLines('{file_list}')) {{
+        if (-not $line) {{ continue }}
+        $path, $name = $line.Split('|')
+        try {{ $in = [System.IO.File]::Open($path, 'Open', 'Read', 'ReadWrite, Delete') }}
+        catch {{ Write-Output ('SKIPPED|' + $path); continue }}
+        try {{
+            $out = $zip.CreateEntry($name, 'Optimal').Open()
+            try {{ $in.CopyTo($out) }} finally {{ $out.Dispose() }}
+        }} finally {{ $in.Dispose() }}
+    }}
+}} finally {{ $zip.Dispose() }}
+Write-Output 'ARCHIVED'
+'''
+
+
+def encoded_command(script):
+    """
+    Encode a PowerShell script for -EncodedCommand, avoids every quoting issue of the command line
+    :param script: PowerShell script
+    :return: base64 string of the UTF-16LE script
+    """
+    return base64.b64encode(script.encode('utf-16-le')).decode('ascii')
+
+
+def archive_timeout(total_size):
+    """
+    Seconds to allow the endpoint for compressing files
+    :param total_size: bytes held by the files
+    :return: int
+    """
+    return ARCHIVE_TIMEOUT + int(total_size / ARCHIVE_RATE)
+
+
+def stage_archive(session, members, archive_path, timeout=ARCHIVE_TIMEOUT):
+    """
+    Compress files into a ZIP archive on the endpoint
+    :param session: established live response session
+    :param members: list of [endpoint file path, member name in the archive] pairs
+    :param archive_path: endpoint path of the archive to create, replaced if it exists
+    :param timeout: seconds the endpoint may take to compress the files, see archive_timeout()
+    :return: list of endpoint file paths that could not be archived, or None if the endpoint could not compress them in time
+    :raises TimeoutError if the sensor stops responding
+    """
+    file_list = archive_path + '.txt'
+    with tempfile.TemporaryFile() as temp_list:
+        temp_list.write(u'\r\n'.join(path + u'|' + name.replace(os.sep, '/').lstrip('/') for path, name in members).encode('utf-8'))  # Member names use ZIP separators
+        temp_list.seek(0)
+        session.put_file(temp_list, file_list)  # The list can be far longer than a command line allows
+
+    try:
+        with phase_metrics.phase(phase_metrics.ZIP):  # Compressing on the endpoint, not a command of the job
+            output = session.create_process(r'powershell.exe -ExecutionPolicy Bypass -NonInteractive -EncodedCommand ' + encoded_command(ARCHIVE_SCRIPT.format(archive=archive_path, file_list=file_list)), True, None, None, timeout, True)
+    except TimeoutError:  # The files are retrieved uncompressed instead. Deleting the file list fails too if the sensor stopped responding.
+        log.info('[INFO] Endpoint did not finish compressing ' + archive_path + ' within ' + str(timeout) + ' seconds')
+        output = b''
+    except Exception as err:
+        log.info('[INFO] Endpoint could not compress ' + archive_path + ': ' + str(err))
+        output = b''
+    finally:
+        try: session.delete_file(file_list)
+        except TimeoutError: raise
+        except Exception: pass
+
+    if isinstance(output, bytes):
+        output = output.decode('utf-8', 'replace')
+    if 'ARCHIVED' not in output:  # PowerShell or System.IO.Compression is unavailable
+        log.info('[INFO] Endpoint could not compress ' + archive_path + ': ' + output.strip()[:500])
+        return None
+    return [line.strip()[len('SKIPPED|'):] for line in output.splitlines() if line.strip().startswith('SKIPPED|')]
+
+
+def extract_member(local_archive, member, output_directory):
+    """
+    Unpack one member of a retrieved archive
+    :param local_archive: local path of the archive retrieved from the endpoint
+    :param member: member name in the archive
+    :param output_directory: local directory the member is written to
+    :return: local path of the unpacked member
+    """
+    with zipfile.ZipFile(local_archive, 'r') as zip_file:
+        return zip_file.extract(member, output_directory)
+
+
+def verify(local_archive):
+    """
+    Check a retrieved archive is complete and every member's CRC matches
+    :param local_archive: local path of the archive retrieved from the endpoint
+    :return: boolean
+    """
+    try:
+        with zipfile.ZipFile(local_archive, 'r') as zip_file:
+            return zip_file.testzip() is None
+    except (zipfile.BadZipfile, IOError, OSError):
+        return False
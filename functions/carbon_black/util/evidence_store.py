@@ -0,0 +1,481 @@
+# -*- coding: utf-8 -*-
+
+# This utility keeps retrieved evidence in a content-addressed store shared by every incident.
+# File: evidence_store.py
+# Date: 10/18/2026
+# Author: Jared F
+
+"""Content-addressed evidence store"""
+#   Usage from a Carbon Black function with an established session:
+#       hashes = evidence_store.endpoint_hashes(session, [r'C:\Windows\System32\evil.dll'])  # One round trip hashes every file on the endpoint
+#       if evidence_store.reference(hashes[r'C:\Windows\System32\evil.dll'], incident_id): ...  # Retrieved before and now referenced, skip the transfer
+#       sha256 = evidence_store.add(local_file, incident_id)  # Store a retrieved file and reference it from the incident
+#       evidence_store.unreference(sha256, incident_id)  # Not delivered into the store after all, drop the reference again
+#       evidence_store.write_manifest(manifest_path, incident_id, hostname, entries)  # Incident bundle pointing into the store
+#       evidence_store.release(incident_id)  # Drop the incident's references, unreferenced files are deleted
+#       evidence_store.register(self)  # In __init__, sweeps the store for deleted incidents and bundles
+#   Files are stored once under objects/<first two hex digits>/<sha256>, whichever incident retrieved them first.
+#   REFS_FILE counts, per file, the references each incident holds on it. Every process sharing the store reloads it
+#   under REFS_LOCK_FILE before changing it. Every SWEEP_INTERVAL the references of deleted incidents are released, and
+#   those of an incident whose bundle manifests were deleted are counted again from the manifests left in its directory.
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from cbapi.errors import TimeoutError
+import carbon_black.util.endpoint_archive as endpoint_archive
+
+try:
+    import fcntl
+except ImportError:  # Not POSIX, the store is then only safe to share between the threads of one process
+    fcntl = None
+
+log = logging.getLogger(__name__)  # Establish logging
+
+STORE_DIRECTORY = '/mnt/cyber-sec-forensics/Resilient/evidence_store'  # Root of the store, on the forensics network share
+BUNDLE_DIRECTORY = '/mnt/cyber-sec-forensics/Resilient'  # Incident directories holding the bundle manifests
+REFS_FILE = 'refs.json'  # Per file reference counts, relative to the store root
+REFS_LOCK_FILE = 'refs.lock'  # Locked while a process changes REFS_FILE, relative to the store root
+SWEEP_INTERVAL = 3600  # Seconds between sweeps for deleted incidents and bundles
+SWEEP_GRACE = 86400  # Seconds a newly referenced file is left alone by the sweep, its bundle may still be in the making
+MIN_DEDUP_SIZE = 1024*1024  # Bytes, smaller files are transferred rather than hashed on the endpoint first
+HASH_TIMEOUT = 300  # Seconds the endpoint may take to hash the files, plus a second for every HASH_RATE bytes
+HASH_RATE = 10*1000000  # Bytes per second the endpoint is assumed to hash at, at worst
+
+# PowerShell that prints sha256|path for every path line of the file list, files it could not read are left out
+HASH_SCRIPT = u'''$sha256 = [System.Security.Cryptography.SHA256]::Create()
+foreach ($path in [System.IO.File]::ReadAllLines('{file_list}')) {{
+    if (-not $path) {{ continue }}
+    try {{ $in = [System.IO.File]::Open($path, 'Open', 'Read', 'ReadWrite, Delete') }}
+    catch {{ continue }}
+    try {{ Write-Output (([System.BitConverter]::ToString($sha256.ComputeHash($in)) -replace '-', '') + '|' + $path) }}
+    catch {{ }}
+    finally {{ $in.Dispose() }}
+}}
+Write-Output 'HASHED'
+'''
+
+
+class EvidenceStore(object):
+    # Singleton
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self, store_directory=STORE_DIRECTORY, bundle_directory=BUNDLE_DIRECTORY):
+        self.store_directory = store_directory
+        self.bundle_directory = bundle_directory
+        self._lock = threading.Lock()
+        self._refs = None  # sha256 -> {"size": bytes, "incidents": {incident_id: references}, "referenced": time}, reloaded on every change
+        self._incident_exists = None  # Callable taking an incident ID, False once the incident is deleted
+        self._thread = None
+
+    @staticmethod
+    def get_store():
+        with EvidenceStore.__instance_lock:
+            if EvidenceStore.__instance is None:
+                EvidenceStore.__instance = EvidenceStore()
+        return EvidenceStore.__instance
+
+    def _load(self):
+        """
+        Reference counts, as last saved by any process. Caller must hold the lock.
+        :return: dict
+        """
+        try:
+            with open(os.path.join(self.store_directory, REFS_FILE), 'r') as f:
+                self._refs = json.load(f)
+        except (IOError, OSError, ValueError):
+            self._refs = {}
+        return self._refs
+
+    @contextmanager
+    def _locked(self):
+        """
+        Change the reference counts, locked against this and every other process sharing the store
+        :return: context manager giving the reference counts, saved once the block completes
+        """
+        with self._lock:
+            if not os.path.exists(self.store_directory):
+                os.makedirs(self.store_directory)
+            with open(os.path.join(self.store_directory, REFS_LOCK_FILE), 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)  # Released when the lock file is closed
+                refs = self._load()  # Another process may have changed them since
+                yield refs
+                self._save()
+
+    def _save(self):
+        """
+        Write the reference counts. Caller must hold the lock.
+        :return:
+        """
+        refs_file = os.path.join(self.store_directory, REFS_FILE)
+        try:
+            if not os.path.exists(self.store_directory):
+                os.makedirs(self.store_directory)
+            temp_refs_file = refs_file + '.' + str(os.getpid())
+            with open(temp_refs_file, 'w') as f:
+                f.write(json.dumps(self._refs))
+            os.rename(temp_refs_file, refs_file)  # Atomic replace, readers never see partial reference counts
+        except (IOError, OSError) as err:
+            log.error('[ERROR] Could not save evidence store references: ' + str(err))
+
+    def object_path(self, sha256):
+        """
+        Store path of a file's content
+        :param sha256: hex digest of the file
+        :return: local file path
+        """
+        return os.path.join(self.store_directory, 'objects', sha256[:2], sha256)
+
+    def contains(self, sha256):
+        """
+        Whether the store holds a file's content
+        :param sha256: hex digest of the file, None is never held
+        :return: boolean
+        """
+        return sha256 is not None and os.path.exists(self.object_path(sha256))
+
+    def reference(self, sha256, incident_id):
+        """
+        Count a reference from an incident on a stored file, a referenced file is never deleted by a sweep
+        :param sha256: hex digest of the file, None is never held
+        :param incident_id: Resilient incident ID
+        :return: boolean, False if the store does not hold the file
+        """
+        with self._locked() as refs:
+            if not self.contains(sha256):  # Checked under the lock, a sweep deletes files only while holding it
+                return False
+            entry = refs.setdefault(sha256, {"size": os.path.getsize(self.object_path(sha256)), "incidents": {}})
+            entry["incidents"][str(incident_id)] = entry["incidents"].get(str(incident_id), 0) + 1
+            entry["referenced"] = int(time.time())
+        return True
+
+    def unreference(self, sha256, incident_id):
+        """
+        Drop one reference from an incident on a stored file, the file is deleted once no incident references it
+        :param sha256: hex digest of a stored file
+        :param incident_id: Resilient incident ID
+        :return: number of bytes freed
+        """
+        freed = 0
+        with self._locked() as refs:
+            entry = refs.get(sha256)
+            if entry is not None and str(incident_id) in entry["incidents"]:
+                entry["incidents"][str(incident_id)] -= 1
+                if entry["incidents"][str(incident_id)] <= 0:
+                    del entry["incidents"][str(incident_id)]
+                if not entry["incidents"]:
+                    freed = self._delete(refs, sha256)
+        return freed
+
+    def add(self, local_file, incident_id):
+        """
+        Store a retrieved file, unless its content is already held, and reference it from an incident
+        :param local_file: local path of the retrieved file, left in place
+        :param incident_id: Resilient incident ID
+        :return: hex digest of the file
+        """
+        sha256 = hashlib.sha256()
+        with open(local_file, 'rb') as f:
+            for block in iter(lambda: f.read(1024*1024), b''):
+                sha256.update(block)
+        sha256 = sha256.hexdigest()
+
+        object_path = self.object_path(sha256)
+        while not self.reference(sha256, incident_id):  # Not held yet, or deleted by a sweep since it was checked
+            if not os.path.exists(os.path.dirname(object_path)):
+                try: os.makedirs(os.path.dirname(object_path))
+                except OSError: pass  # Created by a concurrent add
+            temp_fd, temp_object_path = tempfile.mkstemp(dir=os.path.dirname(object_path))
+            os.close(temp_fd)
+            shutil.copyfile(local_file, temp_object_path)
+            os.rename(temp_object_path, object_path)  # Atomic, the store never holds a partial file
+        return sha256
+
+    def release(self, incident_id):
+        """
+        Drop every reference an incident holds, files no incident references any more are deleted
+        :param incident_id: Resilient incident ID
+        :return: number of bytes freed
+        """
+        freed = 0
+        with self._locked() as refs:
+            for sha256 in list(refs):
+                if refs[sha256]["incidents"].pop(str(incident_id), None) is None:
+                    continue
+                if not refs[sha256]["incidents"]:
+                    freed += self._delete(refs, sha256)
+        if freed: log.info('[INFO] Released the evidence of incident ' + str(incident_id) + ', ' + str(freed) + ' bytes freed')
+        return freed
+
+    def _delete(self, refs, sha256):
+        """
+        Delete a file no incident references any more. Caller must hold _locked().
+        :param refs: reference counts
+        :param sha256: hex digest of the file
+        :return: number of bytes freed
+        """
+        try: os.remove(self.object_path(sha256))
+        except OSError: pass  # Removed already
+        return refs.pop(sha256)["size"]
+
+    def bundle_references(self, incident_id):
+        """
+        References an incident's bundle manifests hold on stored files
+        :param incident_id: Resilient incident ID
+        :return: dict of sha256 -> references, or None if the manifests could not be read
+        """
+        references = {}
+        incident_directory = os.path.join(self.bundle_directory, str(incident_id))
+        try:
+            names = os.listdir(incident_directory) if os.path.isdir(incident_directory) else []  # A deleted directory holds no bundles
+            for name in [name for name in names if name.endswith('.json')]:
+                with open(os.path.join(incident_directory, name), 'r') as f:
+                    manifest = json.load(f)
+                if not isinstance(manifest, dict) or manifest.get("store") is None:  # Not a manifest into the store
+                    continue
+                for each_file in manifest.get("files", []):
+                    references[each_file["sha256"]] = references.get(each_file["sha256"], 0) + 1
+        except (IOError, OSError, ValueError, KeyError, TypeError) as err:
+            log.error('[ERROR] Could not read the evidence manifests of incident ' + str(incident_id) + ': ' + str(err))
+            return None
+        return references
+
+    def sweep(self, incident_exists=None):
+        """
+        Release the references of deleted incidents, and count those of the others again from their bundle manifests
+        :param incident_exists: callable taking an incident ID, False once the incident is deleted
+        :return: number of bytes freed
+        """
+        if not os.path.isdir(self.store_directory) or not os.path.isdir(self.bundle_directory):  # Never release everything because the share is not mounted
+            return 0
+        with self._locked() as refs:
+            incidents = set(incident_id for entry in refs.values() for incident_id in entry["incidents"])
+
+        freed = 0
+        for incident_id in incidents:
+            if incident_exists is not None and not incident_exists(incident_id):  # Checked outside the lock, Resilient may be slow
+                freed += self.release(incident_id)
+                continue
+            references = self.bundle_references(incident_id)
+            if references is None:
+                continue
+            with self._locked() as refs:
+                for sha256 in list(refs):
+                    entry = refs[sha256]
+                    if str(incident_id) not in entry["incidents"] or entry.get("referenced", 0) > time.time() - SWEEP_GRACE:
+                        continue
+                    if references.get(sha256):
+                        entry["incidents"][str(incident_id)] = references[sha256]
+                        continue
+                    del entry["incidents"][str(incident_id)]  # Its bundles were deleted
+                    if not entry["incidents"]:
+                        freed += self._delete(refs, sha256)
+        if freed: log.info('[INFO] Evidence store sweep freed ' + str(freed) + ' bytes')
+        return freed
+
+    def register(self, component):
+        """
+        Sweep the store every SWEEP_INTERVAL on a background thread
+        :param component: FunctionComponent whose rest_client() tells whether an incident still exists
+        :return:
+        """
+        def incident_exists(incident_id):
+            try: component.rest_client().get('/incidents/{0}'.format(incident_id))
+            except Exception as err:
+                return 'not found' not in str(err).lower()  # Only a deleted incident is released, never one Resilient could not be asked about
+            return True
+
+        with self._lock:
+            self._incident_exists = incident_exists
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._sweep_forever, name='cb-evidence-store')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _sweep_forever(self):
+        while True:
+            time.sleep(SWEEP_INTERVAL)
+            try: self.sweep(self._incident_exists)
+            except Exception as err: log.error('[ERROR] Could not sweep the evidence store: ' + str(err))
+
+    @staticmethod
+    def hash_timeout(total_size):
+        """
+        Seconds to allow the endpoint for hashing files
+        :param total_size: bytes held by the files
+        :return: int
+        """
+        return HASH_TIMEOUT + int(total_size / HASH_RATE)
+
+    @staticmethod
+    def endpoint_hashes(session, paths, timeout=HASH_TIMEOUT):
+        """
+        SHA-256 of files on the endpoint, hashed by a single PowerShell process
+        :param session: established live response session
+        :param paths: endpoint file paths
+        :param timeout: seconds the endpoint may take to hash the files, see hash_timeout()
+        :return: dict of endpoint file path -> lowercase hex digest, empty if the endpoint did not finish hashing in time
+        :raises TimeoutError if the sensor stops responding
+        """
+        file_list = r'C:\Windows\CarbonBlack\Reports\evidence_hashes.txt'
+        try: session.create_directory(r'C:\Windows\CarbonBlack\Reports')
+        except TimeoutError: raise
+        except Exception: pass  # Existed already
+
+        with tempfile.TemporaryFile() as temp_list:
+            temp_list.write(u'\r\n'.join(paths).encode('utf-8'))
+            temp_list.seek(0)
+            session.put_file(temp_list, file_list)  # The list can be far longer than a command line allows
+
+        try:
+            output = session.create_process(r'powershell.exe -ExecutionPolicy Bypass -NonInteractive -EncodedCommand ' + endpoint_archive.encoded_command(HASH_SCRIPT.format(file_list=file_list)), True, None, None, timeout, True)
+        except TimeoutError:  # Hashing is only an optimization, every file is transferred instead. Deleting the file list fails too if the sensor stopped responding.
+            log.info('[INFO] Endpoint did not finish hashing ' + str(len(paths)) + ' file(s) within ' + str(timeout) + ' seconds')
+            output = b''
+        except Exception as err:
+            log.info('[INFO] Endpoint could not hash files: ' + str(err))
+            output = b''
+        finally:
+            try: session.delete_file(file_list)
+            except TimeoutError: raise
+            except Exception: pass
+
+        if isinstance(output, bytes):
+            output = output.decode('utf-8', 'replace')
+        hashes = {}
+        for line in output.splitlines():
+            if '|' in line:
+                sha256, path = line.strip().split('|', 1)
+                hashes[path] = sha256.lower()
+        return hashes
+
+    def write_manifest(self, manifest_path, incident_id, hostname, entries):
+        """
+        Write an incident bundle as a manifest pointing into the store
+        :param manifest_path: local path of the manifest
+        :param incident_id: Resilient incident ID
+        :param hostname: host the files were retrieved from
+        :param entries: list of [path within the bundle, endpoint file path, sha256] lists
+        :return:
+        """
+        manifest = {"incident_id": incident_id, "hostname": hostname, "created": int(time.time()), "store": self.store_directory,
+                    "files": [{"path": path.replace(os.sep, '/').lstrip('/'), "source": source, "sha256": sha256, "object": os.path.relpath(self.object_path(sha256), self.store_directory)} for path, source, sha256 in entries]}
+        if not os.path.exists(os.path.dirname(manifest_path)):
+            os.makedirs(os.path.dirname(manifest_path))
+        with open(manifest_path, 'w') as f:
+            f.write(json.dumps(manifest, indent=2))
+
+
+def object_path(sha256):
+    """
+    Store path of a file's content
+    :param sha256: hex digest of the file
+    :return: local file path
+    """
+    return EvidenceStore.get_store().object_path(sha256)
+
+
+def contains(sha256):
+    """
+    Whether the store holds a file's content
+    :param sha256: hex digest of the file
+    :return: boolean
+    """
+    return EvidenceStore.get_store().contains(sha256)
+
+
+def reference(sha256, incident_id):
+    """
+    Count a reference from an incident on a stored file
+    :param sha256: hex digest of the file
+    :param incident_id: Resilient incident ID
+    :return: boolean, False if the store does not hold the file
+    """
+    return EvidenceStore.get_store().reference(sha256, incident_id)
+
+
+def unreference(sha256, incident_id):
+    """
+    Drop one reference from an incident on a stored file, unreferenced files are deleted
+    :param sha256: hex digest of a stored file
+    :param incident_id: Resilient incident ID
+    :return: number of bytes freed
+    """
+    return EvidenceStore.get_store().unreference(sha256, incident_id)
+
+
+def add(local_file, incident_id):
+    """
+    Store a retrieved file and reference it from an incident
+    :param local_file: local path of the retrieved file
+    :param incident_id: Resilient incident ID
+    :return: hex digest of the file
+    """
+    return EvidenceStore.get_store().add(local_file, incident_id)
+
+
+def release(incident_id):
+    """
+    Drop every reference an incident holds, unreferenced files are deleted
+    :param incident_id: Resilient incident ID
+    :return: number of bytes freed
+    """
+    return EvidenceStore.get_store().release(incident_id)
+
+
+def sweep(incident_exists=None):
+    """
+    Release the references of deleted incidents and deleted bundles, unreferenced files are deleted
+    :param incident_exists: callable taking an incident ID, False once the incident is deleted
+    :return: number of bytes freed
+    """
+    return EvidenceStore.get_store().sweep(incident_exists)
+
+
+def register(component):
+    """
+    Sweep the store every SWEEP_INTERVAL on a background thread
+    :param component: FunctionComponent whose rest_client() tells whether an incident still exists
+    :return:
+    """
+    EvidenceStore.get_store().register(component)
+
+
+def hash_timeout(total_size):
+    """
+    Seconds to allow the endpoint for hashing files
+    :param total_size: bytes held by the files
+    :return: int
+    """
+    return EvidenceStore.hash_timeout(total_size)
+
+
+def endpoint_hashes(session, paths, timeout=HASH_TIMEOUT):
+    """
+    SHA-256 of files on the endpoint, hashed by a single PowerShell process
+    :param session: established live response session
+    :param paths: endpoint file paths
+    :param timeout: seconds the endpoint may take to hash the files, see hash_timeout()
+    :return: dict of endpoint file path -> lowercase hex digest
+    """
+    return EvidenceStore.endpoint_hashes(session, paths, timeout)
+
+
+def write_manifest(manifest_path, incident_id, hostname, entries):
+    """
+    Write an incident bundle as a manifest pointing into the store
+    :param manifest_path: local path of the manifest
+    :param incident_id: Resilient incident ID
+    :param hostname: host the files were retrieved from
+    :param entries: list of [path within the bundle, endpoint file path, sha256] lists
+    :return:
+    """
+    EvidenceStore.get_store().write_manifest(manifest_path, incident_id, hostname, entries)
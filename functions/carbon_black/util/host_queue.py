@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+
+# This utility serializes live response work per host with a priority job queue and lease-based host locks.
+# File: host_queue.py
+# Date: 10/18/2026
+# Author: Jared F
+
+"""Per-host job queue"""
+#   Usage from a Carbon Black function:
+#       host_ticket = host_queue.enqueue(hostname, 'cb_retrieve_services')  # Take a place in the host's queue
+#       host_queue.wait_for_turn(host_ticket, deadline)  # Returns as soon as every job ahead has released the host
+#       host_queue.release(host_ticket)  # Hand the host to the next queued job
+#   Jobs are served by priority class, then first come, first served. The class comes from JOB_PRIORITIES unless given
+#   to enqueue(): containment jobs queue ahead of every waiting job, and may run alongside a bulk job holding the host,
+#   sharing its brokered session, so a kill is never stuck behind hours of log transfers. Across hosts, jobs in this
+#   process share a budget of MAX_ACTIVE_JOBS, of which bulk jobs may take MAX_BULK_JOBS, and containment jobs are never
+#   held back by the budget. Tickets enqueued with the same budget_key take a single slot between them, so the hosts of
+#   one fleet run count as one job and never crowd out other work. The host lock file holds a lease naming the owning process, it is renewed while held and
+#   reclaimed when the owning process has died or the lease has expired.
+
+import os
+import json
+import time
+import uuid
+import errno
+import socket
+import logging
+import datetime
+import threading
+import carbon_black.util.phase_metrics as phase_metrics
+
+log = logging.getLogger(__name__)  # Establish logging
+
+LOCK_DIRECTORY = '/home/integrations/.resilient/cb_host_locks'  # Host lock files, one <HOST>.lock per locked host
+LEASE_TTL = 300  # Seconds a host lock lease stays valid without renewal
+RENEW_INTERVAL = 60  # Seconds between lease renewals of held host locks
+RECHECK_INTERVAL = 3  # Seconds between attempts on a host lock held by another process
+
+CONTAINMENT = 0  # Urgent response actions, jump the queue and may run alongside a bulk job
+STANDARD = 1  # Short collections and actions
+BULK = 2  # Long transfers and forensic collections
+PRIORITY_NAMES = {CONTAINMENT: 'containment', STANDARD: 'standard', BULK: 'bulk'}
+
+# Priority class of each function, functions not listed are STANDARD
+JOB_PRIORITIES = {
+    'cb_kill_process': CONTAINMENT,
+    'cb_delete_file_kill_if_necessary': CONTAINMENT,
+    'cb_retrieve_av_logs': BULK,
+    'cb_retrieve_browsing_history': BULK,
+    'cb_retrieve_carbon_black_logs': BULK,
+    'cb_retrieve_file_or_directory': BULK,
+    'cb_retrieve_prefetch_files': BULK,
+    'cb_retrieve_registry_hives': BULK,
+    'cb_retrieve_windows_av_events': BULK,
+    'cb_retrieve_windows_security_events': BULK,
+}
+
+MAX_ACTIVE_JOBS = 8  # Standard and bulk jobs running at once in this process, keep below session_broker.MAX_SESSIONS so containment finds a session
+MAX_BULK_JOBS = 5  # Bulk jobs running at once in this process, the rest of MAX_ACTIVE_JOBS stays free for short jobs
+
+
+class HostTicket(object):
+    """ One job's place in a host's queue """
+    def __init__(self, hostname, job_name, priority=None, budget_key=None):
+        self.ticket_id = uuid.uuid4().hex
+        self.hostname = hostname
+        self.job_name = job_name
+        self.priority = JOB_PRIORITIES.get(job_name, STANDARD) if priority is None else priority
+        self.budget_key = budget_key or self.ticket_id  # Tickets sharing a key take one slot of the job budget
+        self.enqueued = time.time()
+        self.acquired = False  # True while this job holds the host
+        self.released = False  # True once the job left the queue
+        self.alongside = False  # True while this containment job runs alongside the bulk job holding the host
+        self.over_budget = False  # True while this job is next on its host but held back by the job budget
+
+
+class HostQueue(object):
+    # Singleton
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self, lock_directory=LOCK_DIRECTORY, max_active_jobs=MAX_ACTIVE_JOBS, max_bulk_jobs=MAX_BULK_JOBS):
+        self.lock_directory = lock_directory
+        self.max_active_jobs = max_active_jobs
+        self.max_bulk_jobs = max_bulk_jobs
+        self._condition = threading.Condition()
+        self._queues = {}  # hostname -> list of HostTicket by priority then arrival, the holder stays at the head
+        self._heartbeat = None
+
+    @staticmethod
+    def get_queue():
+        with HostQueue.__instance_lock:
+            if HostQueue.__instance is None:
+                HostQueue.__instance = HostQueue()
+        return HostQueue.__instance
+
+    def _lock_file(self, hostname):
+        return os.path.join(self.lock_directory, '{}.lock'.format(hostname))
+
+    def _lease(self, ticket):
+        return {"ticket_id": ticket.ticket_id, "job": ticket.job_name, "pid": os.getpid(), "server": socket.gethostname(),
+                "acquired": ticket.enqueued, "lease_expires": time.time() + LEASE_TTL}
+
+    @staticmethod
+    def _pid_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except OSError as err:
+            return err.errno == errno.EPERM  # EPERM means the process exists but belongs to another user
+        return True
+
+    def read_lease(self, hostname):
+        """
+        Read the lease stored in a host lock file
+        :param hostname: host the lock file belongs to
+        :return: lease dict, an empty dict for a lock file without a lease, or None if the host is not locked
+        """
+        lock_file = self._lock_file(hostname)
+        try:
+            with open(lock_file, 'r') as f:
+                contents = f.read()
+        except (IOError, OSError):
+            return None
+        try: return json.loads(contents)
+        except ValueError: return {}  # Lock files from before leases were added are empty
+
+    def is_stale(self, hostname):
+        """
+        A host lock is stale when its owning process on this server died or its lease expired
+        :param hostname: host the lock file belongs to
+        :return: boolean
+        """
+        lease = self.read_lease(hostname)
+        if lease is None:
+            return False
+        if not lease:  # No lease, fall back to the lock file's age
+            try: return time.time() - os.path.getmtime(self._lock_file(hostname)) > LEASE_TTL
+            except OSError: return False
+        if lease.get("server") == socket.gethostname() and not self._pid_alive(lease.get("pid", 0)):
+            return True
+        return time.time() > lease.get("lease_expires", 0)
+
+    def _write_lease(self, ticket, create):
+        """
+        Write a lease for ticket into its host lock file
+        :param ticket: HostTicket
+        :param create: True to create the lock file exclusively, False to renew a held lock
+        :return: True if the lease was written
+        """
+        lock_file = self._lock_file(ticket.hostname)
+        if create:
+            try:
+                fd = os.open(lock_file, os.O_CREAT | os.O_WRONLY | os.O_EXCL)
+            except OSError:
+                return False
+            with os.fdopen(fd, 'w') as f:
+                f.write(json.dumps(self._lease(ticket)))
+            return True
+
+        temp_lock_file = lock_file + '.' + ticket.ticket_id
+        with open(temp_lock_file, 'w') as f:
+            f.write(json.dumps(self._lease(ticket)))
+        os.rename(temp_lock_file, lock_file)  # Atomic replace, readers never see a partial lease
+        return True
+
+    def _try_lock(self, ticket):
+        """
+        Try to take the host lock file for ticket, reclaiming it if stale
+        :param ticket: HostTicket
+        :return: True if the lock was taken
+        """
+        if not os.path.exists(self.lock_directory):
+            os.makedirs(self.lock_directory)
+        if self._write_lease(ticket, True):
+            return True
+        if self.is_stale(ticket.hostname):
+            log.info('[INFO] Reclaiming stale host lock on ' + ticket.hostname + ': ' + str(self.read_lease(ticket.hostname)))
+            try: os.remove(self._lock_file(ticket.hostname))
+            except OSError: pass
+            return self._write_lease(ticket, True)
+        return False
+
+    def _start_heartbeat(self):
+        if self._heartbeat is None or not self._heartbeat.is_alive():
+            self._heartbeat = threading.Thread(target=self._renew_forever, name='cb-host-queue')
+            self._heartbeat.daemon = True
+            self._heartbeat.start()
+
+    def _renew_forever(self):
+        while True:
+            time.sleep(RENEW_INTERVAL)
+            with self._condition:  # Renew under the condition so a lease is never rewritten after release()
+                for ticket in [queue[0] for queue in self._queues.values() if queue and queue[0].acquired]:
+                    try: self._write_lease(ticket, False)
+                    except Exception as err: log.error('[ERROR] Could not renew host lock lease on ' + ticket.hostname + ': ' + str(err))
+
+    def enqueue(self, hostname, job_name, priority=None, budget_key=None):
+        """
+        Take a place in a host's queue, behind the holder and every waiting job of the same or a higher priority class
+        :param hostname: host the job runs against
+        :param job_name: name of the function running the job, shown to other queued jobs
+        :param priority: CONTAINMENT, STANDARD or BULK, defaults to the job's class in JOB_PRIORITIES
+        :param budget_key: tickets enqueued with the same key take one slot of the job budget, ie the hosts of a fleet run
+        :return: HostTicket
+        """
+        ticket = HostTicket(hostname, job_name, priority, budget_key)
+        with self._condition:
+            queue = self._queues.setdefault(hostname, [])
+            position = len(queue)
+            while position > 0 and not queue[position - 1].acquired and queue[position - 1].priority > ticket.priority:
+                position -= 1
+            if position == 0 and queue:
+                queue[0].over_budget = False  # No longer next on the host
+            queue.insert(position, ticket)
+            if position < len(queue) - 1:
+                log.info('[INFO] ' + job_name + ' (' + PRIORITY_NAMES[ticket.priority] + ') queued ahead of ' + str(len(queue) - 1 - position) + ' waiting jobs on ' + hostname)
+        self._start_heartbeat()
+        return ticket
+
+    def jobs_ahead(self, ticket):
+        """
+        Number of jobs queued or running ahead of ticket in this process, plus one if another process holds the host.
+        Zero for a containment ticket that can run alongside the bulk job holding the host.
+        :param ticket: HostTicket
+        :return: int
+        """
+        if ticket.acquired:
+            return 0
+        with self._condition:
+            queue = self._queues.get(ticket.hostname, [])
+            if self._may_run_alongside(ticket, queue):
+                return 0
+            ahead = queue.index(ticket) if ticket in queue else 0
+        if ahead == 0 and os.path.exists(self._lock_file(ticket.hostname)) and not self.is_stale(ticket.hostname):
+            ahead = 1
+        return ahead
+
+    def _within_budget(self, ticket):
+        """
+        Whether ticket may start without exceeding the job budget. Caller must hold the condition.
+        :param ticket: HostTicket next on its host
+        :return: boolean
+        """
+        if ticket.priority == CONTAINMENT:
+            return True
+        tickets = [t for queue in self._queues.values() for t in queue]
+        active = [t for t in tickets if t.acquired and t.priority != CONTAINMENT]
+        if any(t.budget_key == ticket.budget_key for t in active):  # Shares the slot another ticket of its run holds
+            return True
+        if len(set(t.budget_key for t in active)) >= self.max_active_jobs:
+            return False
+        if ticket.priority == BULK and len(set(t.budget_key for t in active if t.priority == BULK)) >= self.max_bulk_jobs:
+            return False
+        return not any(t.over_budget and t.priority < ticket.priority for t in tickets)  # A more urgent job is waiting for the next free slot
+
+    def _may_run_alongside(self, ticket, queue):
+        """
+        Whether a containment ticket may run alongside the bulk job holding its host. Caller must hold the condition.
+        :param ticket: HostTicket
+        :param queue: the host's queue
+        :return: boolean
+        """
+        return (ticket.priority == CONTAINMENT and len(queue) > 1 and queue[1] is ticket and queue[0].acquired
+                and queue[0].priority == BULK and not queue[0].alongside)
+
+    def wait_for_turn(self, ticket, deadline):
+        """
+        Block until ticket may use the host, or the deadline passes. A ticket is handed the host once every job ahead of it
+        released the host, the job budget has room and it holds the host lock. A containment ticket is handed the host
+        right away when a bulk job in this process holds it, and shares that job's host lock.
+        :param ticket: HostTicket
+        :param deadline: datetime.datetime after which the wait gives up
+        :return: True if ticket holds the host
+        """
+        with self._condition:
+            while not ticket.acquired and not ticket.released:
+                queue = self._queues.get(ticket.hostname, [])
+                if self._may_run_alongside(ticket, queue):
+                    ticket.acquired = ticket.alongside = True
+                    log.info('[INFO] ' + ticket.job_name + ' is running alongside ' + queue[0].job_name + ' on ' + ticket.hostname)
+                    break
+                if queue and queue[0] is ticket:
+                    ticket.over_budget = not self._within_budget(ticket)
+                    if not ticket.over_budget and self._try_lock(ticket):
+                        ticket.acquired = True
+                        log.info('[INFO] ' + ticket.job_name + ' acquired the host lock on ' + ticket.hostname)
+                        break
+
+                remaining = (deadline - datetime.datetime.now()).total_seconds()
+                if remaining <= 0:
+                    break
+                self._condition.wait(min(remaining, RECHECK_INTERVAL))  # Woken immediately by release() in this process
+        return ticket.acquired
+
+    def release(self, ticket):
+        """
+        Leave the host's queue, releasing the host lock if held so the next queued job starts immediately
+        :param ticket: HostTicket, None is ignored
+        :return:
+        """
+        if ticket is None or ticket.released:
+            return
+        with self._condition:
+            ticket.released = True
+            ticket.over_budget = False
+            queue = self._queues.get(ticket.hostname, [])
+            if ticket in queue:
+                queue.remove(ticket)
+            if not queue:
+                self._queues.pop(ticket.hostname, None)
+            if ticket.acquired and not ticket.alongside:
+                lease = self.read_lease(ticket.hostname)
+                if lease is not None and lease.get("ticket_id") == ticket.ticket_id:  # Never remove a lock reclaimed by another job
+                    if queue and queue[0].alongside:  # A containment job is still running, it takes over the host lock
+                        queue[0].alongside = False
+                        try: self._write_lease(queue[0], False)
+                        except Exception as err: log.error('[ERROR] Could not hand the host lock on ' + ticket.hostname + ' to ' + queue[0].job_name + ': ' + str(err))
+                    else:
+                        try: os.remove(self._lock_file(ticket.hostname))
+                        except OSError: pass
+            ticket.acquired = ticket.alongside = False
+            self._condition.notify_all()
+
+    def status(self):
+        """
+        Snapshot of every host queue in this process
+        :return: dict of hostname -> list of dicts describing queued jobs, holder first
+        """
+        with self._condition:
+            return dict((hostname, [{"job": t.job_name, "priority": PRIORITY_NAMES[t.priority], "acquired": t.acquired, "alongside": t.alongside,
+                                     "over_budget": t.over_budget, "waiting_seconds": int(time.time() - t.enqueued)} for t in queue])
+                        for hostname, queue in self._queues.items())
+
+    def reclaim_stale_locks(self):
+        """
+        Remove stale host lock files, ie those left behind when resilient_circuits restarted
+        :return: list of removed lock file names
+        """
+        removed = []
+        if not os.path.exists(self.lock_directory):
+            os.makedirs(self.lock_directory)
+            return removed
+        for lock_file in [f for f in os.listdir(self.lock_directory) if f.endswith(".lock")]:
+            if self.is_stale(lock_file[:-len(".lock")]):
+                try: os.remove(os.path.join(self.lock_directory, lock_file))
+                except OSError: continue
+                removed.append(lock_file)
+        return removed
+
+
+def enqueue(hostname, job_name, priority=None, budget_key=None):
+    """
+    Take a place in a host's queue in the process-wide host queue
+    :param hostname: host the job runs against
+    :param job_name: name of the function running the job
+    :param priority: CONTAINMENT, STANDARD or BULK, defaults to the job's class in JOB_PRIORITIES
+    :param budget_key: tickets enqueued with the same key take one slot of the job budget
+    :return: HostTicket
+    """
+    return HostQueue.get_queue().enqueue(hostname, job_name, priority, budget_key)
+
+
+def jobs_ahead(ticket):
+    """
+    Number of jobs ahead of ticket
+    :param ticket: HostTicket
+    :return: int
+    """
+    return HostQueue.get_queue().jobs_ahead(ticket)
+
+
+def wait_for_turn(ticket, deadline):
+    """
+    Block until ticket holds its host or the deadline passes
+    :param ticket: HostTicket
+    :param deadline: datetime.datetime
+    :return: True if ticket holds the host
+    """
+    with phase_metrics.phase(phase_metrics.WAIT_LOCK):
+        return HostQueue.get_queue().wait_for_turn(ticket, deadline)
+
+
+def release(ticket):
+    """
+    Leave the host's queue and hand the host to the next job
+    :param ticket: HostTicket, None is ignored
+    :return:
+    """
+    HostQueue.get_queue().release(ticket)
+
+
+def reclaim_stale_locks():
+    """
+    Remove stale host lock files
+    :return: list of removed lock file names
+    """
+    return HostQueue.get_queue().reclaim_stale_locks()
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+
+# This utility journals every Carbon Black job in SQLite so jobs interrupted by a restart can be resumed.
+# File: job_journal.py
+# Date: 10/18/2026
+# Author: Jared F
+
+"""Durable job journal"""
+#   Usage from a Carbon Black function:
+#       job_entry = job_journal.start('cb_retrieve_services', incident_id, hostname, sensor.id, kwargs, days_later_timeout_length)
+#       job_journal.finish(job_entry, results)  # In the finally block, the job is no longer in flight
+#   The shared utilities journal the rest: completed phases (phase_metrics), checked out sessions (session_broker) and
+#   transfer checkpoints (transfer). Each is written once, the first time the job records it, so a job costs a few
+#   SQLite writes however often it repeats a phase. "phase" holds the furthest phase the job completed.
+#   A job still marked running whose process died was interrupted, ie by utility_restart_resilient_circuits. At startup
+#   the package initializer closes its orphaned live response sessions and resumes the job from its recorded phase:
+#     - a job that completed its upload phase delivered its results, it is not rerun
+#     - a job that never checked out a session never reached the endpoint, it is parked to run once its host is online
+#     - a RERUNNABLE_FUNCTIONS job that reached the endpoint is parked too, its rerun continues the transfers its
+#       journaled checkpoints hold instead of retrieving them again, and the checkpoints are kept while it is parked
+#     - other jobs (containment and actions) that reached the endpoint are only logged, they are not safe to repeat
+
+import os
+import json
+import time
+import uuid
+import errno
+import socket
+import sqlite3
+import logging
+import threading
+
+log = logging.getLogger(__name__)  # Establish logging
+
+JOURNAL_FILE = '/home/integrations/.resilient/cb_job_journal.db'  # SQLite job journal, kept across restarts
+JOURNAL_TTL = 7*86400  # Seconds journal entries of jobs no longer in flight are kept, default = 7 days
+DELIVERED_PHASE = 'upload'  # phase_metrics.UPLOAD, a job that completed it delivered its results
+
+RERUNNABLE_FUNCTIONS = ('cb_notify_when_host_comes_online', 'cb_retrieve_active_network_connections', 'cb_retrieve_autoruns',
+                        'cb_retrieve_av_logs', 'cb_retrieve_browsing_history', 'cb_retrieve_carbon_black_logs',
+                        'cb_retrieve_file_or_directory', 'cb_retrieve_installed_programs', 'cb_retrieve_logged_in_users',
+                        'cb_retrieve_network_routing_data', 'cb_retrieve_prefetch_files', 'cb_retrieve_process_list',
+                        'cb_retrieve_registry_hives', 'cb_retrieve_scheduled_tasks', 'cb_retrieve_services',
+                        'cb_retrieve_triage_bundle', 'cb_retrieve_usb_history', 'cb_retrieve_user_accounts_data',
+                        'cb_retrieve_windows_av_events', 'cb_retrieve_windows_security_events')  # Read only, safe to run again after a restart
+
+PROCESS_TOKEN = uuid.uuid4().hex  # Tells this process apart from an earlier process that had the same PID
+
+RUNNING = 'running'  # In flight
+FINISHED = 'finished'  # Ended, successfully or not
+PARKED = 'parked'  # Handed to parking.py to run again once the host is online
+INTERRUPTED = 'interrupted'  # Its process died, recovered at startup
+
+_current = threading.local()  # The journaled job running on each thread
+
+SCHEMA = ('CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, function TEXT, incident_id INTEGER, hostname TEXT, sensor_id INTEGER, '
+          'inputs TEXT, deadline INTEGER, server TEXT, pid INTEGER, process TEXT, state TEXT, phase TEXT, completed_phases TEXT, '
+          'sessions TEXT, started INTEGER, updated INTEGER, checkpoints TEXT)')
+
+
+class JobJournal(object):
+    # Singleton
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self, journal_file=JOURNAL_FILE):
+        self.journal_file = journal_file
+        self._lock = threading.Lock()  # One writer at a time in this process, SQLite serializes writers across processes
+        self._upgraded = None  # Journal file whose schema is known to be current
+
+    @staticmethod
+    def get_journal():
+        with JobJournal.__instance_lock:
+            if JobJournal.__instance is None:
+                JobJournal.__instance = JobJournal()
+        return JobJournal.__instance
+
+    def _execute(self, statement, parameters=()):
+        """
+        Run one statement against the journal, never raises
+        :param statement: SQL statement
+        :param parameters: statement parameters
+        :return: list of result rows as dicts, or None if the journal could not be used
+        """
+        with self._lock:
+            try:
+                if not os.path.exists(os.path.dirname(self.journal_file)):
+                    os.makedirs(os.path.dirname(self.journal_file))
+                connection = sqlite3.connect(self.journal_file, timeout=30)
+                try:
+                    connection.row_factory = sqlite3.Row
+                    connection.execute(SCHEMA)
+                    if self._upgraded != self.journal_file:  # Journals written before checkpoints were journaled lack the column
+                        if 'checkpoints' not in [column[1] for column in connection.execute('PRAGMA table_info(jobs)')]:
+                            connection.execute('ALTER TABLE jobs ADD COLUMN checkpoints TEXT')
+                        self._upgraded = self.journal_file
+                    rows = [dict(row) for row in connection.execute(statement, parameters).fetchall()]
+                    connection.commit()
+                    return rows
+                finally:
+                    connection.close()
+            except (sqlite3.Error, IOError, OSError) as err:
+                log.error('[ERROR] Could not use the job journal: ' + str(err))
+                return None
+
+    def start(self, function, incident_id, hostname, sensor_id, inputs, deadline):
+        """
+        Journal a job as in flight, phases, sessions and checkpoints on this thread are recorded to it until it is finished
+        :param function: function name
+        :param incident_id: incident the job belongs to
+        :param hostname: host the job runs against
+        :param sensor_id: CB sensor ID of the host
+        :param inputs: the function's inputs
+        :param deadline: datetime.datetime after which the job gives up
+        :return: job ID
+        """
+        job_id = uuid.uuid4().hex
+        now = int(time.time())
+        self._execute('INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                      (job_id, function, incident_id, hostname, sensor_id, json.dumps(dict(inputs)), int(time.mktime(deadline.timetuple())),
+                       socket.gethostname(), os.getpid(), PROCESS_TOKEN, RUNNING, None, '[]', '[]', now, now, '[]'))
+        _current.job_id = job_id
+        _current.completed_phases = []
+        _current.sessions = []
+        _current.checkpoints = []
+        return job_id
+
+    def record_phase(self, name):
+        """
+        Record a completed phase of the job running on this thread, written the first time the job completes it
+        :param name: phase_metrics phase name
+        :return:
+        """
+        job_id = getattr(_current, 'job_id', None)
+        if job_id is None or name in _current.completed_phases:
+            return
+        _current.completed_phases.append(name)
+        self._execute('UPDATE jobs SET phase = ?, completed_phases = ?, updated = ? WHERE job_id = ?',
+                      (name, json.dumps(_current.completed_phases), int(time.time()), job_id))
+
+    def record_session(self, session_id):
+        """
+        Record a live response session checked out by the job running on this thread
+        :param session_id: CB live response session ID
+        :return:
+        """
+        job_id = getattr(_current, 'job_id', None)
+        if job_id is None or session_id in _current.sessions:
+            return
+        _current.sessions.append(session_id)
+        self._execute('UPDATE jobs SET sessions = ?, updated = ? WHERE job_id = ?', (json.dumps(_current.sessions), int(time.time()), job_id))
+
+    def record_checkpoint(self, key):
+        """
+        Record a transfer checkpoint used by the job running on this thread
+        :param key: transfer.TransferCheckpoint key
+        :return:
+        """
+        job_id = getattr(_current, 'job_id', None)
+        if job_id is None or key in _current.checkpoints:
+            return
+        _current.checkpoints.append(key)
+        self._execute('UPDATE jobs SET checkpoints = ?, updated = ? WHERE job_id = ?', (json.dumps(_current.checkpoints), int(time.time()), job_id))
+
+    def finish(self, job_id, results):
+        """
+        Mark a job no longer in flight
+        :param job_id: job ID from start, None is ignored
+        :param results: the function's results, a parked job is marked parked
+        :return:
+        """
+        if job_id is None:
+            return
+        state = PARKED if results.get("parked") else FINISHED
+        self._execute('UPDATE jobs SET state = ?, updated = ? WHERE job_id = ?', (state, int(time.time()), job_id))
+        if getattr(_current, 'job_id', None) == job_id:
+            _current.job_id = None
+
+    @staticmethod
+    def _process_gone(job):
+        """
+        Whether the process that ran a job on this server is gone
+        :param job: journal entry
+        :return: boolean
+        """
+        if job["process"] == PROCESS_TOKEN:
+            return False
+        if job["pid"] == os.getpid():  # This process reused the PID of the job's process
+            return True
+        try:
+            os.kill(job["pid"], 0)
+        except OSError as err:
+            return err.errno != errno.EPERM  # EPERM means the process exists but belongs to another user
+        return False
+
+    def interrupted_jobs(self):
+        """
+        Mark the in-flight jobs of dead processes on this server interrupted, and purge old entries
+        :return: list of journal entries of the interrupted jobs, inputs, completed_phases, sessions and checkpoints decoded
+        """
+        self._execute('DELETE FROM jobs WHERE state != ? AND updated < ?', (RUNNING, int(time.time()) - JOURNAL_TTL))
+        interrupted = []
+        for job in self._execute('SELECT * FROM jobs WHERE state = ? AND server = ?', (RUNNING, socket.gethostname())) or []:
+            if self._process_gone(job):
+                self._execute('UPDATE jobs SET state = ?, updated = ? WHERE job_id = ?', (INTERRUPTED, int(time.time()), job["job_id"]))
+                for column in ('inputs', 'completed_phases', 'sessions', 'checkpoints'):
+                    job[column] = json.loads(job[column] or ('{}' if column == 'inputs' else '[]'))
+                interrupted.append(job)
+        return interrupted
+
+    def jobs(self, state=None):
+        """
+        Journal entries, newest first
+        :param state: RUNNING, FINISHED, PARKED or INTERRUPTED to filter by, or None for every entry
+        :return: list of journal entries
+        """
+        if state is None:
+            return self._execute('SELECT * FROM jobs ORDER BY started DESC') or []
+        return self._execute('SELECT * FROM jobs WHERE state = ? ORDER BY started DESC', (state,)) or []
+
+
+def start(function, incident_id, hostname, sensor_id, inputs, deadline):
+    """
+    Journal a job as in flight in the process-wide journal
+    :param function: function name
+    :param incident_id: incident the job belongs to
+    :param hostname: host the job runs against
+    :param sensor_id: CB sensor ID of the host
+    :param inputs: the function's inputs
+    :param deadline: datetime.datetime after which the job gives up
+    :return: job ID
+    """
+    return JobJournal.get_journal().start(function, incident_id, hostname, sensor_id, inputs, deadline)
+
+
+def current_job():
+    """
+    Job journaled on this thread
+    :return: job ID, None if no job is journaled on this thread
+    """
+    return getattr(_current, 'job_id', None)
+
+
+def record_phase(name):
+    """
+    Record a completed phase of the job running on this thread
+    :param name: phase_metrics phase name
+    :return:
+    """
+    JobJournal.get_journal().record_phase(name)
+
+
+def record_session(session_id):
+    """
+    Record a live response session checked out by the job running on this thread
+    :param session_id: CB live response session ID
+    :return:
+    """
+    JobJournal.get_journal().record_session(session_id)
+
+
+def record_checkpoint(key):
+    """
+    Record a transfer checkpoint used by the job running on this thread
+    :param key: transfer.TransferCheckpoint key
+    :return:
+    """
+    JobJournal.get_journal().record_checkpoint(key)
+
+
+def finish(job_id, results):
+    """
+    Mark a job no longer in flight
+    :param job_id: job ID from start, None is ignored
+    :param results: the function's results
+    :return:
+    """
+    JobJournal.get_journal().finish(job_id, results)
+
+
+def interrupted_jobs():
+    """
+    Mark and return the in-flight jobs of dead processes on this server
+    :return: list of journal entries
+    """
+    return JobJournal.get_journal().interrupted_jobs()
+
+
+def close_orphaned_sessions(cb, job):
+    """
+    Close the live response sessions an interrupted job held, freeing their CB session slots right away, never raises
+    :param cb: CbEnterpriseResponseAPI
+    :param job: journal entry from interrupted_jobs()
+    :return: list of closed session IDs
+    """
+    closed = []
+    for session_id in job["sessions"]:
+        try:
+            cb.put_object('/api/v1/cblr/session/{0}'.format(session_id), {"status": "close", "id": session_id})
+            closed.append(session_id)
+        except Exception as err:  # Likely already closed by the CB server
+            log.debug('[DEBUG] Could not close orphaned Session #' + str(session_id) + ': ' + str(err))
+    return closed
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+
+# This utility parks jobs waiting on offline hosts so they do not hold a resilient_circuits worker while they wait.
+# File: parking.py
+# Date: 10/18/2026
+# Author: Jared F
+
+"""Parked jobs of offline hosts"""
+#   Usage from a Carbon Black function:
+#       parking.register('cb_retrieve_services', self, cb)  # In __init__, lets this process resume the function's parked jobs
+#       days_later_timeout_length = parking.deadline(datetime.datetime.now() + datetime.timedelta(days=DAYS_UNTIL_TIMEOUT))
+#       if sensor.status != "Online" and parking.should_park():
+#           parking.park('cb_retrieve_services', incident_id, hostname, kwargs, days_later_timeout_length)  # Then return a parked result
+#   Parking is on by default, set PARK_OFFLINE_JOBS = False to keep every job waiting on its worker instead. Workflows
+#   get results["parked"] with was_successful False right away, and the real outcome only as an incident note, so
+#   disable it if a workflow branches on the results of functions run against offline hosts. A parked job is stored in
+#   PARKED_JOBS_FILE and its function returns, freeing the worker. The host is watched by sensor_watcher, and once it
+#   is online the function runs again with the same inputs on a resume thread, at most MAX_RESUMING at once. A resumed
+#   job never parks again. Its status messages go to the log and its outcome is posted to the incident as a note, as is
+#   a job given up on at its deadline. Parked jobs survive resilient_circuits restarts, they resume once their
+#   function's component is registered again. A resumed job keeps the deadline it was parked with.
+#   cb_notify_when_host_comes_online parks its wait the same way, its note that the host came online is the
+#   notification, see SUCCESS_NOTES.
+
+import os
+import json
+import time
+import uuid
+import inspect
+import logging
+import datetime
+import threading
+import carbon_black.util.sensor_watcher as sensor_watcher
+import carbon_black.util.phase_metrics as phase_metrics
+import carbon_black.util.job_journal as job_journal
+
+log = logging.getLogger(__name__)  # Establish logging
+
+PARKED_JOBS_FILE = '/home/integrations/.resilient/cb_parked_jobs.json'  # Parked jobs, kept across restarts
+PARK_OFFLINE_JOBS = True  # Park jobs of offline hosts (default), False keeps every job waiting on its worker
+RESUME_INTERVAL = 30  # Seconds between checks of the parked jobs' hosts
+MAX_RESUMING = 4  # Parked jobs run at once after their hosts come online
+
+# Note posted once a resumed job succeeds, by function, other functions get DEFAULT_SUCCESS_NOTE
+DEFAULT_SUCCESS_NOTE = '[SUCCESS] Parked {function} job on {hostname} ran once the host came online.'
+SUCCESS_NOTES = {'cb_notify_when_host_comes_online': '[SUCCESS] Hostname: {hostname} came online.'}
+
+_resuming = threading.local()  # The parked job running on a resume thread
+
+
+def function_body(component_class, function):
+    """
+    Generator of a function, found under the resilient_circuits decorators
+    :param component_class: FunctionComponent class of the function
+    :param function: function name, ie 'cb_retrieve_services'
+    :return: generator function taking (component, event, **inputs)
+    :raises RuntimeError if no generator is found
+    """
+    body = getattr(component_class, '_{0}_function'.format(function))
+    body = getattr(body, '__func__', body)
+    for _ in range(10):  # Unwrap to the innermost function, the @function wrapper is a generator itself
+        inner = getattr(body, '__wrapped__', None)
+        for cell in getattr(body, '__closure__', None) or ():  # Python 2 functools.wraps sets no __wrapped__
+            if inner is not None:
+                break
+            try:
+                contents = cell.cell_contents
+            except ValueError:  # Empty cell
+                continue
+            if inspect.isfunction(contents):
+                inner = contents
+        if inner is None:
+            break
+        body = inner
+    if inspect.isgeneratorfunction(body):
+        return body
+    raise RuntimeError('Could not find the generator of ' + function)
+
+
+class ParkedJobs(object):
+    # Singleton
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self, jobs_file=PARKED_JOBS_FILE):
+        self.jobs_file = jobs_file
+        self._lock = threading.Lock()
+        self._wake = threading.Event()  # Set to check the parked jobs right away
+        self._jobs = self._load()  # job ID -> {"function", "incident_id", "hostname", "inputs", "parked", "deadline", "phase", "checkpoints"}
+        self._components = {}  # function name -> (FunctionComponent, CbEnterpriseResponseAPI)
+        self._watched = set()  # Hostnames subscribed to the sensor watcher
+        self._running = {}  # job ID -> job, of the jobs running on resume threads, no longer in the parked jobs file as the job journal covers them
+        self._thread = None
+
+    @staticmethod
+    def get_parked():
+        with ParkedJobs.__instance_lock:
+            if ParkedJobs.__instance is None:
+                ParkedJobs.__instance = ParkedJobs()
+        return ParkedJobs.__instance
+
+    def _load(self):
+        try:
+            with open(self.jobs_file, 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save(self):
+        """
+        Write the parked jobs. Caller must hold the lock.
+        :return:
+        """
+        try:
+            if not os.path.exists(os.path.dirname(self.jobs_file)):
+                os.makedirs(os.path.dirname(self.jobs_file))
+            temp_jobs_file = self.jobs_file + '.' + str(os.getpid())
+            with open(temp_jobs_file, 'w') as f:
+                f.write(json.dumps(self._jobs))
+            os.rename(temp_jobs_file, self.jobs_file)  # Atomic replace, a restart never reads partial jobs
+        except (IOError, OSError) as err:
+            log.error('[ERROR] Could not save parked jobs: ' + str(err))
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._resume_forever, name='cb-parked-jobs')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def register(self, function, component, cb):
+        """
+        Let this process resume a function's parked jobs
+        :param function: function name
+        :param component: the function's FunctionComponent
+        :param cb: CbEnterpriseResponseAPI of the function
+        :return:
+        """
+        with self._lock:
+            self._components[function] = (component, cb)
+            waiting = [job for job in self._jobs.values() if job["function"] == function]
+        if waiting:
+            log.info('[INFO] ' + str(len(waiting)) + ' parked ' + function + ' jobs will resume when their hosts come online')
+            self._start()
+            self._wake.set()
+
+    def park(self, function, incident_id, hostname, inputs, deadline, interrupted=None):
+        """
+        Store a job to run again once its host comes online
+        :param function: function name
+        :param incident_id: incident the job belongs to
+        :param hostname: offline host
+        :param inputs: the function's inputs
+        :param deadline: datetime.datetime after which the job is given up
+        :param interrupted: job journal entry of an interrupted job, its rerun resumes from the entry's phase and checkpoints
+        :return: job ID
+        """
+        job_id = uuid.uuid4().hex
+        job_journal.finish(job_journal.current_job(), {"parked": True})  # Out of the job journal before it is in the parked jobs, a restart never reruns it twice
+        with self._lock:
+            self._jobs[job_id] = {"function": function, "incident_id": incident_id, "hostname": hostname, "inputs": dict(inputs),
+                                  "parked": int(time.time()), "deadline": int(time.mktime(deadline.timetuple())),
+                                  "phase": (interrupted or {}).get("phase"), "checkpoints": (interrupted or {}).get("checkpoints", [])}
+            self._save()
+        log.info('[INFO] Parked ' + function + ' job ' + job_id + ' until ' + hostname + ' comes online')
+        phase_metrics.discard_run(phase_metrics.current_run())  # The resumed run is timed instead
+        self._start()
+        self._wake.set()
+        return job_id
+
+    def status(self):
+        """
+        Snapshot of the parked jobs
+        :return: dict of job ID -> job, with "running" set for jobs on resume threads
+        """
+        with self._lock:
+            jobs = dict((job_id, dict(job, running=False)) for job_id, job in self._jobs.items())
+            jobs.update((job_id, dict(job, running=True)) for job_id, job in self._running.items())
+            return jobs
+
+    def checkpoints(self):
+        """
+        Transfer checkpoints of parked jobs, their reruns continue them
+        :return: set of transfer.TransferCheckpoint keys
+        """
+        with self._lock:
+            return set(key for job in list(self._jobs.values()) + list(self._running.values()) for key in job.get("checkpoints", []))
+
+    def _note(self, job, text):
+        """
+        Post a note about a parked job to its incident, never raises
+        :param job: parked job
+        :param text: note text
+        :return:
+        """
+        component = self._components.get(job["function"], (None, None))[0]
+        if component is None:
+            log.info(text)
+            return
+        try:
+            component.rest_client().post('/incidents/{0}/comments'.format(job["incident_id"]), {"text": {"format": "text", "content": text}})
+        except Exception as err:
+            log.error('[ERROR] Could not post a note to incident ' + str(job["incident_id"]) + ': ' + str(err))
+
+    def _finish(self, job_id):
+        """
+        Forget a resumed job
+        :param job_id: job ID
+        :return:
+        """
+        with self._lock:
+            self._running.pop(job_id, None)
+
+    def _resume_forever(self):
+        while True:
+            try:
+                self.resume_ready()
+            except Exception as err:
+                log.error('[ERROR] Parked jobs could not be checked: ' + str(err))
+            self._wake.wait(RESUME_INTERVAL)
+            self._wake.clear()
+
+    def resume_ready(self):
+        """
+        Give up parked jobs past their deadline, and start those whose host is online
+        :return: list of started job IDs
+        """
+        watcher = sensor_watcher.SensorWatcher.get_watcher()
+        started, expired = [], []
+        with self._lock:
+            for job_id, job in sorted(self._jobs.items(), key=lambda item: item[1]["parked"]):
+                if job["function"] not in self._components:
+                    continue
+                if time.time() > job["deadline"]:
+                    expired.append(job)
+                    del self._jobs[job_id]
+                    continue
+                if job["hostname"] not in self._watched:
+                    watcher.subscribe(self._components[job["function"]][1], job["hostname"])  # Refreshed by the watcher's batch queries from now on
+                    self._watched.add(job["hostname"])
+                sensor = watcher.get_sensor(job["hostname"])
+                if sensor is not None and sensor.status == "Online" and sensor.restart_queued is not True and len(self._running) < MAX_RESUMING:
+                    self._running[job_id] = job
+                    del self._jobs[job_id]  # The resumed run is journaled instead, a restart reruns it from the job journal if at all
+                    started.append((job_id, job))
+            if expired or started:
+                self._save()
+
+            for hostname in self._watched - set(job["hostname"] for job in self._jobs.values()):  # No parked job is left on the host
+                watcher.unsubscribe(hostname)
+                self._watched.discard(hostname)
+
+        for job in expired:
+            self._note(job, '[FAILURE] Parked ' + job["function"] + ' job on ' + job["hostname"] + ' was given up, the host stayed offline until ' +
+                       datetime.datetime.fromtimestamp(job["deadline"]).strftime('%Y-%m-%d %H:%M:%S') + '.')
+
+        for job_id, job in started:
+            log.info('[INFO] Resuming parked ' + job["function"] + ' job ' + job_id + ', ' + job["hostname"] + ' is online' +
+                     (', it was interrupted after its ' + job["phase"] + ' phase' if job.get("phase") else ''))
+            worker = threading.Thread(target=self._run, args=(job_id, job), name='cb-resume-' + job["hostname"])
+            worker.daemon = True
+            worker.start()
+        return [job_id for job_id, job in started]
+
+    def _run(self, job_id, job):
+        """
+        Run a parked job's function again with its inputs, on a resume thread
+        :param job_id: job ID
+        :param job: parked job
+        :return:
+        """
+        component = self._components[job["function"]][0]
+        results, error = None, None
+        _resuming.job_id = job_id
+        _resuming.deadline = datetime.datetime.fromtimestamp(job["deadline"])
+        try:
+            for item in function_body(type(component), job["function"])(component, None, **job["inputs"]):
+                if isinstance(getattr(item, 'value', None), dict):  # FunctionResult
+                    results = item.value
+                elif isinstance(item, Exception):  # FunctionError
+                    error = str(item) or type(item).__name__
+                else:  # StatusMessage
+                    log.info('[INFO] Parked job ' + job_id + ': ' + str(getattr(item, 'text', item)))
+        except Exception as err:
+            error = str(err)
+        finally:
+            _resuming.job_id = None
+            _resuming.deadline = None
+            self._finish(job_id)
+
+        if results is not None and results.get("was_successful"):
+            self._note(job, SUCCESS_NOTES.get(job["function"], DEFAULT_SUCCESS_NOTE).format(function=job["function"], hostname=job["hostname"]))
+        else:
+            self._note(job, '[FAILURE] Parked ' + job["function"] + ' job on ' + job["hostname"] + ' ran once the host came online, but did not succeed' +
+                       (': ' + error if error else '. See the integration server log for details.'))
+
+
+def register(function, component, cb):
+    """
+    Let this process resume a function's parked jobs
+    :param function: function name
+    :param component: the function's FunctionComponent
+    :param cb: CbEnterpriseResponseAPI of the function
+    :return:
+    """
+    ParkedJobs.get_parked().register(function, component, cb)
+
+
+def should_park():
+    """
+    Whether a job waiting on an offline host should be parked, a resumed job never parks again
+    :return: boolean
+    """
+    return PARK_OFFLINE_JOBS and getattr(_resuming, 'job_id', None) is None
+
+
+def deadline(default):
+    """
+    Deadline of the job running on this thread, a resumed job keeps the deadline it was parked with
+    :param default: datetime.datetime deadline of a job that was not parked
+    :return: datetime.datetime
+    """
+    return getattr(_resuming, 'deadline', None) or default
+
+
+def park(function, incident_id, hostname, inputs, deadline, interrupted=None):
+    """
+    Park a job until its host comes online
+    :param function: function name
+    :param incident_id: incident the job belongs to
+    :param hostname: offline host
+    :param inputs: the function's inputs
+    :param deadline: datetime.datetime after which the job is given up
+    :param interrupted: job journal entry of an interrupted job, its rerun resumes from the entry's phase and checkpoints
+    :return: job ID
+    """
+    return ParkedJobs.get_parked().park(function, incident_id, hostname, inputs, deadline, interrupted)
+
+
+def checkpoints():
+    """
+    Transfer checkpoints of parked jobs, kept for their reruns
+    :return: set of transfer.TransferCheckpoint keys
+    """
+    return ParkedJobs.get_parked().checkpoints()
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+
+# This utility times each phase of a Carbon Black job so slow runs can be traced to their real bottleneck.
+# File: phase_metrics.py
+# Date: 10/18/2026
+# Author: Jared F
+
+"""Per-phase job instrumentation"""
+#   Usage from a Carbon Black function:
+#       job_metrics = phase_metrics.start_run('cb_retrieve_process_list', hostname, sensor.id)  # Phases on this thread are recorded to the job
+#       with phase_metrics.phase(phase_metrics.ZIP): ...  # Time a block the shared utilities do not already time
+#       phase_metrics.post_attachment(self.rest_client(), uri, temp_file.name, file_name)  # Replaces self.rest_client().post_attachment(...)
+#       phase_metrics.finish_run(job_metrics, results["was_successful"])  # In the finally block, logs and exports the job's phases
+#   The shared utilities record their own phases: sensor_watcher waits (wait_host), host_queue waits (wait_lock), session_broker
+#   checkouts (session), create_process on brokered sessions (create_process), transfer.py and get_file (transfer) and retry
+#   backoffs (backoff). Phases do not nest, time inside an open phase belongs to that phase only.
+#   Every finished job is logged as one JSON line and added to counters written in Prometheus text format to METRICS_FILE,
+#   for the node_exporter textfile collector. Prometheus series are labeled by function and phase, the JSON lines also carry
+#   the hostname and sensor ID, set HOST_LABELS to label the series by host too on small fleets.
+
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+import carbon_black.util.job_journal as job_journal
+
+log = logging.getLogger(__name__)  # Establish logging
+
+METRICS_FILE = '/home/integrations/.resilient/cb_metrics.prom'  # Prometheus text format export, rewritten after every job
+HOST_LABELS = False  # Label Prometheus series with hostname and sensor ID, one series per host and phase
+
+WAIT_HOST = 'wait_host'  # Waiting for the host to come online or finish a sensor restart
+WAIT_LOCK = 'wait_lock'  # Waiting behind other jobs for the host lock
+SESSION = 'session'  # Establishing or checking out a live response session
+PROCESS = 'create_process'  # Running commands on the endpoint
+TRANSFER = 'transfer'  # Moving files between the endpoint and the integration server
+ZIP = 'zip'  # Packaging retrieved files on the integration server or the endpoint
+UPLOAD = 'upload'  # Posting attachments to Resilient
+BACKOFF = 'backoff'  # Sleeping before a retry or waiting out a CB outage
+
+_current = threading.local()  # The job running on each thread
+
+
+class JobRun(object):
+    """ Phase timings of one function run against one host """
+    def __init__(self, function, hostname, sensor_id=None):
+        self.function = function
+        self.hostname = hostname
+        self.sensor_id = sensor_id
+        self.started = time.time()
+        self.finished = None  # Set once the run is finished
+        self.phases = {}  # phase -> {"seconds", "bytes", "calls"}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, size=0):
+        """
+        Add time and bytes to a phase
+        :param name: phase name
+        :param seconds: time spent
+        :param size: bytes moved
+        :return:
+        """
+        with self._lock:
+            entry = self.phases.setdefault(name, {"seconds": 0.0, "bytes": 0, "calls": 0})
+            entry["seconds"] += seconds
+            entry["bytes"] += int(size or 0)
+            entry["calls"] += 1
+
+    def to_dict(self, was_successful):
+        """
+        Structured record of the run
+        :param was_successful: outcome of the run
+        :return: dict
+        """
+        duration = (self.finished or time.time()) - self.started
+        with self._lock:
+            phases = dict((name, dict(entry, seconds=round(entry["seconds"], 3))) for name, entry in self.phases.items())
+        return {"function": self.function, "hostname": self.hostname, "sensor_id": self.sensor_id, "started": int(self.started),
+                "duration": round(duration, 3), "outcome": "success" if was_successful else "failure", "phases": phases,
+                "unattributed": round(max(0.0, duration - sum(entry["seconds"] for entry in phases.values())), 3)}
+
+
+class _Phase(object):
+    """ Handle of an open phase, set bytes to count the bytes it moved """
+    def __init__(self):
+        self.bytes = 0
+
+
+class MetricsRegistry(object):
+    # Singleton
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self, metrics_file=METRICS_FILE):
+        self.metrics_file = metrics_file
+        self._lock = threading.Lock()
+        self._phases = {}  # (function, phase[, hostname, sensor_id]) -> {"seconds", "bytes", "calls"}
+        self._jobs = {}  # (function, outcome) -> {"count", "seconds"}
+
+    @staticmethod
+    def get_registry():
+        with MetricsRegistry.__instance_lock:
+            if MetricsRegistry.__instance is None:
+                MetricsRegistry.__instance = MetricsRegistry()
+        return MetricsRegistry.__instance
+
+    def add(self, record):
+        """
+        Count a finished run into the exported counters
+        :param record: JobRun.to_dict() record
+        :return:
+        """
+        with self._lock:
+            for name, entry in record["phases"].items():
+                key = (record["function"], name) + ((record["hostname"], str(record["sensor_id"])) if HOST_LABELS else ())
+                total = self._phases.setdefault(key, {"seconds": 0.0, "bytes": 0, "calls": 0})
+                for field in total:
+                    total[field] += entry[field]
+            job = self._jobs.setdefault((record["function"], record["outcome"]), {"count": 0, "seconds": 0.0})
+            job["count"] += 1
+            job["seconds"] += record["duration"]
+
+    def prometheus_text(self):
+        """
+        Counters in Prometheus text exposition format
+        :return: string
+        """
+        def labels(key):
+            names = ('function', 'phase', 'hostname', 'sensor_id')
+            return '{' + ','.join('{0}="{1}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in zip(names, key)) + '}'
+
+        lines = []
+        with self._lock:
+            for metric, field, help_text in (('cb_job_phase_seconds_total', 'seconds', 'Seconds Carbon Black jobs spent in each phase'),
+                                             ('cb_job_phase_bytes_total', 'bytes', 'Bytes Carbon Black jobs moved in each phase'),
+                                             ('cb_job_phase_calls_total', 'calls', 'Times Carbon Black jobs entered each phase')):
+                lines.append('# HELP {0} {1}'.format(metric, help_text))
+                lines.append('# TYPE {0} counter'.format(metric))
+                for key in sorted(self._phases):
+                    lines.append('{0}{1} {2}'.format(metric, labels(key), repr(self._phases[key][field]) if field == 'seconds' else self._phases[key][field]))
+
+            lines.append('# HELP cb_jobs_total Carbon Black jobs finished, by outcome')
+            lines.append('# TYPE cb_jobs_total counter')
+            for function, outcome in sorted(self._jobs):
+                lines.append('cb_jobs_total{{function="{0}",outcome="{1}"}} {2}'.format(function, outcome, self._jobs[(function, outcome)]["count"]))
+            lines.append('# HELP cb_job_duration_seconds_total Seconds Carbon Black jobs ran, by outcome')
+            lines.append('# TYPE cb_job_duration_seconds_total counter')
+            for function, outcome in sorted(self._jobs):
+                lines.append('cb_job_duration_seconds_total{{function="{0}",outcome="{1}"}} {2}'.format(function, outcome, repr(self._jobs[(function, outcome)]["seconds"])))
+        return '\n'.join(lines) + '\n'
+
+    def export(self):
+        """
+        Write the counters to the Prometheus textfile, never raises
+        :return:
+        """
+        try:
+            if not os.path.exists(os.path.dirname(self.metrics_file)):
+                os.makedirs(os.path.dirname(self.metrics_file))
+            temp_metrics_file = self.metrics_file + '.' + str(os.getpid())
+            with open(temp_metrics_file, 'w') as f:
+                f.write(self.prometheus_text())
+            os.rename(temp_metrics_file, self.metrics_file)  # Atomic replace, the collector never reads a partial file
+        except (IOError, OSError) as err:
+            log.error('[ERROR] Could not export job metrics: ' + str(err))
+
+
+class InstrumentedSession(object):
+    """ Live response session whose create_process, get_file and put_file calls are recorded to the running job """
+    def __init__(self, session):
+        self._session = session
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    def create_process(self, *args, **kwargs):
+        with phase(PROCESS) as measured:
+            output = self._session.create_process(*args, **kwargs)
+            measured.bytes = len(output) if output else 0
+        return output
+
+    def get_file(self, *args, **kwargs):
+        with phase(TRANSFER) as measured:
+            data = self._session.get_file(*args, **kwargs)
+            measured.bytes = len(data) if data else 0
+        return data
+
+    def put_file(self, *args, **kwargs):
+        with phase(TRANSFER):
+            return self._session.put_file(*args, **kwargs)
+
+
+def start_run(function, hostname, sensor_id=None):
+    """
+    Start recording the phases of a job, phases recorded on this thread belong to it until it is finished
+    :param function: name of the function running the job
+    :param hostname: host the job runs against
+    :param sensor_id: CB sensor ID of the host
+    :return: JobRun
+    """
+    run = JobRun(function, hostname, sensor_id)
+    _current.run = run
+    _current.open = False
+    return run
+
+
+def current_run():
+    """
+    Job running on this thread
+    :return: JobRun, or None
+    """
+    return getattr(_current, 'run', None)
+
+
+@contextmanager
+def phase(name, size=0):
+    """
+    Time the enclosed block as a phase of the job running on this thread, recorded even if it raises
+    :param name: phase name
+    :param size: bytes moved, or set .bytes on the yielded handle
+    :return: _Phase handle
+    """
+    measured = _Phase()
+    measured.bytes = size
+    run = current_run()
+    if run is None or getattr(_current, 'open', False):  # No job on this thread, or the time belongs to the open phase
+        yield measured
+        return
+
+    _current.open = True
+    start = time.time()
+    try:
+        yield measured
+    except BaseException:
+        _current.open = False
+        run.record(name, time.time() - start, measured.bytes)
+        raise
+    _current.open = False
+    run.record(name, time.time() - start, measured.bytes)
+    job_journal.record_phase(name)  # A job interrupted by a restart resumes from the phases it completed
+
+
+def post_attachment(rest_client, uri, filepath, *args, **kwargs):
+    """
+    Post an attachment to Resilient, timed as the job's upload phase
+    :param rest_client: Resilient rest client
+    :param uri: attachments URI of the incident
+    :param filepath: local path of the file to attach
+    :return: Resilient response
+    """
+    with phase(UPLOAD, os.path.getsize(filepath)):
+        return rest_client.post_attachment(uri, filepath, *args, **kwargs)
+
+
+def instrument(session):
+    """
+    Wrap a live response session so its commands and transfers are recorded to the running job
+    :param session: live response session
+    :return: InstrumentedSession
+    """
+    return InstrumentedSession(session)
+
+
+def finish_run(run, was_successful):
+    """
+    Finish a job: log its phases as one JSON line and export them, a finished or None run is ignored
+    :param run: JobRun from start_run
+    :param was_successful: outcome of the job
+    :return: JobRun.to_dict() record, or None
+    """
+    if run is None or run.finished is not None:
+        return None
+    run.finished = time.time()
+    if current_run() is run:
+        _current.run = None
+
+    record = run.to_dict(was_successful)
+    log.info(json.dumps(record, sort_keys=True))  # One structured line per job
+    registry = MetricsRegistry.get_registry()
+    registry.add(record)
+    registry.export()
+    return record
+
+
+def discard_run(run):
+    """
+    Stop recording a job without logging or exporting it, ie when the job is parked to run later
+    :param run: JobRun from start_run, None is ignored
+    :return:
+    """
+    if run is None or run.finished is not None:
+        return
+    run.finished = time.time()
+    if current_run() is run:
+        _current.run = None
+
+
+def prometheus_text():
+    """
+    Counters of every finished job in Prometheus text exposition format
+    :return: string
+    """
+    return MetricsRegistry.get_registry().prometheus_text()
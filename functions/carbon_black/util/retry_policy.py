@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+# This utility decides how Carbon Black functions recover from CB timeouts and connection failures.
+# File: retry_policy.py
+# Date: 10/18/2026
+# Author: Jared F
+
+"""Shared retry policy"""
+#   Usage from a Carbon Black function, replaces the per-function TimeoutError and connection exception handlers:
+#       except retry_policy.RETRYABLE_ERRORS as err:  # Catch CB timeouts and connection exceptions and handle
+#           if not retry_policy.is_retryable(err): raise  # Only handle ApiError involving network connection error
+#           timeouts = timeouts + 1
+#           if retry_policy.rule_for(err).discard_session:
+#               try: session_broker.discard_session(session)  # Do not reuse a session that timed out
+#               except: pass
+#           for status_message in retry_policy.recover(cb, err, hostname, timeouts, MAX_TIMEOUTS): yield StatusMessage(status_message)
+#           continue
+#   Each error class has a rule: sensor timeouts restart the sensor and back off exponentially with jitter,
+#   connection failures trip a server-wide circuit breaker. While the breaker is open every job waits on it,
+#   one of them probes CB with backoff, and all of them resume together once CB responds again.
+
+import time
+import random
+import logging
+import threading
+from cbapi.errors import TimeoutError, ApiError
+from urllib3.exceptions import ProtocolError, NewConnectionError, ConnectTimeoutError, MaxRetryError
+import carbon_black.util.sensor_index as sensor_index
+import carbon_black.util.phase_metrics as phase_metrics
+
+log = logging.getLogger(__name__)  # Establish logging
+
+RETRYABLE_ERRORS = (TimeoutError, ApiError, ProtocolError, NewConnectionError, ConnectTimeoutError, MaxRetryError)  # Exceptions the policy may handle, check is_retryable()
+PROBE_INTERVAL = 5  # Seconds before the first probe of CB once the circuit breaker opens
+MAX_PROBE_INTERVAL = 300  # Seconds, slowest interval between probes of CB while it stays down
+MAX_OUTAGE_WAIT = 6*3600  # Seconds a job waits on the open circuit breaker before the attempt counts as failed
+RESUME_SPREAD = 10  # Seconds, resumed jobs start within this window so CB is not hit by every job in the same instant
+
+
+class RetryRule(object):
+    """ How one class of error is recovered from """
+    def __init__(self, name, base_delay, max_delay, restart_sensor=False, discard_session=False, trips_breaker=False):
+        self.name = name
+        self.base_delay = base_delay  # Seconds before the first retry
+        self.max_delay = max_delay  # Seconds, the backoff never exceeds this
+        self.restart_sensor = restart_sensor  # Restart the sensor before retrying
+        self.discard_session = discard_session  # The live response session can no longer be trusted
+        self.trips_breaker = trips_breaker  # The error means CB itself is unreachable
+
+    def delay(self, attempt):
+        """
+        Exponential backoff with jitter, half the delay is fixed and half is random so retries spread out
+        :param attempt: 1 for the first retry
+        :return: seconds
+        """
+        delay = min(self.max_delay, self.base_delay * (2 ** max(0, attempt - 1)))
+        return delay / 2.0 + random.uniform(0, delay / 2.0)
+
+
+RULES = {
+    'timeout': RetryRule('TimeoutError', base_delay=30, max_delay=600, restart_sensor=True, discard_session=True),  # Live response command timed out on the sensor
+    'network': RetryRule('Carbon Black unreachable', base_delay=PROBE_INTERVAL, max_delay=MAX_PROBE_INTERVAL, trips_breaker=True),  # CB server connection failure
+}
+
+
+class CircuitBreaker(object):
+    # Singleton
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._open = False  # True while CB is considered down
+        self._probing = False  # True while a waiting job is probing CB
+        self.opened_at = None  # When the breaker last opened
+
+    @staticmethod
+    def get_breaker():
+        with CircuitBreaker.__instance_lock:
+            if CircuitBreaker.__instance is None:
+                CircuitBreaker.__instance = CircuitBreaker()
+        return CircuitBreaker.__instance
+
+    def is_open(self):
+        with self._condition:
+            return self._open
+
+    def trip(self):
+        """
+        Open the breaker, jobs that fail to reach CB wait on it instead of retrying on their own schedule
+        :return:
+        """
+        with self._condition:
+            if not self._open:
+                self._open = True
+                self.opened_at = time.time()
+                log.info('[INFO] Carbon Black is unreachable, pausing jobs until it responds')
+
+    def wait(self, cb, max_wait=MAX_OUTAGE_WAIT):
+        """
+        Block while the breaker is open. One waiting job probes CB with exponential backoff, the rest are woken together when it responds.
+        :param cb: CbEnterpriseResponseAPI used to probe CB
+        :param max_wait: seconds to wait before giving up
+        :return: True once CB responds, False if max_wait passed first
+        """
+        deadline = time.time() + max_wait
+        probe_interval = PROBE_INTERVAL
+        with self._condition:
+            while self._open:
+                if time.time() >= deadline:
+                    return False
+
+                if self._probing:  # Another job is probing, wait to be woken
+                    self._condition.wait(min(MAX_PROBE_INTERVAL, max(0, deadline - time.time())))
+                    continue
+
+                self._probing = True
+                self._condition.release()
+                try:
+                    time.sleep(min(probe_interval + random.uniform(0, probe_interval / 2.0), max(0, deadline - time.time())))
+                    try:
+                        cb.info()  # Any answer means CB is reachable again
+                        responded = True
+                    except Exception:
+                        responded = False
+                finally:
+                    self._condition.acquire()
+                    self._probing = False
+
+                if responded:
+                    log.info('[INFO] Carbon Black is responding again after ' + str(int(time.time() - self.opened_at)) + ' seconds, resuming jobs')
+                    self._open = False
+                    self._condition.notify_all()
+                else:
+                    probe_interval = min(MAX_PROBE_INTERVAL, probe_interval * 2)
+                    self._condition.notify_all()  # Let another waiter take over probing if this job gives up
+        return True
+
+
+def rule_for(err):
+    """
+    Rule that handles an exception
+    :param err: exception caught from a CB call
+    :return: RetryRule, or None if the exception must not be retried
+    """
+    if isinstance(err, TimeoutError):
+        return RULES['timeout']
+    if isinstance(err, ApiError) and 'network connection error' not in str(err):  # Only ApiError involving network connection error is retried
+        return None
+    if isinstance(err, RETRYABLE_ERRORS):
+        return RULES['network']
+    return None
+
+
+def is_retryable(err):
+    """
+    Whether the policy handles an exception
+    :param err: exception caught from a CB call
+    :return: boolean
+    """
+    return rule_for(err) is not None
+
+
+def backoff(cb, err, hostname, attempt):
+    """
+    Apply the exception's rule before a retry: restart the sensor and sleep the backoff, or wait out a CB outage
+    :param cb: CbEnterpriseResponseAPI
+    :param err: exception caught from a CB call, must be retryable
+    :param hostname: hostname of the job's sensor
+    :param attempt: 1 for the first retry
+    :return: True if the job may retry, False if CB stayed unreachable
+    """
+    rule = rule_for(err)
+    if rule.trips_breaker:
+        breaker = CircuitBreaker.get_breaker()
+        breaker.trip()
+        if not breaker.wait(cb):
+            return False
+        time.sleep(random.uniform(0, RESUME_SPREAD))
+        return True
+
+    if rule.restart_sensor:
+        try: sensor_index.lookup(cb, hostname).restart_sensor()  # Queried again, the indexed sensor may be stale. Restarting the sensor may avoid a timeout from occurring again
+        except Exception as restart_err: log.info('[INFO] Could not restart the sensor of ' + str(hostname) + ': ' + str(restart_err))
+    time.sleep(rule.delay(attempt))  # Sleep to apply sensor restart, longer after every failed attempt
+    return True
+
+
+def recover(cb, err, hostname, attempt, max_attempts):
+    """
+    Recover from a retryable exception, yielding status messages for the function to post
+    :param cb: CbEnterpriseResponseAPI
+    :param err: exception caught from a CB call, must be retryable
+    :param hostname: hostname of the job's sensor
+    :param attempt: number of failures so far, including this one
+    :param max_attempts: failures allowed before the function aborts
+    :return: generator of status message strings
+    """
+    rule = rule_for(err)
+    if attempt > max_attempts:
+        yield '[FATAL ERROR] ' + str(type(err).__name__) + ' was encountered. The maximum number of retries was reached. Aborting!'
+        yield '[FAILURE] Fatal error caused exit!'
+        return
+
+    if rule.trips_breaker:
+        yield '[ERROR] Carbon Black was unreachable. Reattempting once it responds... (' + str(attempt) + '/' + str(max_attempts) + ')'
+    else:
+        yield '[ERROR] ' + rule.name + ' was encountered. Reattempting... (' + str(attempt) + '/' + str(max_attempts) + ')'
+
+    with phase_metrics.phase(phase_metrics.BACKOFF):
+        recovered = backoff(cb, err, hostname, attempt)
+    if not recovered:
+        yield '[WARNING] Carbon Black stayed unreachable for ' + str(MAX_OUTAGE_WAIT // 3600) + ' hours'
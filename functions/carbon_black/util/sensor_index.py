@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+# This utility resolves hostnames to Carbon Black sensors from an in-memory index of the fleet.
+# File: sensor_index.py
+# Date: 10/18/2026
+# Author: Jared F
+
+"""Hostname to sensor index"""
+#   Usage from a Carbon Black function:
+#       sensor = sensor_index.find(cb, hostname)  # Replaces cb.select(Sensor).where('hostname:' + hostname)[0]
+#       if sensor is None: ...  # Host does not have CB agent
+#       sensor = sensor_index.lookup(cb, hostname)  # Fresh from CB, ie before acting on the sensor
+#   Refreshes are not incremental, CB has no changed-since filter on the sensor list: the whole sensor list is
+#   bulk-loaded in one query and reloaded once it is older than INDEX_TTL, so a sensor's status may be up to INDEX_TTL
+#   old; sensor_watcher.wait_for() still decides when a host is online. The watcher's batch refreshes reload the index
+#   too. A hostname missing from the index costs one hostname query, which adds the host to the index if CB knows it.
+#   Hostnames are keyed upper case by their first 15 characters, as CB limits them, and a reinstalled host resolves
+#   to its newest sensor.
+
+import time
+import logging
+import datetime
+import threading
+from cbapi.response import Sensor
+
+log = logging.getLogger(__name__)  # Establish logging
+
+INDEX_TTL = 60  # Seconds a bulk-loaded index is trusted before the next lookup reloads it
+
+
+def hostname_key(hostname):
+    """
+    Normalize a hostname the way CB limits it: upper case and limited to 15 characters
+    :param hostname: hostname
+    :return: upper case hostname, truncated to 15 characters
+    """
+    return str(hostname).upper()[:15]
+
+
+def _checkin_time(sensor):
+    """
+    When a sensor last checked in, comparable across time zone offsets
+    :param sensor: sensor object
+    :return: naive UTC datetime, datetime.min if the sensor never checked in
+    """
+    checkin = getattr(sensor, 'last_checkin_time', None)
+    if checkin is None:  # Never checked in, the oldest of all
+        return datetime.datetime.min
+    if checkin.utcoffset() is not None:
+        checkin = (checkin - checkin.utcoffset()).replace(tzinfo=None)
+    return checkin
+
+
+class SensorIndex(object):
+    # Singleton
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self, ttl=INDEX_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._by_hostname = {}  # hostname key -> most recently checked in sensor
+        self._loaded_at = 0  # When the fleet was last bulk-loaded
+
+    @staticmethod
+    def get_index():
+        with SensorIndex.__instance_lock:
+            if SensorIndex.__instance is None:
+                SensorIndex.__instance = SensorIndex()
+        return SensorIndex.__instance
+
+    def _add(self, sensor, by_hostname):
+        """
+        Add a sensor, the most recently checked in sensor wins a reused hostname. Caller must hold the lock.
+        :param sensor: sensor object
+        :param by_hostname: hostname map being built
+        :return:
+        """
+        key = hostname_key(sensor.hostname)
+        current = by_hostname.get(key)
+        if current is None or _checkin_time(sensor) > _checkin_time(current):
+            by_hostname[key] = sensor
+
+    def load(self, sensors):
+        """
+        Replace the index with a bulk-loaded sensor list
+        :param sensors: every sensor object in CB
+        :return:
+        """
+        with self._lock:
+            by_hostname = {}
+            for sensor in sensors:
+                self._add(sensor, by_hostname)
+            for key, sensor in by_hostname.items():
+                old = self._by_hostname.get(key)
+                if old is not None and old.id != sensor.id:  # The host was reinstalled, its new sensor replaces the old one
+                    log.info('[INFO] Sensor index saw ' + key + ' move from CB Sensor #' + str(old.id) + ' to CB Sensor #' + str(sensor.id))
+            self._by_hostname = by_hostname
+            self._loaded_at = time.time()
+
+    def reload(self, cb):
+        """
+        Bulk-load every sensor in one query
+        :param cb: CbEnterpriseResponseAPI
+        :return: dict of hostname key -> most recently checked in sensor
+        """
+        self.load(cb.select(Sensor))  # One API call returns the whole fleet
+        with self._lock:
+            return dict(self._by_hostname)
+
+    def is_stale(self):
+        with self._lock:
+            return time.time() - self._loaded_at > self.ttl
+
+    def find(self, cb, hostname):
+        """
+        Sensor for a hostname, resolved from memory
+        :param cb: CbEnterpriseResponseAPI
+        :param hostname: hostname
+        :return: the hostname's most recently checked in sensor, or None if CB has no sensor for it
+        """
+        if self.is_stale():
+            self.reload(cb)
+
+        with self._lock:
+            sensor = self._by_hostname.get(hostname_key(hostname))
+        if sensor is not None:
+            return sensor
+        return self.lookup(cb, hostname)  # Not in the index, the host may have enrolled since the last load
+
+    def lookup(self, cb, hostname):
+        """
+        Sensor for a hostname, queried from CB and updated in the index
+        :param cb: CbEnterpriseResponseAPI
+        :param hostname: hostname
+        :return: the hostname's most recently checked in sensor, or None if CB has no sensor for it
+        """
+        key = hostname_key(hostname)
+        sensors = list(cb.select(Sensor).where('hostname:' + key))
+        with self._lock:
+            newest = {}
+            for each_sensor in sensors:
+                if hostname_key(each_sensor.hostname) == key:
+                    self._add(each_sensor, newest)
+            if key in newest:
+                self._by_hostname[key] = newest[key]  # Replaces the indexed sensor, even if the index held a newer check in
+            return self._by_hostname.get(key)
+
+    def sensors(self, cb):
+        """
+        Every indexed sensor, reloaded first if the index is stale
+        :param cb: CbEnterpriseResponseAPI
+        :return: list of the most recently checked in sensor of each hostname
+        """
+        if self.is_stale():
+            self.reload(cb)
+        with self._lock:
+            return list(self._by_hostname.values())
+
+
+def find(cb, hostname):
+    """
+    Sensor for a hostname, resolved from the process-wide index
+    :param cb: CbEnterpriseResponseAPI
+    :param hostname: hostname
+    :return: sensor object, or None if CB has no sensor for the hostname
+    """
+    return SensorIndex.get_index().find(cb, hostname)
+
+
+def lookup(cb, hostname):
+    """
+    Sensor for a hostname, queried from CB and updated in the process-wide index
+    :param cb: CbEnterpriseResponseAPI
+    :param hostname: hostname
+    :return: sensor object, or None if CB has no sensor for the hostname
+    """
+    return SensorIndex.get_index().lookup(cb, hostname)
+
+
+def sensors(cb):
+    """
+    Every indexed sensor
+    :param cb: CbEnterpriseResponseAPI
+    :return: list of sensor objects
+    """
+    return SensorIndex.get_index().sensors(cb)
+
+
+def reload(cb):
+    """
+    Bulk-load every sensor into the process-wide index
+    :param cb: CbEnterpriseResponseAPI
+    :return: dict of hostname key -> most recently checked in sensor
+    """
+    return SensorIndex.get_index().reload(cb)
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+# This utility watches Carbon Black sensor state fleet-wide so functions no longer poll CB for their own host.
+# File: sensor_watcher.py
+# Date: 10/18/2026
+# Author: Jared F
+
+"""Fleet-wide sensor status watcher"""
+#   Usage from a Carbon Black function:
+#       sensor = sensor_watcher.wait_for(cb, hostname, lambda s: s.status == "Online", deadline, sensor)
+#   One background thread batch-queries every sensor on an adaptive interval while any function is waiting,
+#   keeps a hostname -> sensor map in memory, and wakes waiting functions when their host's state changes.
+
+import time
+import logging
+import datetime
+import threading
+import carbon_black.util.sensor_index as sensor_index
+import carbon_black.util.phase_metrics as phase_metrics
+
+log = logging.getLogger(__name__)  # Establish logging
+
+MIN_INTERVAL = 3  # Seconds, fastest refresh interval, used right after a state change or a new waiter
+MAX_INTERVAL = 60  # Seconds, slowest refresh interval, reached while watched hosts stay unchanged
+RECHECK_INTERVAL = 3  # Seconds between re-evaluations of a waiter's condition, conditions may depend on more than sensor state
+
+
+class SensorWatcher(object):
+    # Singleton
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self):
+        self._cb = None  # CbEnterpriseResponseAPI used for the batch queries
+        self._condition = threading.Condition()
+        self._poke = threading.Event()  # Set to cut the current refresh interval short
+        self._sensors = {}  # hostname -> latest sensor object
+        self._waiters = {}  # hostname -> number of functions waiting on the host
+        self._interval = MIN_INTERVAL
+        self._generation = 0  # Incremented on every completed refresh
+        self._thread = None
+
+    @staticmethod
+    def get_watcher():
+        with SensorWatcher.__instance_lock:
+            if SensorWatcher.__instance is None:
+                SensorWatcher.__instance = SensorWatcher()
+        return SensorWatcher.__instance
+
+    @staticmethod
+    def hostname_key(hostname):
+        """
+        Normalize a hostname the way the sensor index does, CB limits hostname to 15 characters
+        :param hostname: hostname string
+        :return: upper case hostname, truncated to 15 characters
+        """
+        return sensor_index.hostname_key(hostname)
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._watch_forever, name='cb-sensor-watcher')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _watch_forever(self):
+        while True:
+            with self._condition:
+                while not self._waiters:  # Nothing to watch, sleep until a function subscribes
+                    self._condition.wait()
+                cb = self._cb
+
+            try:
+                changed = self.refresh(cb)
+            except Exception as err:
+                log.error('[ERROR] Sensor watcher could not query CB: ' + str(err))
+                changed = False
+
+            if changed: self._interval = MIN_INTERVAL
+            else: self._interval = min(self._interval * 2, MAX_INTERVAL)
+
+            self._poke.wait(self._interval)
+            self._poke.clear()
+
+    def refresh(self, cb):
+        """
+        Batch-query every sensor in one call and update the hostname map, waking waiters when a watched host changed
+        :param cb: CbEnterpriseResponseAPI
+        :return: True if the status or restart_queued value of a watched host changed
+        """
+        latest = sensor_index.reload(cb)  # One API call returns the whole fleet and keeps the sensor index fresh, reused hostnames resolve to the most recently checked in sensor
+
+        changed = False
+        with self._condition:
+            for hostname in self._waiters:
+                old, new = self._sensors.get(hostname), latest.get(hostname)
+                if old is None or new is None:
+                    changed = changed or (old is not new)
+                elif old.status != new.status or old.restart_queued != new.restart_queued:
+                    log.info('[INFO] Sensor watcher saw ' + hostname + ' change to status=' + str(new.status) + ', restart_queued=' + str(new.restart_queued))
+                    changed = True
+            self._sensors = latest
+            self._generation += 1
+            self._condition.notify_all()  # Waiters re-evaluate against the fresh state
+        return changed
+
+    def subscribe(self, cb, hostname):
+        """
+        Start watching a hostname, the next refresh happens immediately
+        :param cb: CbEnterpriseResponseAPI
+        :param hostname: hostname to watch
+        :return:
+        """
+        hostname = self.hostname_key(hostname)
+        with self._condition:
+            if self._cb is None:
+                self._cb = cb
+            self._waiters[hostname] = self._waiters.get(hostname, 0) + 1
+            self._interval = MIN_INTERVAL
+            self._condition.notify_all()
+        self._start()
+        self._poke.set()
+
+    def unsubscribe(self, hostname):
+        """
+        Stop watching a hostname
+        :param hostname: hostname previously passed to subscribe
+        :return:
+        """
+        hostname = self.hostname_key(hostname)
+        with self._condition:
+            count = self._waiters.get(hostname, 0) - 1
+            if count > 0: self._waiters[hostname] = count
+            else: self._waiters.pop(hostname, None)
+
+    def get_sensor(self, hostname, default=None):
+        """
+        Latest sensor object seen for a hostname
+        :param hostname: hostname
+        :param default: returned if the watcher has not seen the hostname
+        :return: sensor object
+        """
+        with self._condition:
+            return self._sensors.get(self.hostname_key(hostname), default)
+
+    def wait_for(self, cb, hostname, condition, deadline, default=None):
+        """
+        Block until condition(sensor) is True for the hostname's latest sensor or the deadline passes
+        :param cb: CbEnterpriseResponseAPI
+        :param hostname: hostname to wait on
+        :param condition: callable taking the latest sensor object and returning a boolean
+        :param deadline: datetime.datetime after which the wait gives up
+        :param default: sensor object returned while the watcher has not seen the hostname
+        :return: the latest sensor object, check it again as the deadline may have passed
+        """
+        if default is not None and condition(default):  # Already satisfied, skip the batch query entirely
+            return default
+
+        key = self.hostname_key(hostname)
+        self.subscribe(cb, key)
+        try:
+            with self._condition:
+                start_generation = self._generation
+                first_refresh = time.time() + MAX_INTERVAL
+                while True:
+                    if self._generation > start_generation:  # Only trust state refreshed after the wait began
+                        sensor = self._sensors.get(key, default)
+                    elif time.time() >= first_refresh:  # The watcher could not refresh, fall back to the caller's sensor
+                        sensor = default
+                    else:
+                        sensor = None
+                    if sensor is not None and condition(sensor):
+                        return sensor
+
+                    remaining = (deadline - datetime.datetime.now()).total_seconds()
+                    if remaining <= 0:
+                        return default if sensor is None else sensor
+                    self._condition.wait(min(remaining, RECHECK_INTERVAL))
+        finally:
+            self.unsubscribe(key)
+
+
+def wait_for(cb, hostname, condition, deadline, default=None):
+    """
+    Block until condition(sensor) is True for the hostname or the deadline passes, using the process-wide watcher
+    :param cb: CbEnterpriseResponseAPI
+    :param hostname: hostname to wait on
+    :param condition: callable taking the latest sensor object and returning a boolean
+    :param deadline: datetime.datetime after which the wait gives up
+    :param default: sensor object returned while the watcher has not seen the hostname
+    :return: the latest sensor object
+    """
+    with phase_metrics.phase(phase_metrics.WAIT_HOST):
+        return SensorWatcher.get_watcher().wait_for(cb, hostname, condition, deadline, default)
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+
+# This utility brokers Carbon Black live response sessions so warm sessions are reused across function invocations.
+# File: session_broker.py
+# Date: 10/18/2026
+# Author: Jared F
+
+"""Live response session broker"""
+#   Usage from a Carbon Black function:
+#       session = session_broker.request_session(cb, sensor.id)  # Warm session if one is held for the sensor
+#       session_broker.release_session(session)  # Return the session to the broker, it is kept warm for the next function
+#       session_broker.discard_session(session)  # Close a session that is no longer trusted (ie after a TimeoutError)
+
+import time
+import logging
+import threading
+import carbon_black.util.phase_metrics as phase_metrics
+import carbon_black.util.job_journal as job_journal
+
+log = logging.getLogger(__name__)  # Establish logging
+
+MAX_SESSIONS = 10  # Maximum number of live response sessions held open at once, keep at or below the CB server's session limit
+SESSION_IDLE_TIMEOUT = 600  # Seconds an unused session is kept warm before it is closed
+HEALTH_CHECK_AFTER = 60  # Seconds a session may sit unused before it is health checked on its next checkout
+KEEPALIVE_INTERVAL = 60  # Seconds between keepalives sent for idle sessions, keeps the CB server from expiring them
+CREATE_WAIT_TIMEOUT = 3600  # Seconds to wait for a free session slot before giving up
+
+
+class SessionBrokerFull(Exception):
+    """ No live response session slot became available in time """
+    def __init__(self, sensor_id, max_sessions):
+        fail_msg = "No live response session slot for CB Sensor #{} became available, all {} sessions are in use".format(sensor_id, max_sessions)
+        super(SessionBrokerFull, self).__init__(fail_msg)
+
+
+class _BrokeredSession(object):
+    """ Book-keeping for one live response session held by the broker """
+    def __init__(self, cb, sensor_id):
+        self.cb = cb
+        self.sensor_id = sensor_id
+        self.session = None  # Set once the session is established
+        self.ready = False  # False while the session is still being established
+        self.discarded = False  # True once the session should no longer be handed out
+        self.users = 0  # Number of functions currently using the session
+        self.last_used = time.time()
+        self.last_keepalive = time.time()
+
+
+class SessionBroker(object):
+    # Singleton
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self, max_sessions=MAX_SESSIONS, idle_timeout=SESSION_IDLE_TIMEOUT):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._entries = {}  # sensor_id -> _BrokeredSession, one held session per sensor
+        self._retired = []  # Discarded _BrokeredSession entries still in use, counted against max_sessions until closed
+        self._condition = threading.Condition()
+        self._reaper = None
+
+    @staticmethod
+    def get_broker():
+        with SessionBroker.__instance_lock:
+            if SessionBroker.__instance is None:
+                SessionBroker.__instance = SessionBroker()
+        return SessionBroker.__instance
+
+    def _held(self):
+        """
+        Number of session slots currently held, including sessions being established and retired sessions in use
+        :return: int
+        """
+        return len(self._entries) + len(self._retired)
+
+    def _start_reaper(self):
+        """
+        Start the background thread that closes idle sessions and keeps warm sessions alive
+        :return:
+        """
+        if self._reaper is None or not self._reaper.is_alive():
+            self._reaper = threading.Thread(target=self._reap_forever, name='cb-session-broker')
+            self._reaper.daemon = True
+            self._reaper.start()
+
+    def _reap_forever(self):
+        while True:
+            time.sleep(min(KEEPALIVE_INTERVAL, self.idle_timeout))
+            try: self.close_idle_sessions()
+            except Exception as err: log.error('[ERROR] Session broker reaper encountered: ' + str(err))
+
+    def _evict_one_idle(self):
+        """
+        Pick the least recently used idle session for closing to free a slot. Caller must hold the condition.
+        :return: _BrokeredSession or None
+        """
+        idle = [e for e in self._entries.values() if e.ready and e.users == 0]
+        if not idle:
+            return None
+        entry = min(idle, key=lambda e: e.last_used)
+        del self._entries[entry.sensor_id]
+        return entry
+
+    def _close(self, entry):
+        """
+        Close the underlying live response session, never raises
+        :param entry: _BrokeredSession
+        :return:
+        """
+        try:
+            entry.session.close()
+            log.info('[INFO] Session broker closed Session #' + str(entry.session.session_id) + ' to CB Sensor #' + str(entry.sensor_id))
+        except Exception as err:
+            log.debug('[DEBUG] Session broker could not close session to CB Sensor #' + str(entry.sensor_id) + ': ' + str(err))
+
+    def _is_healthy(self, entry):
+        """
+        Run a cheap live response command to confirm a warm session still works
+        :param entry: _BrokeredSession
+        :return: boolean
+        """
+        try:
+            entry.session.list_drives()
+            return True
+        except Exception as err:
+            log.info('[INFO] Warm session to CB Sensor #' + str(entry.sensor_id) + ' failed its health check: ' + str(err))
+            return False
+
+    def request_session(self, cb, sensor_id):
+        """
+        Check out a live response session for sensor_id, reusing a warm session when one is held
+        :param cb: CbEnterpriseResponseAPI used to establish a new session
+        :param sensor_id: CB sensor ID
+        :return: live response session
+        :raises SessionBrokerFull if no session slot frees up within CREATE_WAIT_TIMEOUT
+        """
+        self._start_reaper()
+        give_up_at = time.time() + CREATE_WAIT_TIMEOUT
+
+        while True:
+            evicted = None
+            with self._condition:
+                entry = self._entries.get(sensor_id)
+
+                if entry is not None and not entry.ready:  # Another function is establishing this sensor's session, wait for it
+                    self._condition.wait(5)
+                    continue
+
+                if entry is not None:  # Warm session is held for this sensor
+                    entry.users += 1
+                    check_health = entry.users == 1 and (time.time() - entry.last_used) >= HEALTH_CHECK_AFTER
+                    if not check_health:
+                        entry.last_used = time.time()
+                        return entry.session
+
+                else:  # No session is held for this sensor, reserve a slot and establish one
+                    if self._held() >= self.max_sessions:
+                        evicted = self._evict_one_idle()
+                        if evicted is None:
+                            if time.time() >= give_up_at:
+                                raise SessionBrokerFull(sensor_id, self.max_sessions)
+                            self._condition.wait(5)
+                            continue
+
+                    entry = _BrokeredSession(cb, sensor_id)
+                    entry.users = 1
+                    self._entries[sensor_id] = entry
+                    check_health = False
+
+            if evicted is not None:
+                self._close(evicted)
+
+            if check_health:  # Verify the warm session outside of the lock
+                if self._is_healthy(entry):
+                    with self._condition:
+                        entry.last_used = time.time()
+                    return entry.session
+                self.discard_session(entry.session)
+                continue
+
+            try:
+                entry.session = phase_metrics.instrument(cb.live_response.request_session(sensor_id))  # Commands and transfers on the session are timed per job
+            except Exception:
+                with self._condition:  # Free the reserved slot so waiters can retry
+                    if self._entries.get(sensor_id) is entry:
+                        del self._entries[sensor_id]
+                    self._condition.notify_all()
+                raise
+
+            with self._condition:
+                entry.ready = True
+                entry.last_used = time.time()
+                entry.last_keepalive = time.time()
+                self._condition.notify_all()
+            return entry.session
+
+    def _find(self, session):
+        """
+        Find the broker entry owning session. Caller must hold the condition.
+        :param session: live response session
+        :return: _BrokeredSession or None
+        """
+        if session is None:  # Nothing checked out, never match an entry still connecting
+            return None
+        for entry in list(self._entries.values()) + self._retired:
+            if entry.session is session:
+                return entry
+        return None
+
+    def release_session(self, session):
+        """
+        Return a checked out session to the broker, the session is kept warm for reuse
+        :param session: live response session from request_session
+        :return:
+        """
+        close_entry = None
+        with self._condition:
+            entry = self._find(session)
+            if entry is None:  # Unknown or already closed session
+                return
+            entry.users = max(0, entry.users - 1)
+            entry.last_used = time.time()
+            if entry.discarded and entry.users == 0:
+                self._retired.remove(entry)
+                close_entry = entry
+            self._condition.notify_all()
+
+        if close_entry is not None:
+            self._close(close_entry)
+
+    def discard_session(self, session):
+        """
+        Stop handing out a session that is no longer trusted, it is closed once every user has released it
+        :param session: live response session from request_session
+        :return:
+        """
+        close_entry = None
+        with self._condition:
+            entry = self._find(session)
+            if entry is None:  # Unknown or already closed session
+                return
+            if not entry.discarded:
+                entry.discarded = True
+                if self._entries.get(entry.sensor_id) is entry:
+                    del self._entries[entry.sensor_id]
+                self._retired.append(entry)
+            entry.users = max(0, entry.users - 1)
+            if entry.users == 0:
+                self._retired.remove(entry)
+                close_entry = entry
+            self._condition.notify_all()
+
+        if close_entry is not None:
+            self._close(close_entry)
+
+    def close_idle_sessions(self):
+        """
+        Close sessions unused for longer than idle_timeout and send keepalives for the remaining idle sessions
+        :return:
+        """
+        now = time.time()
+        to_close = []
+        to_keepalive = []
+        with self._condition:
+            for sensor_id, entry in list(self._entries.items()):
+                if not entry.ready or entry.users > 0:
+                    continue
+                if now - entry.last_used >= self.idle_timeout:
+                    del self._entries[sensor_id]
+                    to_close.append(entry)
+                elif now - entry.last_keepalive >= KEEPALIVE_INTERVAL:
+                    entry.last_keepalive = now
+                    to_keepalive.append(entry)
+            if to_close:
+                self._condition.notify_all()
+
+        for entry in to_close:
+            self._close(entry)
+
+        for entry in to_keepalive:
+            try: entry.cb.get_object('/api/v1/cblr/session/{0}/keepalive'.format(entry.session.session_id))
+            except Exception as err:
+                log.info('[INFO] Keepalive failed for Session #' + str(entry.session.session_id) + ', it will be replaced on next use: ' + str(err))
+                self.discard_session_if_idle(entry.session)
+
+    def discard_session_if_idle(self, session):
+        """
+        Discard a session only if no function is currently using it
+        :param session: live response session
+        :return:
+        """
+        with self._condition:
+            entry = self._find(session)
+            if entry is None or entry.users > 0:
+                return
+            entry.users += 1  # Balanced by discard_session
+        self.discard_session(session)
+
+    def close_all_sessions(self):
+        """
+        Close every idle session held by the broker, sessions in use are closed when released
+        :return:
+        """
+        with self._condition:
+            entries = list(self._entries.values())
+        for entry in entries:
+            if entry.ready:
+                self.discard_session_if_idle(entry.session)
+
+
+def request_session(cb, sensor_id):
+    """
+    Check out a live response session for sensor_id from the process-wide broker
+    :param cb: CbEnterpriseResponseAPI
+    :param sensor_id: CB sensor ID
+    :return: live response session
+    """
+    with phase_metrics.phase(phase_metrics.SESSION):
+        session = SessionBroker.get_broker().request_session(cb, sensor_id)
+    job_journal.record_session(session.session_id)  # Closed at startup if a restart interrupts the job
+    return session
+
+
+def release_session(session):
+    """
+    Return a session to the process-wide broker so it stays warm for the next function
+    :param session: live response session
+    :return:
+    """
+    SessionBroker.get_broker().release_session(session)
+
+
+def discard_session(session):
+    """
+    Close a session held by the process-wide broker that should no longer be reused
+    :param session: live response session
+    :return:
+    """
+    SessionBroker.get_broker().discard_session(session)
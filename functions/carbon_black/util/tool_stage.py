@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+# This utility stages integration server tools on endpoints, uploading a tool only when the staged copy differs.
+# File: tool_stage.py
+# Date: 10/18/2026
+# Author: Jared F
+
+"""Hash-checked tool staging"""
+#   Usage from a Carbon Black function with an established session:
+#       tool_stage.stage_tool(session, PATH_TO_UTILITY, r'C:\Windows\CarbonBlack\Tools\BHV.exe')  # Replaces delete_file + put_file
+#       session.create_process(r'C:\Windows\CarbonBlack\Tools\BHV.exe ...', True)
+#   Staged tools are left on the endpoint, the next collection on the host hashes the staged copy with certutil
+#   (built into every supported Windows version) and skips the upload when it matches the integration server's copy.
+#   Which tool versions are staged on which sensor is recorded in STAGED_TOOLS_FILE.
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from cbapi.errors import TimeoutError
+
+log = logging.getLogger(__name__)  # Establish logging
+
+STAGED_TOOLS_FILE = '/home/integrations/.resilient/cb_staged_tools.json'  # Tool versions staged on each sensor, kept across runs
+HASH_TIMEOUT = 120  # Seconds the endpoint may take to hash a staged tool
+
+
+class ToolStage(object):
+    # Singleton
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self, staged_tools_file=STAGED_TOOLS_FILE):
+        self.staged_tools_file = staged_tools_file
+        self._lock = threading.Lock()
+        self._staged = self._load()  # sensor_id -> {endpoint path: {"tool", "sha256", "size", "staged"}}
+        self._local_hashes = {}  # local path -> (size, mtime, sha256), tools are only rehashed when they change
+
+    @staticmethod
+    def get_stage():
+        with ToolStage.__instance_lock:
+            if ToolStage.__instance is None:
+                ToolStage.__instance = ToolStage()
+        return ToolStage.__instance
+
+    def _load(self):
+        try:
+            with open(self.staged_tools_file, 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save(self):
+        """
+        Write the staged tools record. Caller must hold the lock.
+        :return:
+        """
+        try:
+            if not os.path.exists(os.path.dirname(self.staged_tools_file)):
+                os.makedirs(os.path.dirname(self.staged_tools_file))
+            temp_staged_tools_file = self.staged_tools_file + '.' + str(os.getpid())
+            with open(temp_staged_tools_file, 'w') as f:
+                f.write(json.dumps(self._staged))
+            os.rename(temp_staged_tools_file, self.staged_tools_file)  # Atomic replace, readers never see a partial record
+        except (IOError, OSError) as err:
+            log.error('[ERROR] Could not save staged tools: ' + str(err))
+
+    def local_hash(self, local_path):
+        """
+        SHA-256 of the integration server's copy of a tool
+        :param local_path: integration server file path
+        :return: lowercase hex digest
+        """
+        stat = os.stat(local_path)
+        with self._lock:
+            cached = self._local_hashes.get(local_path)
+        if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime:
+            return cached[2]
+
+        sha256 = hashlib.sha256()
+        with open(local_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024*1024), b''):
+                sha256.update(block)
+        with self._lock:
+            self._local_hashes[local_path] = (stat.st_size, stat.st_mtime, sha256.hexdigest())
+        return sha256.hexdigest()
+
+    @staticmethod
+    def endpoint_hash(session, remote_path):
+        """
+        SHA-256 of a file on the endpoint
+        :param session: established live response session
+        :param remote_path: endpoint file path
+        :return: lowercase hex digest, or None if the endpoint could not hash the file
+        :raises TimeoutError if the sensor stops responding
+        """
+        try: output = session.create_process(r'certutil.exe -hashfile "{0}" SHA256'.format(remote_path), True, None, None, HASH_TIMEOUT, True)
+        except TimeoutError: raise
+        except Exception as err:
+            log.info('[INFO] Endpoint could not hash ' + remote_path + ': ' + str(err))
+            return None
+
+        if isinstance(output, bytes):
+            output = output.decode('utf-8', 'replace')
+        for line in output.splitlines():
+            digest = line.strip().replace(' ', '').lower()  # Older certutil versions space-separate the digest bytes
+            if re.match(r'^[0-9a-f]{64}$', digest):
+                return digest
+        return None
+
+    def staged_tools(self, sensor_id):
+        """
+        Tools recorded as staged on a sensor
+        :param sensor_id: CB sensor ID
+        :return: dict of endpoint path -> {"tool", "sha256", "size", "staged"}
+        """
+        with self._lock:
+            return dict(self._staged.get(str(sensor_id), {}))
+
+    def record(self, sensor_id, remote_path, local_path, sha256):
+        """
+        Record a tool version as staged on a sensor
+        :param sensor_id: CB sensor ID
+        :param remote_path: endpoint file path
+        :param local_path: integration server file path of the tool
+        :param sha256: hex digest of the staged copy
+        :return:
+        """
+        with self._lock:
+            self._staged.setdefault(str(sensor_id), {})[remote_path] = {"tool": os.path.basename(local_path), "sha256": sha256, "size": os.path.getsize(local_path), "staged": int(time.time())}
+            self._save()
+
+    def forget(self, sensor_id, remote_path):
+        """
+        Remove a tool from a sensor's record, ie after it was deleted from the endpoint
+        :param sensor_id: CB sensor ID
+        :param remote_path: endpoint file path
+        :return:
+        """
+        with self._lock:
+            if self._staged.get(str(sensor_id), {}).pop(remote_path, None) is not None:
+                self._save()
+
+    def stage_tool(self, session, local_path, remote_path):
+        """
+        Place a tool on the endpoint unless the staged copy already matches the integration server's copy
+        :param session: established live response session
+        :param local_path: integration server file path of the tool
+        :param remote_path: endpoint file path
+        :return: True if the tool was uploaded, False if the staged copy was reused
+        :raises TimeoutError if the sensor stops responding
+        """
+        local_hash = self.local_hash(local_path)
+
+        try: listing = session.list_directory(remote_path)[0]
+        except TimeoutError: raise
+        except Exception: listing = None  # Tool was never staged
+
+        if listing is not None:
+            if listing['size'] == os.path.getsize(local_path) and self.endpoint_hash(session, remote_path) == local_hash:
+                self.record(session.sensor_id, remote_path, local_path, local_hash)
+                log.info('[INFO] ' + remote_path + ' is already staged on CB Sensor #' + str(session.sensor_id))
+                return False
+
+            try: session.delete_file(remote_path)  # Stale or modified copy
+            except TimeoutError: raise
+            except Exception: pass
+
+        self.forget(session.sensor_id, remote_path)
+        with open(local_path, 'rb') as f:
+            session.put_file(f, remote_path)  # Place the tool on the endpoint
+        self.record(session.sensor_id, remote_path, local_path, local_hash)
+        log.info('[INFO] Staged ' + local_path + ' to ' + remote_path + ' on CB Sensor #' + str(session.sensor_id))
+        return True
+
+
+def stage_tool(session, local_path, remote_path):
+    """
+    Place a tool on the endpoint unless the staged copy already matches the integration server's copy
+    :param session: established live response session
+    :param local_path: integration server file path of the tool
+    :param remote_path: endpoint file path
+    :return: True if the tool was uploaded, False if the staged copy was reused
+    """
+    return ToolStage.get_stage().stage_tool(session, local_path, remote_path)
+
+
+def staged_tools(sensor_id):
+    """
+    Tools recorded as staged on a sensor
+    :param sensor_id: CB sensor ID
+    :return: dict of endpoint path -> {"tool", "sha256", "size", "staged"}
+    """
+    return ToolStage.get_stage().staged_tools(sensor_id)
+
+
+def forget(sensor_id, remote_path):
+    """
+    Remove a tool from a sensor's record
+    :param sensor_id: CB sensor ID
+    :param remote_path: endpoint file path
+    :return:
+    """
+    ToolStage.get_stage().forget(sensor_id, remote_path)
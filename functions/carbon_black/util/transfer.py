@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+
+# This utility streams files retrieved over a live response session into local files and ZIP archives.
+# File: transfer.py
+# Date: 10/18/2026
+# Author: Jared F
+
+"""Live response file transfer"""
+#   Usage from a Carbon Black function with an established session:
+#       with zipfile.ZipFile(temp_zip, 'w') as zip_file:
+#           transfer.stream_file_to_zip(session, r'C:\Windows\file.log', zip_file, 'file.log', custom_timeout)
+#   The file is copied from the CB server in CHUNK_SIZE pieces, it is never held in memory as a whole.
+#   Resumable retrievals that survive TimeoutError retries and sensor restarts:
+#       checkpoint = transfer.TransferCheckpoint(hostname, 'cb_retrieve_file_or_directory', path_or_file)
+#       local_file = transfer.resumable_get(session, checkpoint, r'C:\Windows\file.log')  # Continues from the last completed chunk
+#       checkpoint.clear()  # Once the retrieved files were delivered
+#   Several files at once over one session, local files are returned in the order requested:
+#       local_files = transfer.retrieve_files(session, checkpoint, [[remote_path, listing], ...])
+#   Every completed transfer is observed by the sensor's transfer rate model, which sizes the resumable range timeouts.
+#   The sensor runs a session's commands one at a time, so a range command waits out the commands queued ahead of it:
+#   its timeout adds theirs, and its observed duration starts once the command ahead of it completed.
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import hashlib
+import zipfile
+import tempfile
+import threading
+from six.moves import queue
+from cbapi.errors import TimeoutError, ApiError
+import carbon_black.util.transfer_rate as transfer_rate
+import carbon_black.util.phase_metrics as phase_metrics
+import carbon_black.util.job_journal as job_journal
+
+log = logging.getLogger(__name__)  # Establish logging
+
+CHUNK_SIZE = 1024*1024  # Bytes read from the CB server and written into the archive at a time, default = 1MB
+RESUME_CHUNK_SIZE = 16*1024*1024  # Bytes requested from the sensor per live response get file command in resumable retrievals, default = 16MB
+CHECKPOINT_DIRECTORY = '/home/integrations/.resilient/cb_transfers'  # Resumable retrieval checkpoints, one subdirectory per job
+CHECKPOINT_TTL = 86400  # Seconds an untouched checkpoint is kept before it is reclaimed, default = 1 day
+CHECKPOINT_SAVE_INTERVAL = 1  # Minimum seconds between checkpoint state saves while files complete, bounds disk writes for directories of small files
+MAX_PARALLEL_TRANSFERS = 4  # Live response get file commands run at once on one session by retrieve_files
+
+_session_commands = {}  # Session ID -> {"queued": {command: timeout}, "completed": time the last command completed}
+_session_commands_lock = threading.Lock()
+
+
+def _zip_arcname(arcname):
+    """
+    Normalize an archive member name the way zipfile.ZipFile.write does
+    :param arcname: member name, may use os.sep and a leading separator
+    :return: normalized member name
+    """
+    arcname = os.path.normpath(os.path.splitdrive(arcname)[1])
+    while arcname[0] in (os.sep, os.altsep):
+        arcname = arcname[1:]
+    return arcname
+
+
+def stream_file(session, remote_path, output_file, timeout=None):
+    """
+    Copy a file from the endpoint into an open local file object
+    :param session: established live response session
+    :param remote_path: endpoint file path
+    :param output_file: file object opened for binary writing
+    :param timeout: seconds to wait for the sensor to upload the file to the CB server
+    :return: number of bytes written
+    """
+    started = time.time()
+    with phase_metrics.phase(phase_metrics.TRANSFER) as measured:
+        raw = session.get_raw_file(remote_path, timeout=timeout)
+        try:
+            start = output_file.tell()
+            shutil.copyfileobj(raw, output_file, CHUNK_SIZE)
+            file_size = measured.bytes = output_file.tell() - start
+        finally:
+            raw.close()
+    transfer_rate.observe(session.sensor_id, file_size, time.time() - started)
+    return file_size
+
+
+def stream_file_to_zip(session, remote_path, zip_file, arcname, timeout=None):
+    """
+    Copy a file from the endpoint straight into a deflated member of an open ZIP archive
+    :param session: established live response session
+    :param remote_path: endpoint file path
+    :param zip_file: zipfile.ZipFile opened for writing
+    :param arcname: member name in the archive
+    :param timeout: seconds to wait for the sensor to upload the file to the CB server
+    :return: number of uncompressed bytes written
+    """
+    arcname = _zip_arcname(arcname)
+
+    if sys.version_info < (3, 6):  # ZipFile.open(mode='w') is not available, spool through a temporary file instead
+        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+            try:
+                file_size = stream_file(session, remote_path, temp_file, timeout)
+                temp_file.close()
+                with phase_metrics.phase(phase_metrics.ZIP, file_size):
+                    zip_file.write(temp_file.name, arcname, compress_type=zipfile.ZIP_DEFLATED)
+                return file_size
+            finally:
+                os.unlink(temp_file.name)
+
+    zinfo = zipfile.ZipInfo(arcname, date_time=time.localtime(time.time())[:6])
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.external_attr = 0o600 << 16  # -rw-------
+    started = time.time()
+    with phase_metrics.phase(phase_metrics.TRANSFER) as measured:  # Deflating happens as the stream arrives, it is timed as part of the transfer
+        raw = session.get_raw_file(remote_path, timeout=timeout)
+        try:
+            with zip_file.open(zinfo, 'w', force_zip64=True) as member:  # force_zip64 as the size is unknown until the stream ends
+                shutil.copyfileobj(raw, member, CHUNK_SIZE)
+        finally:
+            raw.close()
+        measured.bytes = zinfo.file_size
+    transfer_rate.observe(session.sensor_id, zinfo.file_size, time.time() - started)
+    return zinfo.file_size
+
+
+class TransferCheckpoint(object):
+    """ Local record of the byte ranges and files a job has already retrieved from an endpoint """
+    def __init__(self, hostname, job_name, target, checkpoint_directory=None):
+        self.key = hashlib.sha1(u'|'.join([str(hostname).upper(), job_name, target]).encode('utf-8')).hexdigest()
+        self.directory = os.path.join(checkpoint_directory or CHECKPOINT_DIRECTORY, self.key)  # Resolved per checkpoint so CHECKPOINT_DIRECTORY can be redirected, ie by the benchmark
+        self._state_file = os.path.join(self.directory, 'state.json')
+        self.files = self._load()  # remote path -> {"local", "size", "modified", "received", "complete"}
+        self._lock = threading.Lock()  # Transfers of several files may update the checkpoint at once
+        self._saved = 0  # When the state was last saved
+        job_journal.record_checkpoint(self.key)  # A job interrupted by a restart keeps its checkpoint for its rerun
+
+    def _load(self):
+        try:
+            with open(self._state_file, 'r') as f:
+                return json.load(f).get("files", {})
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save(self, force=True):
+        """
+        Write the state file. Caller must hold the lock.
+        :param force: False to skip the save if the state was saved within CHECKPOINT_SAVE_INTERVAL
+        :return:
+        """
+        if not force and time.time() - self._saved < CHECKPOINT_SAVE_INTERVAL:
+            return  # The in-memory state stays authoritative for retries within this job
+        self._saved = time.time()
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        temp_state_file = self._state_file + '.tmp'
+        with open(temp_state_file, 'w') as f:
+            f.write(json.dumps({"files": self.files, "saved": time.time()}))
+        os.rename(temp_state_file, self._state_file)  # Atomic replace, a crash never leaves a partial state file
+
+    def local_path(self, remote_path):
+        """
+        Local file holding the bytes retrieved so far for remote_path
+        :param remote_path: endpoint file path
+        :return: local file path, or None if the file was never started
+        """
+        with self._lock:
+            entry = self.files.get(remote_path)
+        return None if entry is None else os.path.join(self.directory, entry["local"])
+
+    def matches(self, remote_path, listing):
+        """
+        Whether the checkpoint for remote_path is still valid for the file currently on the endpoint
+        :param remote_path: endpoint file path
+        :param listing: session.list_directory() entry for remote_path
+        :return: boolean
+        """
+        entry = self.files.get(remote_path)
+        return entry is not None and entry["size"] == listing['size'] and entry["modified"] == listing.get('last_write_time')
+
+    def start(self, remote_path, listing):
+        """
+        Checkpoint entry for remote_path, restarted from byte zero if the endpoint file changed since it was checkpointed
+        :param remote_path: endpoint file path
+        :param listing: session.list_directory() entry for remote_path
+        :return: checkpoint entry dict
+        """
+        with self._lock:
+            if not self.matches(remote_path, listing):
+                local = self.files[remote_path]["local"] if remote_path in self.files else '{0}.part'.format(len(self.files))
+                self.files[remote_path] = {"local": local, "size": listing['size'], "modified": listing.get('last_write_time'), "received": 0, "complete": False}
+                self._save(force=False)  # Nothing retrieved yet, losing this entry only restarts the file
+            return self.files[remote_path]
+
+    def advance(self, remote_path, received, complete=False):
+        """
+        Record bytes of remote_path safely written to its local file
+        :param remote_path: endpoint file path
+        :param received: number of bytes written and flushed
+        :param complete: True once the whole file was received
+        :return:
+        """
+        with self._lock:
+            self.files[remote_path]["received"] = received
+            self.files[remote_path]["complete"] = complete
+            self._save(force=not complete)  # Ranges of large files are always saved, completions are batched
+
+    def save(self):
+        """
+        Write any batched completions to the state file
+        :return:
+        """
+        with self._lock:
+            if self.files:
+                self._save()
+
+    def is_complete(self, remote_path):
+        return self.files.get(remote_path, {}).get("complete", False)
+
+    def received_bytes(self):
+        """
+        Bytes already retrieved across every file in the checkpoint
+        :return: int
+        """
+        with self._lock:
+            return sum(entry["received"] for entry in self.files.values())
+
+    def clear(self):
+        """
+        Remove the checkpoint and every retrieved file it holds
+        :return:
+        """
+        with self._lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.files = {}
+
+
+def _queue_command(session, timeout):
+    """
+    Count a get file command as queued on the session
+    :param session: established live response session
+    :param timeout: seconds the command itself may take
+    :return: (command, seconds to wait for the command, including the timeouts of the commands queued ahead of it)
+    """
+    command = object()
+    with _session_commands_lock:
+        commands = _session_commands.setdefault(session.session_id, {"queued": {}, "completed": 0})
+        wait = timeout + sum(commands["queued"].values())
+        commands["queued"][command] = timeout
+    return command, wait
+
+
+def _complete_command(session, command, queued):
+    """
+    The command is no longer queued on the session
+    :param session: established live response session
+    :param command: command from _queue_command
+    :param queued: time the command was queued
+    :return: time the sensor started running the command, once the commands queued ahead of it completed
+    """
+    with _session_commands_lock:
+        commands = _session_commands[session.session_id]
+        del commands["queued"][command]
+        started = max(queued, commands["completed"])
+        commands["completed"] = time.time()
+        if not commands["queued"]:
+            del _session_commands[session.session_id]
+    return started
+
+
+def _cblr_base(session):
+    """
+    Live response API base URL of a session
+    :param session: established live response session
+    :return: URL path, None if the session does not expose it
+    """
+    return getattr(session, 'cblr_base', None) or getattr(session, '_cblr_base', None)  # Attribute name differs between cbapi versions
+
+
+def supports_file_ranges(session):
+    """
+    Whether the session exposes the cbapi internals get_file_range relies on, they are not part of the public cbapi API
+    :param session: established live response session
+    :return: boolean
+    """
+    return all(hasattr(session, name) for name in ('_lr_post_command', '_poll_command', '_cb')) and _cblr_base(session) is not None
+
+
+def get_file_range(session, remote_path, offset, count, timeout=None):
+    """
+    Retrieve part of a file from the endpoint using the live response get file command's offset and get_count
+    :param session: established live response session
+    :param remote_path: endpoint file path
+    :param offset: first byte to retrieve
+    :param count: number of bytes to retrieve
+    :param timeout: seconds to wait for the sensor to upload the range to the CB server
+    :return: file-like raw stream of the range, close it when done
+    :raises ApiError if the installed cbapi does not support it, or the CB server did not return the range
+    """
+    if not supports_file_ranges(session):
+        raise ApiError('The installed cbapi does not support ranged get file commands')
+
+    data = {"name": "get file", "object": remote_path, "offset": offset, "get_count": count}
+    resp = session._lr_post_command(data)
+    if getattr(resp, 'status_code', 200) != 200:
+        raise ApiError('Get file command for ' + remote_path + ' failed with HTTP status ' + str(resp.status_code))
+    resp = resp.json()
+    session._poll_command(resp.get('id'), timeout=timeout)
+    response = session._cb.session.get('{cblr_base}/session/{0}/file/{1}/content'.format(session.session_id, resp.get('file_id'), cblr_base=_cblr_base(session)), stream=True)
+    if response.status_code != 200:  # Never write an error body into the retrieved file
+        response.close()
+        raise ApiError('Retrieving ' + remote_path + ' at byte ' + str(offset) + ' failed with HTTP status ' + str(response.status_code))
+    response.raw.decode_content = True
+    return response.raw
+
+
+def resumable_get(session, checkpoint, remote_path, listing=None):
+    """
+    Retrieve a file from the endpoint in RESUME_CHUNK_SIZE ranges, checkpointing after every range
+    so a retry after a TimeoutError continues from the last completed range instead of byte zero
+    :param session: established live response session
+    :param checkpoint: TransferCheckpoint of the job
+    :param remote_path: endpoint file path
+    :param listing: session.list_directory() entry for remote_path, listed if not provided
+    :return: local file path holding the complete file
+    """
+    if listing is None:
+        listing = session.list_directory(remote_path)[0]
+    entry = checkpoint.start(remote_path, listing)
+    local_file = checkpoint.local_path(remote_path)
+    if entry["complete"] and os.path.exists(local_file):
+        return local_file
+
+    ranged = supports_file_ranges(session)  # Without ranges the file is retrieved whole, and a retry starts over
+    received = entry["received"] if os.path.exists(local_file) and ranged else 0
+    if received:
+        log.info('[INFO] Resuming ' + remote_path + ' at byte ' + str(received) + ' of ' + str(entry["size"]))
+
+    with open(local_file, 'r+b' if os.path.exists(local_file) else 'wb') as f:
+        f.truncate(received)  # Drop bytes written after the last checkpoint
+        f.seek(received)
+        while received < entry["size"]:
+            count = min(RESUME_CHUNK_SIZE, entry["size"] - received) if ranged else entry["size"]
+            started = time.time()
+            command, timeout = _queue_command(session, transfer_rate.timeout(session.sensor_id, count))  # Sized from the sensor's learned transfer rate, plus the commands queued ahead on the session
+            with phase_metrics.phase(phase_metrics.TRANSFER) as measured:
+                try:
+                    raw = get_file_range(session, remote_path, received, count, timeout) if ranged else session.get_raw_file(remote_path, timeout=timeout)
+                finally:
+                    started = _complete_command(session, command, started)  # Time spent queued is not transfer time
+                try:
+                    shutil.copyfileobj(raw, f, CHUNK_SIZE)
+                finally:
+                    raw.close()
+                measured.bytes = f.tell() - received
+            transfer_rate.observe(session.sensor_id, f.tell() - received, time.time() - started)
+            f.flush()
+            os.fsync(f.fileno())
+            if f.tell() <= received:
+                raise IOError('Sensor returned no data for ' + remote_path + ' at byte ' + str(received))
+            received = f.tell()
+            checkpoint.advance(remote_path, received)
+            if not ranged:  # The whole file was retrieved, as it is now
+                break
+
+    checkpoint.advance(remote_path, received, True)
+    return local_file
+
+
+def retrieve_files(session, checkpoint, files, max_parallel=MAX_PARALLEL_TRANSFERS):
+    """
+    Retrieve several files from the endpoint with resumable_get, running up to max_parallel transfers at once on the session
+    :param session: established live response session
+    :param checkpoint: TransferCheckpoint of the job
+    :param files: list of [remote path, session.list_directory() entry] pairs
+    :param max_parallel: maximum number of transfers running at once
+    :return: list of local file paths in the same order as files
+    :raises the first TimeoutError encountered, else the first other error, once the running transfers stopped
+    """
+    pending = queue.Queue()
+    for index, (remote_path, listing) in enumerate(files):
+        pending.put((index, remote_path, listing))
+    local_files = [None] * len(files)
+    errors = []
+
+    def transfer_worker():
+        while not errors:  # Stop taking new files once a transfer failed
+            try: index, remote_path, listing = pending.get_nowait()
+            except queue.Empty: return
+            try: local_files[index] = resumable_get(session, checkpoint, remote_path, listing)
+            except Exception as err:
+                errors.append(err)
+                return
+
+    workers = [threading.Thread(target=transfer_worker, name='cb-transfer') for _ in range(min(max(1, max_parallel), len(files)))]
+    with phase_metrics.phase(phase_metrics.TRANSFER) as measured:  # The workers run outside the job's thread, time the batch as one transfer
+        received = checkpoint.received_bytes()
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join()
+        measured.bytes = checkpoint.received_bytes() - received
+    checkpoint.save()
+
+    if errors:
+        raise next((err for err in errors if isinstance(err, TimeoutError)), errors[0])  # A TimeoutError sends the job down its retry path
+    return local_files
+
+
+def reclaim_stale_checkpoints(checkpoint_directory=CHECKPOINT_DIRECTORY, keep=()):
+    """
+    Remove checkpoints untouched for longer than CHECKPOINT_TTL, ie those of jobs that were abandoned
+    :param checkpoint_directory: directory holding the checkpoints
+    :param keep: checkpoint keys kept whatever their age, ie those of parked jobs
+    :return: list of removed checkpoint directory names
+    """
+    removed = []
+    if not os.path.exists(checkpoint_directory):
+        return removed
+    for name in os.listdir(checkpoint_directory):
+        if name in keep:
+            continue
+        directory = os.path.join(checkpoint_directory, name)
+        try: age = time.time() - os.path.getmtime(os.path.join(directory, 'state.json'))
+        except OSError: age = time.time() - os.path.getmtime(directory)
+        if age > CHECKPOINT_TTL:
+            shutil.rmtree(directory, ignore_errors=True)
+            removed.append(name)
+    return removed
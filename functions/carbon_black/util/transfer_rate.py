@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+# This utility learns the file transfer rate of each Carbon Black sensor to size timeouts and pick delivery.
+# File: transfer_rate.py
+# Date: 10/18/2026
+# Author: Jared F
+
+"""Per-sensor transfer rate model"""
+#   Usage from a Carbon Black function:
+#       custom_timeout = transfer_rate.timeout(sensor.id, file_size)  # Replaces int((file_size / TRANSFER_RATE) + 120)
+#       if transfer_rate.deliver_as_attachment(os.stat(temp_zip.name).st_size, MAX_UPLOAD_SIZE):
+#           with transfer_rate.measure(transfer_rate.RESILIENT, os.stat(temp_zip.name).st_size):
+#               self.rest_client().post_attachment(...)
+#   Each completed transfer updates an exponentially weighted moving average (EWMA) of the sensor's throughput,
+#   the averages are stored in RATES_FILE so they carry over between runs and resilient_circuits restarts.
+
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)  # Establish logging
+
+RATES_FILE = '/home/integrations/.resilient/cb_transfer_rates.json'  # Learned transfer rates, kept across runs
+DEFAULT_RATE = 225000  # Bytes per second, the expected minimum file transfer rate via Carbon Black for sensors without observations
+MIN_RATE = 20000  # Bytes per second, learned rates are never trusted below this
+SMOOTHING = 0.3  # Weight of the newest observation in the EWMA
+SAFETY_FACTOR = 2  # Timeouts allow a transfer to run this many times slower than the learned rate
+TIMEOUT_PADDING = 120  # Seconds added to every timeout for command setup and good measure
+MIN_SAMPLE_SIZE = 256*1024  # Bytes, smaller transfers are dominated by command latency and are not observed
+MAX_ATTACHMENT_SECONDS = 600  # Expected seconds an attachment upload may take before delivery reverts to the network share
+RESILIENT = 'resilient'  # Key of the Resilient attachment upload rate
+
+
+class TransferRateModel(object):
+    # Singleton
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self, rates_file=RATES_FILE):
+        self.rates_file = rates_file
+        self._lock = threading.Lock()
+        self._rates = self._load()  # key -> {"rate": bytes per second EWMA, "samples": int, "updated": epoch seconds}
+
+    @staticmethod
+    def get_model():
+        with TransferRateModel.__instance_lock:
+            if TransferRateModel.__instance is None:
+                TransferRateModel.__instance = TransferRateModel()
+        return TransferRateModel.__instance
+
+    def _load(self):
+        try:
+            with open(self.rates_file, 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save(self):
+        """
+        Write the learned rates. Caller must hold the lock.
+        :return:
+        """
+        try:
+            if not os.path.exists(os.path.dirname(self.rates_file)):
+                os.makedirs(os.path.dirname(self.rates_file))
+            temp_rates_file = self.rates_file + '.' + str(os.getpid())
+            with open(temp_rates_file, 'w') as f:
+                f.write(json.dumps(self._rates))
+            os.rename(temp_rates_file, self.rates_file)  # Atomic replace, readers never see partial rates
+        except (IOError, OSError) as err:
+            log.error('[ERROR] Could not save transfer rates: ' + str(err))
+
+    def estimate(self, key):
+        """
+        Learned transfer rate
+        :param key: CB sensor ID, or RESILIENT
+        :return: bytes per second, or None if nothing was observed yet
+        """
+        with self._lock:
+            entry = self._rates.get(str(key))
+        return None if entry is None else entry["rate"]
+
+    def expected_minimum_rate(self, key):
+        """
+        Slowest rate a healthy transfer is expected to reach, used to size timeouts
+        :param key: CB sensor ID, or RESILIENT
+        :return: bytes per second
+        """
+        rate = self.estimate(key)
+        if rate is None:
+            return DEFAULT_RATE
+        return max(MIN_RATE, rate / SAFETY_FACTOR)
+
+    def timeout(self, key, size):
+        """
+        Seconds to allow for a transfer of size bytes
+        :param key: CB sensor ID
+        :param size: bytes to transfer
+        :return: int
+        """
+        return int((size / float(self.expected_minimum_rate(key))) + TIMEOUT_PADDING)
+
+    def observe(self, key, size, seconds):
+        """
+        Fold a completed transfer into the key's EWMA
+        :param key: CB sensor ID, or RESILIENT
+        :param size: bytes transferred
+        :param seconds: duration of the transfer
+        :return:
+        """
+        if size < MIN_SAMPLE_SIZE or seconds <= 0:
+            return
+        observed = size / float(seconds)
+        with self._lock:
+            entry = self._rates.get(str(key))
+            if entry is None:
+                entry = {"rate": observed, "samples": 0}
+            else:
+                entry["rate"] = SMOOTHING * observed + (1 - SMOOTHING) * entry["rate"]
+            entry["samples"] += 1
+            entry["updated"] = int(time.time())
+            self._rates[str(key)] = entry
+            self._save()
+
+    def deliver_as_attachment(self, size, max_upload_size):
+        """
+        Whether a file should be posted to the incident rather than dropped on the network share
+        :param size: bytes to deliver
+        :param max_upload_size: largest attachment allowed
+        :return: boolean
+        """
+        if size > max_upload_size:
+            return False
+        rate = self.estimate(RESILIENT)
+        return rate is None or size / float(rate) <= MAX_ATTACHMENT_SECONDS
+
+
+def estimate(key):
+    """
+    Learned transfer rate of the process-wide model
+    :param key: CB sensor ID, or RESILIENT
+    :return: bytes per second, or None
+    """
+    return TransferRateModel.get_model().estimate(key)
+
+
+def timeout(key, size):
+    """
+    Seconds to allow for a transfer of size bytes from a sensor
+    :param key: CB sensor ID
+    :param size: bytes to transfer
+    :return: int
+    """
+    return TransferRateModel.get_model().timeout(key, size)
+
+
+def observe(key, size, seconds):
+    """
+    Record a completed transfer in the process-wide model
+    :param key: CB sensor ID, or RESILIENT
+    :param size: bytes transferred
+    :param seconds: duration of the transfer
+    :return:
+    """
+    TransferRateModel.get_model().observe(key, size, seconds)
+
+
+def deliver_as_attachment(size, max_upload_size):
+    """
+    Whether a file should be posted to the incident rather than dropped on the network share
+    :param size: bytes to deliver
+    :param max_upload_size: largest attachment allowed
+    :return: boolean
+    """
+    return TransferRateModel.get_model().deliver_as_attachment(size, max_upload_size)
+
+
+@contextmanager
+def measure(key, size):
+    """
+    Observe the duration of the enclosed transfer, nothing is observed if it raises
+    :param key: CB sensor ID, or RESILIENT
+    :param size: bytes transferred
+    :return:
+    """
+    start = time.time()
+    yield
+    observe(key, size, time.time() - start)
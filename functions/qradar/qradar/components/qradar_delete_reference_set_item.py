@@ -45,7 +45,10 @@ class FunctionComponent(ResilientComponent):
                                          username=self.options.get("username", None),
                                          password=self.options.get("qradarpassword", None),
                                          token=self.options.get("qradartoken", None),
-                                         cafile=qradar_verify_cert)
+                                         cafile=qradar_verify_cert,
+                                         pool_size=self.options.get("http_pool_size", None),
+                                         connect_timeout=self.options.get("connect_timeout", None),
+                                         read_timeout=self.options.get("read_timeout", None))
 
             result = qradar_client.delete_ref_element(qradar_reference_set_name,
                                                    qradar_reference_set_item_value)
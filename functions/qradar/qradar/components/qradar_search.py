@@ -13,10 +13,10 @@ import tempfile
 import logging
 from resilient_circuits import ResilientComponent, function, handler, StatusMessage, FunctionResult, FunctionError
 from qradar.util.qradar_utils import QRadarClient
-from qradar.util import function_utils
 
 MAX_UPLOAD_SIZE = 50*1000000  # Maximum number of bytes of files to upload as an attachment before reverting to a network share drop, default = 50MB
 NET_SHARE_PATH = r'/mnt/cyber-sec-forensics/Resilient'  # Network share path accessible to Resilient Circuits
+MAX_RESULT_EVENTS = 10000  # Maximum number of events returned to the post-processor, every event still goes into the CSV, default = 10K
 
 
 class FunctionComponent(ResilientComponent):
@@ -38,6 +38,7 @@ class FunctionComponent(ResilientComponent):
         results = {}
         results["was_successful"] = False
         results["events"] = None
+        results["event_count"] = 0
 
         try:
             # Get the function parameters:
@@ -59,13 +60,15 @@ class FunctionComponent(ResilientComponent):
 
             log = logging.getLogger(__name__)
 
-            # qradar_verify_cert = False  # Add this in if SSL cert verification should be bypassed.
+            qradar_verify_cert = True
+            if qradar_config.get("verify_cert") == "false": qradar_verify_cert = False  # SSL cert verification can be bypassed in app.config
 
             if qradar_query_timeout_mins is None: qradar_query_timeout = float(86400)  # Default: 1 day
             else: qradar_query_timeout = float(qradar_query_timeout_mins*60)
 
             log.debug('[INFO] Connecting to QRadar API...')
-            qradar_client = QRadarClient(host=host, username=None, password=None, token=qradartoken, cafile=qradar_verify_cert)
+            qradar_client = QRadarClient(host=host, username=None, password=None, token=qradartoken, cafile=qradar_verify_cert,
+                                         pool_size=qradar_config.get("http_pool_size"), connect_timeout=qradar_config.get("connect_timeout"), read_timeout=qradar_config.get("read_timeout"))
             if qradar_client.verify_connect() is False:
                 yield StatusMessage('[FATAL ERROR] Unable to establish API connection to QRadar!')
                 yield FunctionResult(results)
@@ -74,37 +77,49 @@ class FunctionComponent(ResilientComponent):
 
             yield StatusMessage('[INFO] Running QRadar search query...')
             log.debug('QRadar search query: ' + qradar_query)
-            query_result = qradar_client.ariel_search(qradar_query, range_start=qradar_query_range_start, range_end=qradar_query_range_end, timeout=qradar_query_timeout, wf_bundle=wf_bundle)
+            query_pages = qradar_client.ariel_search_pages(qradar_query, range_start=qradar_query_range_start, range_end=qradar_query_range_end, timeout=qradar_query_timeout, wf_bundle=wf_bundle,
+                                                           fetch_concurrency=qradar_config.get("result_fetch_concurrency"), cache_ttl=qradar_config.get("search_cache_ttl"))
 
-            if query_result is None:
+            if query_pages is None:
                 yield StatusMessage('[INFO] Search canceled!')
+                yield FunctionResult(results)
+                return
 
-            else:
-                yield StatusMessage('[INFO] Search completed!')
-
-                results["was_successful"] = True
-                results["events"] = query_result['events']
+            yield StatusMessage('[INFO] Search completed! Retrieving matching events...')
+            events = []
 
             with tempfile.NamedTemporaryFile(delete=False) as temp_zip:  # Create temporary temp_zip for creating zip_file
                 try:
                     with zipfile.ZipFile(temp_zip, 'w') as zip_file:  # Establish zip_file from temporary temp_zip for packaging CSV into
-                        with tempfile.NamedTemporaryFile(delete=False) as temp_file:  # Create temp_file for CSV
+                        with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_file:  # Create temp_file for CSV, text mode for the csv module
                             try:
-                                if len(query_result['events']) == 0:
+                                csv_writer = csv.writer(temp_file)
+                                header = None
+                                for page in query_pages:  # One page of events is held in memory at a time, however many events matched
+                                    if header is None:
+                                        header = list(page[0].keys())
+                                        csv_writer.writerow(header)  # header row
+                                    for row in page:
+                                        csv_writer.writerow([row.get(column) for column in header])  # values row
+                                    results["event_count"] += len(page)
+                                    events.extend(page[:MAX_RESULT_EVENTS - len(events)])
+
+                                if results["event_count"] == 0:
                                     yield StatusMessage('[INFO] No matching events found.')
                                     temp_file.write('No matching events.')
                                 else:
-                                    yield StatusMessage('[INFO] ' + str(len(query_result['events'])) + ' matching events found.')
-                                    csv_writer = csv.writer(temp_file)
-                                    csv_writer.writerow(query_result['events'][0].keys())  # header row
-                                    for row in query_result['events']:
-                                        csv_writer.writerow(row.values())  # values row
+                                    yield StatusMessage('[INFO] ' + str(results["event_count"]) + ' matching events found.')
+                                    if results["event_count"] > len(events):
+                                        yield StatusMessage('[INFO] The first ' + str(len(events)) + ' events are returned to the post-processor, the CSV holds them all.')
                                 temp_file.close()
                                 zip_file.write(temp_file.name, 'QRadar_Search_Query_Results.csv', compress_type=zipfile.ZIP_DEFLATED)  # Write temp_file into zip_file
 
                             finally:
                                 os.unlink(temp_file.name)  # Delete temporary temp_file
 
+                    results["was_successful"] = True
+                    results["events"] = events
+
                     if os.stat(temp_zip.name).st_size <= MAX_UPLOAD_SIZE:
                         self.rest_client().post_attachment('/incidents/{0}/attachments'.format(incident_id), temp_zip.name, 'QRadar_Search_Query_Results{0}.zip'.format(''))  # Post temp_zip to incident
                         yield StatusMessage('[SUCCESS] Posted ZIP file of QRadar Search Query to the incident as an attachment!')
@@ -15,5 +15,13 @@ username=admin
 qradarpassword=changeme
 #Note, if both qradarpassword and qadartoken are given, password will be used
 qradartoken=changeme
+#Optional, keep-alive connections kept open to QRadar and connect/read timeouts in seconds
+#http_pool_size=10
+#connect_timeout=10
+#read_timeout=300
+#Optional, Range windows of an Ariel search result fetched at once, keep at or below http_pool_size
+#result_fetch_concurrency=4
+#Optional, seconds an Ariel search with a fixed START/STOP window is reused by runs of the same query, 0 starts a new search every run
+#search_cache_ttl=300
 '''
     return config_data
\ No newline at end of file
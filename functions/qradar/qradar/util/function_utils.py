@@ -3,6 +3,7 @@
 # (c) Copyright IBM Corp. 2018. All Rights Reserved.
 #
 # Util functions
+import re
 import unicodedata
 
 
@@ -21,3 +22,27 @@ def fix_dict_value(events):
                     event[key] = str(unicodedata.normalize("NFKD", event[key].decode('utf-8', 'ignore')))
 
     return events
+
+
+def normalize_aql(query):
+    """
+    Normalize an AQL query so the same query written with different whitespace compares equal.
+    Runs of whitespace outside quoted literals become a single space, a trailing ; is dropped.
+    :param query: AQL query string
+    :return: normalized query string
+    """
+    parts = re.split(r"""('(?:[^']|'')*'|"[^"]*")""", query.strip().rstrip(';').strip())
+    return "".join(part if i % 2 else re.sub(r"\s+", " ", part) for i, part in enumerate(parts))
+
+
+def has_fixed_time_window(query):
+    """
+    Whether an AQL query searches a fixed time window, START and STOP given as a date literal or epoch milliseconds.
+    A query with LAST n, relative START/STOP expressions or no time clause searches a window that moves with the clock.
+    :param query: AQL query string
+    :return: boolean
+    """
+    parts = re.split(r"""('(?:[^']|'')*'|"[^"]*")""", normalize_aql(query))
+    query = "".join(part[0] + "?" + part[0] if i % 2 else part for i, part in enumerate(parts))  # Keywords inside literals and quoted names do not count
+    return all(re.search(r"\b" + keyword + r" ('\?'|\d+)(\s|$)", query, re.IGNORECASE) for keyword in ("START", "STOP")) \
+        and not re.search(r"\bLAST \d", query, re.IGNORECASE)
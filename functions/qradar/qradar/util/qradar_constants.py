@@ -16,3 +16,21 @@ SEARCH_STATUS_WAIT = "WAIT"
 SEARCH_STATUS_SORTING = "SORTING"
 SEARCH_STATUS_CANCELED = "CANCELED"
 SEARCH_STATUS_ERROR = "ERROR"
+
+# Pooled HTTP session to the QRadar console, app.config http_pool_size, connect_timeout and read_timeout override these
+HTTP_POOL_SIZE = 10  # Keep-alive connections kept open to the console
+CONNECT_TIMEOUT = 10  # Seconds to wait for a connection to the console
+READ_TIMEOUT = 300  # Seconds to wait for the console to send data, large result ranges are slow to start
+
+RESULT_PAGE_SIZE = 10000  # Events fetched per Range window when paging through Ariel search results
+RESULT_FETCH_CONCURRENCY = 4  # Range windows fetched at once from a completed search, 1 fetches them one after another
+
+# Adaptive Ariel search polling
+POLL_INTERVAL_MIN = 0.5  # Seconds before the first status poll, short searches are picked up right away
+POLL_INTERVAL_MAX = 30  # Seconds the wait between status polls backs off to for long running searches
+POLL_BACKOFF = 1.5  # Factor the wait between status polls grows by each poll
+WORKFLOW_CHECK_INTERVAL = 15  # Seconds between checks of whether the Resilient workflow was terminated
+
+# Ariel search cache, app.config search_cache_ttl overrides the TTL
+SEARCH_CACHE_TTL = 300  # Seconds a search with a fixed START/STOP window is reused by runs of the same AQL, 0 starts a new search every run
+SEARCH_CACHE_MAX_ENTRIES = 100  # Searches kept for reuse, the least recently used is evicted past this
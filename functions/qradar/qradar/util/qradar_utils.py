@@ -6,8 +6,12 @@
 #
 import requests
 import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 import base64
 import logging
+from requests.adapters import HTTPAdapter
 import qradar.util.qradar_constants as qradar_constants
 import qradar.util.function_utils as function_utils
 from resilient_lib import get_workflow_status
@@ -58,6 +62,7 @@ class SearchFailure(Exception):
 class AuthInfo(object):
     # Singleton
     __instance = None
+    __instance_lock = threading.Lock()
 
     def __init__(self):
         self.headers = {}
@@ -65,15 +70,20 @@ class AuthInfo(object):
         self.qradar_token = None
         self.api_url = None
         self.cafile = True
+        self.session = None  # Pooled keep-alive session shared by every call to the console
+        self.pool_size = None
+        self.timeout = (qradar_constants.CONNECT_TIMEOUT, qradar_constants.READ_TIMEOUT)
+        self._lock = threading.Lock()
         pass
 
     @staticmethod
     def get_authInfo():
-        if AuthInfo.__instance is None:
-            AuthInfo.__instance = AuthInfo()
+        with AuthInfo.__instance_lock:
+            if AuthInfo.__instance is None:
+                AuthInfo.__instance = AuthInfo()
         return AuthInfo.__instance
 
-    def create(self, host, username=None, password=None, token=None, cafile=None):
+    def create(self, host, username=None, password=None, token=None, cafile=None, pool_size=None, connect_timeout=None, read_timeout=None):
         """
         Create headers used for REST Api calls
         :param host: qradar host
@@ -81,27 +91,195 @@ class AuthInfo(object):
         :param password: qradar password
         :param token: Use token or username/password to auth
         :param cafile:
+        :param pool_size: keep-alive connections to keep open to the console, default qradar_constants.HTTP_POOL_SIZE
+        :param connect_timeout: seconds to wait for a connection, default qradar_constants.CONNECT_TIMEOUT
+        :param read_timeout: seconds to wait for the console to send data, default qradar_constants.READ_TIMEOUT
         :return:
         """
-        self.headers = {'Accept': 'application/json'}
+        headers = {'Accept': 'application/json'}
         if username and password:
             self.qradar_auth = base64.b64encode((username + ':' + password).encode('ascii'))
-            self.headers['Authorization'] = b"Basic " + self.qradar_auth
+            headers['Authorization'] = b"Basic " + self.qradar_auth
         elif token:
             self.qradar_token = token
-            self.headers["SEC"] = self.qradar_token
+            headers["SEC"] = self.qradar_token
+        self.headers = headers
 
         self.api_url = "https://{}/api/".format(host)
         self.cafile = cafile
+        self.timeout = (float(connect_timeout or qradar_constants.CONNECT_TIMEOUT), float(read_timeout or qradar_constants.READ_TIMEOUT))
+        self.create_session(int(pool_size or qradar_constants.HTTP_POOL_SIZE))
+
+    def create_session(self, pool_size):
+        """
+        Create the pooled session, kept across calls so polls reuse open connections instead of a new TCP and TLS handshake each
+        :param pool_size: keep-alive connections to keep open to the console
+        :return:
+        """
+        with self._lock:
+            if self.session is not None and self.pool_size == pool_size:
+                return  # Headers, verify and timeout are passed per request, the open connections stay valid
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)  # Threads past pool_size get a connection that is not kept
+            session.mount("https://", adapter)
+            self.session = session  # A replaced session is not closed, requests of other threads may still be using it
+            self.pool_size = pool_size
+
+
+class SearchCache(object):
+    """
+    Ariel searches kept for reuse by later runs of the same normalized AQL, so a repeat search does not start a new
+    search job on the console. Only search_ids are kept, the results stay on the console. Only queries with a fixed
+    START/STOP window are kept, a relative window (LAST n MINUTES) moves on and a reused search would miss newer events.
+    """
+    # Singleton
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self, max_entries=qradar_constants.SEARCH_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._searches = OrderedDict()  # normalized query -> (search_id, time started), least recently used first
+        self._users = {}  # search_id -> number of runs waiting on the search
+        self._lock = threading.Lock()
+        self._start_locks = {}  # normalized query -> [lock, runs holding or waiting on it]
+
+    @staticmethod
+    def get_cache():
+        with SearchCache.__instance_lock:
+            if SearchCache.__instance is None:
+                SearchCache.__instance = SearchCache()
+        return SearchCache.__instance
+
+    @contextmanager
+    def start_lock(self, query):
+        """
+        Hold while a query's search is looked up or started, so concurrent runs of the query share one search,
+        runs of other queries start theirs meanwhile
+        :param query: normalized query string
+        :return: context manager
+        """
+        with self._lock:
+            entry = self._start_locks.setdefault(query, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._start_locks[query]
+
+    def acquire(self, query, ttl):
+        """
+        Get the search of a query started within ttl seconds, and count this run as waiting on it
+        :param query: normalized query string
+        :param ttl: seconds a search is reused
+        :return: search_id, None if there is none to reuse
+        """
+        with self._lock:
+            entry = self._searches.get(query)
+            if entry is None:
+                return None
+            if time.time() - entry[1] > ttl:
+                del self._searches[query]
+                return None
+            self._searches[query] = self._searches.pop(query)  # Most recently used
+            self._users[entry[0]] = self._users.get(entry[0], 0) + 1
+            return entry[0]
+
+    def add(self, query, search_id):
+        """
+        Keep a new search of a query for reuse, and count this run as waiting on it
+        :param query: normalized query string
+        :param search_id: search_id returned from QRadar
+        :return:
+        """
+        with self._lock:
+            self._searches.pop(query, None)
+            self._searches[query] = (search_id, time.time())
+            while len(self._searches) > self.max_entries:
+                self._searches.popitem(last=False)  # Evict the least recently used
+            self._users[search_id] = self._users.get(search_id, 0) + 1
+
+    def discard(self, query, search_id):
+        """
+        Stop reusing a search that QRadar no longer has, or that failed
+        :param query: normalized query string
+        :param search_id: search_id returned from QRadar
+        :return:
+        """
+        with self._lock:
+            if self._searches.get(query, (None,))[0] == search_id:
+                del self._searches[query]
+
+    def release(self, search_id):
+        """
+        This run no longer waits on the search
+        :param search_id: search_id returned from QRadar
+        :return: number of other runs still waiting on the search
+        """
+        with self._lock:
+            users = self._users.get(search_id, 1) - 1
+            if users > 0:
+                self._users[search_id] = users
+            else:
+                self._users.pop(search_id, None)
+            return max(users, 0)
+
+    def waiting(self, search_id):
+        """
+        Number of runs waiting on a search
+        :param search_id: search_id returned from QRadar
+        :return: int
+        """
+        with self._lock:
+            return self._users.get(search_id, 0)
+
+
+class PageFetch(threading.Thread):
+    """ Fetches one Range window of a search result on its own thread """
+    def __init__(self, ariel_search, search_id, start, end):
+        super(PageFetch, self).__init__(name="qradar-page-{}-{}".format(start, end))
+        self.daemon = True
+        self.ariel_search = ariel_search
+        self.search_id = search_id
+        self.start_index = start
+        self.end_index = end
+        self.events = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.events = self.ariel_search.get_result_page(self.search_id, self.start_index, self.end_index)
+        except Exception as e:
+            self.error = e
+
+    def result(self):
+        """
+        Wait for the window
+        :return: list of events, empty if the window starts past the last event
+        :raises SearchFailure
+        """
+        self.join()
+        if self.error is not None:
+            raise self.error
+        return self.events
 
 
 class ArielSearch(object):
 
-    def __init__(self, timeout=600, polling_period=5):
+    def __init__(self, timeout=600, polling_period=qradar_constants.POLL_INTERVAL_MAX, page_size=qradar_constants.RESULT_PAGE_SIZE,
+                 fetch_concurrency=qradar_constants.RESULT_FETCH_CONCURRENCY):
         self.range_start = 0
         self.range_end = 50
         self.search_timeout = timeout
-        self.polling_period = polling_period
+        self.polling_period = polling_period  # Longest wait between status polls
+        self.progress = None  # Percent complete of the running search, as reported by QRadar
+        self.page_size = page_size
+        self.fetch_concurrency = fetch_concurrency
+        self.record_count = None  # Number of events of the completed search, as reported by QRadar
+        self.cache_ttl = qradar_constants.SEARCH_CACHE_TTL  # Seconds a search is reused by runs of the same query, 0 disables
 
     def set_range_start(self, start):
         """
@@ -126,6 +304,22 @@ class ArielSearch(object):
         """
         self.search_timeout = timeout
 
+    def set_cache_ttl(self, cache_ttl):
+        """
+        Set how long a search is reused by runs of the same query
+        :param cache_ttl: seconds, 0 starts a new search every run
+        :return:
+        """
+        self.cache_ttl = max(0, float(cache_ttl))
+
+    def set_fetch_concurrency(self, fetch_concurrency):
+        """
+        Set the number of Range windows fetched at once
+        :param fetch_concurrency: int, 1 fetches them one after another
+        :return:
+        """
+        self.fetch_concurrency = max(1, int(fetch_concurrency))
+
     def get_search_id(self, query):
         """
         Get the search if associated with the search using query
@@ -140,7 +334,7 @@ class ArielSearch(object):
 
         search_id = ""
         try:
-            response = requests.Session().post(url=url, headers=auth_info.headers, data=data, verify=auth_info.cafile)
+            response = auth_info.session.post(url=url, headers=auth_info.headers, data=data, verify=auth_info.cafile, timeout=auth_info.timeout)
             json = response.json()
             if "search_id" in json:
                 search_id = json["search_id"]
@@ -158,28 +352,99 @@ class ArielSearch(object):
         :return: dict with events
         :raises SearchFailure
         """
+        events = []
+        for page in self.iter_search_result(search_id):
+            events.extend(page)
+
+        return {"events": events}
+
+    def iter_search_result(self, search_id):
+        """
+        Page through the search result associated with search_id, one Range window of page_size events at a time,
+        so only a single page is held in memory however many events the search returned
+        :param search_id:
+        :return: generator of lists of events, one list per page
+        :raises SearchFailure
+        """
+        if self.fetch_concurrency > 1 and self.record_count is not None:
+            for events in self.iter_search_result_parallel(search_id):
+                yield events
+            return
+
+        start = self.range_start
+        while start <= self.range_end:
+            end = min(start + self.page_size - 1, self.range_end)
+            events = self.get_result_page(search_id, start, end)
+            if not events:
+                if self.record_count is not None and start < self.record_count:  # QRadar reported more events, never return a truncated result
+                    LOG.error('No events returned for items={}-{} of search_id {} with record_count {}'.format(start, end, search_id, self.record_count))
+                    raise SearchFailure(search_id, None)
+                break
+            yield events
+            if len(events) < end - start + 1:  # Last page of the result
+                break
+            start = end + 1
+
+    def iter_search_result_parallel(self, search_id):
+        """
+        Page through the search result associated with search_id, fetching up to fetch_concurrency Range windows at once
+        and yielding them in order, so a large result is limited by bandwidth instead of the latency of each request.
+        At most fetch_concurrency pages are held in memory. Needs the record_count of the completed search.
+        :param search_id:
+        :return: generator of lists of events, one list per page
+        :raises SearchFailure
+        """
+        last = min(self.range_end, self.record_count - 1)
+        windows = [(start, min(start + self.page_size - 1, last)) for start in range(self.range_start, last + 1, self.page_size)]
+
+        fetches = []
+        while windows or fetches:
+            while windows and len(fetches) < self.fetch_concurrency:
+                fetch = PageFetch(self, search_id, *windows.pop(0))
+                fetch.start()
+                fetches.append(fetch)
+
+            fetch = fetches.pop(0)
+            events = fetch.result()
+            if not events:  # Every window is within record_count, a missing one would truncate the result. Windows still in flight finish on their own threads
+                LOG.error('No events returned for items={}-{} of search_id {} with record_count {}'.format(fetch.start_index, fetch.end_index, search_id, self.record_count))
+                raise SearchFailure(search_id, None)
+            yield events
+
+    def get_result_page(self, search_id, start, end):
+        """
+        Get one Range window of the search result associated with search_id
+        :param search_id:
+        :param start: index of the first event
+        :param end: index of the last event
+        :return: list of events, empty if the window starts past the last event
+        :raises SearchFailure if QRadar did not return the window
+        """
         auth_info = AuthInfo.get_authInfo()
         url = auth_info.api_url + qradar_constants.ARIEL_SEARCHES_RESULT.format(search_id)
 
         headers = auth_info.headers.copy()
         # if the # of returned items is big, this call will take a long time!
         # Need to use Range to limit the #.
-        headers[b"Range"] = "items={}-{}".format(str(self.range_start), str(self.range_end))
+        headers[b"Range"] = "items={}-{}".format(str(start), str(end))
 
         response = None
         try:
-            response = requests.Session().get(url=url, headers=headers, verify=auth_info.cafile)
+            response = auth_info.session.get(url=url, headers=headers, verify=auth_info.cafile, timeout=auth_info.timeout)
         except Exception as e:
             LOG.error(str(e))
             raise SearchFailure(search_id, None)
 
-        ret = {}
-        if response.status_code == 200:
-            events = response.json()["events"]
-            events = function_utils.fix_dict_value(events)
-            ret = {"events": events}
+        if response.status_code == 416:  # Range Not Satisfiable, the window starts past the last event
+            return []
+        if response.status_code != 200:  # A transient error must fail the search rather than end its result early
+            LOG.error('Getting items={}-{} of search_id {} failed with status code {}'.format(start, end, search_id, response.status_code))
+            raise SearchFailure(search_id, response.status_code)
 
-        return ret
+        events = response.json()["events"]
+        events = function_utils.fix_dict_value(events)
+
+        return events
 
     def check_status(self, search_id):
         """
@@ -192,11 +457,13 @@ class ArielSearch(object):
         url = "{}{}/{}".format(auth_info.api_url, qradar_constants.ARIEL_SEARCHES, search_id)
         status = None
         try:
-            response = requests.Session().get(url=url, headers=auth_info.headers, verify=auth_info.cafile)
+            response = auth_info.session.get(url=url, headers=auth_info.headers, verify=auth_info.cafile, timeout=auth_info.timeout)
             json_dict = response.json()
+            self.progress = json_dict.get("progress")
             if "status" in json_dict:
                 if json_dict["status"] == qradar_constants.SEARCH_STATUS_COMPLETED:
                     status = qradar_constants.SEARCH_STATUS_COMPLETED
+                    self.record_count = json_dict.get("record_count")  # Lets the result be fetched in parallel windows
                 elif json_dict["status"] == qradar_constants.SEARCH_STATUS_WAIT \
                     or json_dict["status"] == qradar_constants.SEARCH_STATUS_SORTING \
                         or json_dict["status"] == qradar_constants.SEARCH_STATUS_EXECUTE:
@@ -210,6 +477,83 @@ class ArielSearch(object):
 
         return status
 
+    def reuse_search_id(self, query):
+        """
+        Get the search_id of a running or completed search of the same query from the search cache, if QRadar still has it
+        :param query: input query string
+        :return: search_id, None if there is no search to reuse
+        """
+        cache = SearchCache.get_cache()
+        normalized_query = function_utils.normalize_aql(query)
+        search_id = cache.acquire(normalized_query, self.cache_ttl)
+        if search_id is None:
+            return None
+
+        try:
+            status = self.check_status(search_id)
+        except SearchFailure:  # Canceled, failed, or already removed by QRadar
+            status = None
+        if status is None:
+            cache.discard(normalized_query, search_id)
+            cache.release(search_id)
+            return None
+
+        LOG.info('Reusing Ariel search_id ' + str(search_id) + ' of the same query')
+        return search_id
+
+    def start_search(self, query):
+        """
+        Reuse a search of the same query, or start a new one and keep it for reuse. Only queries with a fixed
+        START/STOP window are reused, a query with a relative window always starts a new search.
+        :param query: input query string
+        :return: search_id returned from QRadar
+        :raises SearchJobFailure
+        """
+        if not self.cache_ttl or not function_utils.has_fixed_time_window(query):
+            return self.get_search_id(query)
+
+        cache = SearchCache.get_cache()
+        normalized_query = function_utils.normalize_aql(query)
+        with cache.start_lock(normalized_query):
+            search_id = self.reuse_search_id(query)
+            if search_id is None:
+                search_id = self.get_search_id(query)
+                if search_id:
+                    cache.add(normalized_query, search_id)
+        return search_id
+
+    def release_search(self, search_id):
+        """
+        This run no longer waits on the search, runs of the same query may cancel it from now on
+        :param search_id: search_id returned from QRadar
+        :return:
+        """
+        if search_id and self.cache_ttl:
+            SearchCache.get_cache().release(search_id)
+
+    def stop_search(self, search_id):
+        """
+        Cancel a search this run gives up on, unless other runs of the same query are still waiting on it
+        :param search_id
+        :raises SearchJobFailure
+        """
+        if SearchCache.get_cache().waiting(search_id) <= 1:
+            self.cancel_search(search_id)
+
+    def next_poll_interval(self, interval, elapsed):
+        """
+        Wait before the next status poll: backs off by POLL_BACKOFF up to polling_period, but not past the
+        completion QRadar's reported progress predicts, so long searches are polled rarely and none is picked up late
+        :param interval: previous wait in seconds
+        :param elapsed: seconds the search has run
+        :return: seconds to wait
+        """
+        interval = min(interval * qradar_constants.POLL_BACKOFF, self.polling_period)
+        if self.progress and 0 < self.progress < 100:
+            remaining = elapsed * (100 - self.progress) / float(self.progress)  # Assumes the search progresses at the same rate
+            interval = min(interval, max(remaining, qradar_constants.POLL_INTERVAL_MIN))
+        return interval
+
     def cancel_search(self, search_id):
         """
         Cancels the search associated with search_id
@@ -220,7 +564,7 @@ class ArielSearch(object):
         url = "{}{}/{}".format(auth_info.api_url, qradar_constants.ARIEL_SEARCHES, search_id)
         data = {"status": "CANCELED"}
         try:
-            response = requests.Session().post(url=url, headers=auth_info.headers, data=data, verify=auth_info.cafile)
+            response = auth_info.session.post(url=url, headers=auth_info.headers, data=data, verify=auth_info.cafile, timeout=auth_info.timeout)
             json_dict = response.json()
 
             if len(json_dict) == 0 or response.status_code != 200:
@@ -230,28 +574,52 @@ class ArielSearch(object):
             LOG.error(str(e))
             raise SearchJobFailure("Search cancellation attempted, but failed due to an exception!")
 
-    def perform_search(self, query, wf_bundle):
+    def run_search(self, query, wf_bundle):
         """
-        Performs an ariel search from a provided AQL query string with workflow state in mind.
+        Runs an ariel search from a provided AQL query string to completion with workflow state in mind.
         :param query: query string to perform search
         :param wf_bundle: list containing two elements, the Resilient rest_client() and the Resilient workflow_id respectively
-        :return: result: search results, None returned if workflow is stopped prior to search completion
+        :return: search_id of the completed search, this run waits on it until release_search() once its result is fetched,
+                 None returned if workflow is stopped prior to search completion
         :raises SearchFailure or SearchJobFailure
         """
-        search_id = self.get_search_id(query)
+        search_id = self.start_search(query)
 
+        completed_search_id = None
+        try:
+            completed_search_id = self.wait_for_search(query, search_id, wf_bundle)
+            return completed_search_id
+        except (SearchFailure, SearchTimeout):
+            SearchCache.get_cache().discard(function_utils.normalize_aql(query), search_id)  # Later runs start a new search
+            raise
+        finally:
+            if completed_search_id is None:  # No result to fetch, this run no longer waits on the search
+                self.release_search(search_id)
+
+    def wait_for_search(self, query, search_id, wf_bundle):
+        """
+        Poll a started ariel search until it completes with workflow state in mind.
+        :param query: query string of the search
+        :param search_id: search_id returned from QRadar
+        :param wf_bundle: list containing two elements, the Resilient rest_client() and the Resilient workflow_id respectively
+        :return: search_id of the completed search, None returned if workflow is stopped prior to search completion
+        :raises SearchFailure or SearchJobFailure
+        """
         if search_id:
             start_time = time.time()  # store the start time
             done = False
+            interval = None  # Wait between status polls, adapts to the search's progress
+            workflow_checked = None  # When the workflow was last checked, on its own slower cadence than the polls
 
             LOG.info('Ariel search started under search_id: ' + str(search_id))
 
             while not done:
                 status = self.check_status(search_id)
-                if wf_bundle:
+                if wf_bundle and (workflow_checked is None or time.time() - workflow_checked >= qradar_constants.WORKFLOW_CHECK_INTERVAL):
+                    workflow_checked = time.time()
                     if (get_workflow_status(wf_bundle[0], wf_bundle[1])).is_terminated:
                         LOG.info('Workflow terminated. Canceling search...')
-                        self.cancel_search(search_id)
+                        self.stop_search(search_id)
                         return None
 
                 if status == qradar_constants.SEARCH_STATUS_COMPLETED:
@@ -266,22 +634,59 @@ class ArielSearch(object):
                     # time_out defaults to 10 minutes. If customer overrides it to 0, it will never timeout
                     if self.search_timeout != 0:
                         if time.time() - start_time > self.search_timeout:
-                            self.cancel_search(search_id)  # Cancel search on timeout
+                            self.stop_search(search_id)  # Cancel search on timeout
                             # We could return the search results instead of raising an exception, but they would be incomplete.
                             raise SearchTimeout(search_id, status)
-                    time.sleep(self.polling_period)  # polling_interval is defaulted to 5 sec
+                    if interval is None:
+                        interval = min(qradar_constants.POLL_INTERVAL_MIN, self.polling_period)
+                    else:
+                        interval = self.next_poll_interval(interval, time.time() - start_time)
+                    if self.search_timeout != 0:  # Poll once more right at the timeout rather than past it
+                        interval = min(interval, max(self.search_timeout - (time.time() - start_time), 0) + qradar_constants.POLL_INTERVAL_MIN)
+                    time.sleep(interval)
         else:
             LOG.error("search_id is None")
             raise SearchJobFailure(query)
 
-        result = self.get_search_result(search_id)
+        return search_id
+
+    def perform_search(self, query, wf_bundle):
+        """
+        Performs an ariel search from a provided AQL query string with workflow state in mind.
+        :param query: query string to perform search
+        :param wf_bundle: list containing two elements, the Resilient rest_client() and the Resilient workflow_id respectively
+        :return: result: search results, None returned if workflow is stopped prior to search completion
+        :raises SearchFailure or SearchJobFailure
+        """
+        search_id = self.run_search(query, wf_bundle)
+        if search_id is None:
+            return None
+
+        try:
+            result = self.get_search_result(search_id)
+        finally:
+            self.release_search(search_id)
 
         return result
 
+    def iter_search_pages(self, search_id):
+        """
+        Page through the result of a search run_search() completed, this run waits on the search until the pages are
+        exhausted or the generator is closed, so a terminated run of the same query never cancels it meanwhile
+        :param search_id: search_id returned from run_search()
+        :return: generator of lists of events, one list per page
+        :raises SearchFailure
+        """
+        try:
+            for events in self.iter_search_result(search_id):
+                yield events
+        finally:
+            self.release_search(search_id)
+
 
 class QRadarClient(object):
 
-    def __init__(self, host, username=None, password=None, token=None, cafile=None):
+    def __init__(self, host, username=None, password=None, token=None, cafile=None, pool_size=None, connect_timeout=None, read_timeout=None):
         """
         Init
         :param host:  QRadar host
@@ -289,9 +694,12 @@ class QRadarClient(object):
         :param password: QRadar password
         :param token: QRadar token
         :param cafile: verify cert or not
+        :param pool_size: keep-alive connections to keep open to QRadar
+        :param connect_timeout: seconds to wait for a connection to QRadar
+        :param read_timeout: seconds to wait for QRadar to send data
         """
         auth_info = AuthInfo.get_authInfo()
-        auth_info.create(host, username, password, token, cafile)
+        auth_info.create(host, username, password, token, cafile, pool_size, connect_timeout, read_timeout)
 
     def check_openssl(self):
         """
@@ -307,20 +715,20 @@ class QRadarClient(object):
         auth_info = AuthInfo.get_authInfo()
 
         url = auth_info.api_url + qradar_constants.HELP_VERSIONS
-        session = requests.Session()
-        response = session.get(url, headers=auth_info.headers, verify=auth_info.cafile)
+        response = auth_info.session.get(url, headers=auth_info.headers, verify=auth_info.cafile, timeout=auth_info.timeout)
 
         return response
 
-    def ariel_search(self, query, range_start=None, range_end=None, timeout=None, wf_bundle=None):
+    @staticmethod
+    def _ariel_search(range_start=None, range_end=None, timeout=None, fetch_concurrency=None, cache_ttl=None):
         """
-        Perform an Ariel search
-        :param query: query string
+        Ariel search with the given range and timeout
         :param range_start: start index of event results to return
         :param range_end: ending index of event results to return
         :param timeout: timeout for search
-        :param wf_bundle: list containing two elements, the Resilient rest_client() and the Resilient workflow_id respectively
-        :return: dict with events
+        :param fetch_concurrency: Range windows of the result to fetch at once
+        :param cache_ttl: seconds a search is reused by runs of the same query
+        :return: ArielSearch
         """
         ariel_search = ArielSearch()
         if range_start is not None:
@@ -332,9 +740,51 @@ class QRadarClient(object):
         if timeout is not None:
             ariel_search.set_timeout(timeout)
 
+        if fetch_concurrency is not None:
+            ariel_search.set_fetch_concurrency(fetch_concurrency)
+
+        if cache_ttl is not None:
+            ariel_search.set_cache_ttl(cache_ttl)
+
+        return ariel_search
+
+    def ariel_search(self, query, range_start=None, range_end=None, timeout=None, wf_bundle=None, fetch_concurrency=None, cache_ttl=None):
+        """
+        Perform an Ariel search
+        :param query: query string
+        :param range_start: start index of event results to return
+        :param range_end: ending index of event results to return
+        :param timeout: timeout for search
+        :param wf_bundle: list containing two elements, the Resilient rest_client() and the Resilient workflow_id respectively
+        :param fetch_concurrency: Range windows of the result to fetch at once, default qradar_constants.RESULT_FETCH_CONCURRENCY
+        :param cache_ttl: seconds a search is reused by runs of the same query, default qradar_constants.SEARCH_CACHE_TTL
+        :return: dict with events
+        """
+        ariel_search = self._ariel_search(range_start, range_end, timeout, fetch_concurrency, cache_ttl)
+
         response = ariel_search.perform_search(query, wf_bundle)
         return response
 
+    def ariel_search_pages(self, query, range_start=None, range_end=None, timeout=None, wf_bundle=None, fetch_concurrency=None, cache_ttl=None):
+        """
+        Perform an Ariel search and page through its events, for results too large to hold in memory at once
+        :param query: query string
+        :param range_start: start index of event results to return
+        :param range_end: ending index of event results to return
+        :param timeout: timeout for search
+        :param wf_bundle: list containing two elements, the Resilient rest_client() and the Resilient workflow_id respectively
+        :param fetch_concurrency: Range windows of the result to fetch at once, default qradar_constants.RESULT_FETCH_CONCURRENCY
+        :param cache_ttl: seconds a search is reused by runs of the same query, default qradar_constants.SEARCH_CACHE_TTL
+        :return: generator of lists of events, one list per page, None returned if workflow is stopped prior to search completion
+        """
+        ariel_search = self._ariel_search(range_start, range_end, timeout, fetch_concurrency, cache_ttl)
+
+        search_id = ariel_search.run_search(query, wf_bundle)
+        if search_id is None:
+            return None
+
+        return ariel_search.iter_search_pages(search_id)
+
     def verify_connect(self):
         """
         QRadar does not support session key. check version to verify
@@ -370,7 +820,7 @@ class QRadarClient(object):
         url = "{}{}".format(auth_info.api_url, qradar_constants.REFERENCE_SET_URL)
         ret = []
         try:
-            response = requests.Session().get(url=url, headers=auth_info.headers, verify=auth_info.cafile)
+            response = auth_info.session.get(url=url, headers=auth_info.headers, verify=auth_info.cafile, timeout=auth_info.timeout)
             #
             # Sample return:
             """
@@ -439,7 +889,7 @@ class QRadarClient(object):
                 parameter = quote('?filter=value="{}"'.format(filter))
                 url = url + parameter
 
-            response = requests.Session().get(url=url, headers=auth_info.headers, verify=auth_info.cafile)
+            response = auth_info.session.get(url=url, headers=auth_info.headers, verify=auth_info.cafile, timeout=auth_info.timeout)
             # Sample return
             #{"creation_time":1523020929069,"timeout_type":"FIRST_SEEN","number_of_elements":2,
             # "data":[{"last_seen":1523020984874,"first_seen":1523020984874,"source":"admin","value":"8.8.8.8"}],
@@ -474,7 +924,7 @@ class QRadarClient(object):
         try:
             data = {"value": quote(value)}
 
-            response = requests.Session().post(url=url, headers=auth_info.headers, data=data, verify=auth_info.cafile)
+            response = auth_info.session.post(url=url, headers=auth_info.headers, data=data, verify=auth_info.cafile, timeout=auth_info.timeout)
 
             ret = {"status_code": response.status_code, "content": response.json()}
 
@@ -499,7 +949,7 @@ class QRadarClient(object):
 
         ret = {}
         try:
-            response = requests.Session().delete(url=url, headers=auth_info.headers, verify=auth_info.cafile)
+            response = auth_info.session.delete(url=url, headers=auth_info.headers, verify=auth_info.cafile, timeout=auth_info.timeout)
 
             ret = {"status_code": response.status_code, "content": response.json()}
 